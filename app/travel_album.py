@@ -0,0 +1,53 @@
+import asyncio
+
+from aiogram.types import Message
+
+from app.travel_database import MediaTypeEnum
+
+# Сколько ждать следующего сообщения альбома, прежде чем считать его полным
+ALBUM_DEBOUNCE = 0.6
+
+album_buffers = {}
+
+
+async def album_middleware(handler, event: Message, data):
+    """Собирает сообщения одного media_group_id и пропускает дальше один раз со всем альбомом.
+
+    Регистрируется как outer middleware диспетчера: альбом собирается до фильтров
+    и лимитов запросов, поэтому фото и видео одного альбома попадают в один хендлер,
+    а лимит считает альбом одним сообщением.
+    """
+    if not isinstance(event, Message) or not event.media_group_id:
+        data["album"] = [event]
+        return await handler(event, data)
+
+    key = (event.chat.id, event.media_group_id)
+    buffer = album_buffers.get(key)
+    if buffer is not None:
+        buffer.append(event)
+        return
+
+    album_buffers[key] = buffer = [event]
+    try:
+        received = 0
+        while received != len(buffer):
+            received = len(buffer)
+            await asyncio.sleep(ALBUM_DEBOUNCE)
+    finally:
+        album_buffers.pop(key, None)
+
+    album = sorted(buffer, key=lambda message: message.message_id)
+    data["album"] = album
+    # Фильтры хендлеров проверяют первое сообщение альбома
+    return await handler(album[0], data)
+
+
+def album_media(album: list[Message]) -> list[tuple[MediaTypeEnum, str]]:
+    """(тип, file_id) всех фото и видео альбома в порядке отправки"""
+    media = []
+    for message in album:
+        if message.photo:
+            media.append((MediaTypeEnum.photo, message.photo[-1].file_id))
+        elif message.video:
+            media.append((MediaTypeEnum.video, message.video.file_id))
+    return media
@@ -0,0 +1,78 @@
+import time
+
+from app.travel_metrics import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """Предохранитель внешней зависимости.
+
+    После failure_threshold ошибок подряд размыкается и reset_timeout секунд
+    сразу отказывает. Затем пропускает один пробный запрос (half-open): успех
+    замыкает цепь, ошибка снова размыкает. Заодно собирает метрики вызовов.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.probe_started = 0.0
+        metrics.register_gauge(f"breaker.{name}.state", lambda: STATE_VALUES[self.state])
+
+    def available(self) -> bool:
+        """Можно ли сейчас обращаться к зависимости (без захвата пробного запроса)"""
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        return not (self.state == HALF_OPEN and self.probe_running())
+
+    def probe_running(self) -> bool:
+        # Пробный запрос, который так и не отчитался (например, отменен), не держит цепь вечно
+        return self.probing and time.monotonic() - self.probe_started < self.reset_timeout
+
+    def allow(self) -> bool:
+        """Разрешает вызов; в half-open пропускает только один пробный"""
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                metrics.inc(f"breaker.{self.name}.rejected")
+                return False
+            self.state = HALF_OPEN
+            self.probing = False
+
+        if self.state == HALF_OPEN:
+            if self.probe_running():
+                metrics.inc(f"breaker.{self.name}.rejected")
+                return False
+            self.probing = True
+            self.probe_started = time.monotonic()
+        return True
+
+    def success(self, seconds: float):
+        metrics.inc(f"http.{self.name}.requests")
+        metrics.observe(f"http.{self.name}.seconds", seconds)
+        if self.state != CLOSED:
+            print(f"✅ {self.name}: зависимость снова доступна")
+        self.state = CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def failure(self, seconds: float, kind: str = "errors"):
+        metrics.inc(f"http.{self.name}.requests")
+        metrics.inc(f"http.{self.name}.{kind}")
+        metrics.observe(f"http.{self.name}.seconds", seconds)
+        self.failures += 1
+        self.probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                metrics.inc(f"breaker.{self.name}.opened")
+                print(f"⚡ {self.name}: предохранитель разомкнут после {self.failures} ошибок")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
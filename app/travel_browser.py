@@ -0,0 +1,237 @@
+import asyncio
+import os
+import tempfile
+import time
+
+import psutil
+from selenium import webdriver
+
+from app.travel_metrics import metrics
+from bot.config import heatmap_width, heatmap_height, browser_name, browser_pool_size, browser_max_renders, \
+    browser_memory_limit_mb, browser_render_timeout, browser_queue_timeout, browser_health_interval, \
+    browser_tiles_wait
+
+# Страница готова, когда загрузились и документ, и все тайлы Leaflet
+TILES_LOADED = """
+return document.readyState === 'complete' &&
+    Array.from(document.querySelectorAll('img.leaflet-tile')).every(img => img.complete);
+"""
+
+
+class BrowserUnavailable(Exception):
+    """Браузер не запускается или все заняты дольше queue_timeout"""
+
+
+class BrowserWorker:
+    def __init__(self, driver):
+        self.driver = driver
+        self.renders = 0
+
+    def memory_mb(self) -> float:
+        """RSS драйвера и всех процессов браузера под ним"""
+        try:
+            root = psutil.Process(self.driver.service.process.pid)
+            processes = [root, *root.children(recursive=True)]
+        except (psutil.Error, AttributeError):
+            return 0.0
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except psutil.Error:
+                pass
+        return total / 1024 / 1024
+
+    def alive(self) -> bool:
+        try:
+            return self.driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            print(f"❌ Ошибка остановки браузера: {e}")
+
+
+def launch_driver():
+    """Запускает headless-браузер под размер картинки карты"""
+    if browser_name == "chrome":
+        options = webdriver.ChromeOptions()
+        options.add_argument("--headless=new")
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+        driver = webdriver.Chrome(options=options)
+    else:
+        options = webdriver.FirefoxOptions()
+        options.add_argument("--headless")
+        driver = webdriver.Firefox(options=options)
+    driver.set_window_size(heatmap_width, heatmap_height)
+    return driver
+
+
+class BrowserPool:
+    """Пул заранее запущенных headless-браузеров для скриншотов карт folium.
+
+    Одновременно работает не больше size браузеров; остальные запросы ждут
+    свободный в очереди не дольше queue_timeout. Браузер перезапускается после
+    max_renders рендеров, при превышении memory_limit_mb и если перестал
+    отвечать на проверке здоровья.
+    """
+
+    def __init__(self, size: int = 2, max_renders: int = 50, memory_limit_mb: float = 600,
+                 render_timeout: float = 20, queue_timeout: float = 30, health_interval: float = 60,
+                 launch=launch_driver):
+        self.size = size
+        self.max_renders = max_renders
+        self.memory_limit_mb = memory_limit_mb
+        self.render_timeout = render_timeout
+        self.queue_timeout = queue_timeout
+        self.health_interval = health_interval
+        self.launch = launch
+        self.idle = asyncio.Queue()
+        self.workers = set()
+        self.starting = 0
+        self.monitor_task = None
+        self.closed = False
+
+    async def start(self):
+        """Прогревает пул: поднимает все браузеры и запускает проверку здоровья"""
+        self.closed = False
+        if self.monitor_task is None:
+            self.monitor_task = asyncio.create_task(self.monitor())
+        await asyncio.gather(*(self.spawn() for _ in range(self.size - len(self.workers) - self.starting)))
+
+    async def spawn(self):
+        self.starting += 1
+        started = time.monotonic()
+        try:
+            driver = await asyncio.to_thread(self.launch)
+        except Exception as e:
+            metrics.inc("browser.launch_errors")
+            print(f"❌ Не удалось запустить браузер: {e}")
+            return
+        finally:
+            self.starting -= 1
+
+        worker = BrowserWorker(driver)
+        if self.closed:
+            await asyncio.to_thread(worker.quit)
+            return
+        metrics.observe("browser.launch_seconds", time.monotonic() - started)
+        self.workers.add(worker)
+        self.idle.put_nowait(worker)
+
+    async def retire(self, worker: BrowserWorker, reason: str):
+        """Останавливает браузер и поднимает замену"""
+        self.workers.discard(worker)
+        metrics.inc(f"browser.recycled.{reason}")
+        await asyncio.to_thread(worker.quit)
+        if not self.closed:
+            asyncio.create_task(self.spawn())
+
+    async def acquire(self) -> BrowserWorker:
+        if not self.workers and not self.starting:
+            # Пул пуст (не прогрет или браузеры не запускаются) - не ждем очередь впустую
+            await self.spawn()
+            if not self.workers:
+                raise BrowserUnavailable("не удалось запустить браузер")
+        elif self.idle.empty() and len(self.workers) + self.starting < self.size:
+            asyncio.create_task(self.spawn())
+
+        started = time.monotonic()
+        try:
+            worker = await asyncio.wait_for(self.idle.get(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.inc("browser.queue_timeouts")
+            raise BrowserUnavailable(f"нет свободного браузера за {self.queue_timeout} с")
+        metrics.observe("browser.queue_wait_seconds", time.monotonic() - started)
+        return worker
+
+    async def render(self, html: str) -> bytes:
+        """PNG-скриншот страницы; ждет свободный браузер в очереди"""
+        worker = await self.acquire()
+        started = time.monotonic()
+        try:
+            png = await asyncio.wait_for(asyncio.to_thread(screenshot, worker.driver, html),
+                                         timeout=self.render_timeout)
+        except asyncio.CancelledError:
+            # Поток со скриншотом продолжает работать - такой браузер в пул не возвращаем
+            asyncio.create_task(self.retire(worker, "cancelled"))
+            raise
+        except Exception:
+            # Браузер мог зависнуть посреди рендера - не возвращаем его в пул
+            metrics.inc("browser.render_errors")
+            await self.retire(worker, "error")
+            raise
+
+        metrics.inc("browser.renders")
+        metrics.observe("browser.render_seconds", time.monotonic() - started)
+        worker.renders += 1
+        # Перезапуск идет в фоне, чтобы не задерживать готовую картинку
+        if worker.renders >= self.max_renders:
+            asyncio.create_task(self.retire(worker, "renders"))
+        elif self.memory_limit_mb and await asyncio.to_thread(worker.memory_mb) > self.memory_limit_mb:
+            asyncio.create_task(self.retire(worker, "memory"))
+        else:
+            self.idle.put_nowait(worker)
+        return png
+
+    async def monitor(self):
+        """Периодически проверяет простаивающие браузеры"""
+        while not self.closed:
+            await asyncio.sleep(self.health_interval)
+            for _ in range(self.idle.qsize()):
+                try:
+                    worker = self.idle.get_nowait()
+                except asyncio.QueueEmpty:
+                    # Пока шла проверка, простаивающие браузеры разобрали рендеры
+                    break
+
+                reason = None
+                try:
+                    if not await asyncio.to_thread(worker.alive):
+                        reason = "health"
+                    elif self.memory_limit_mb and await asyncio.to_thread(worker.memory_mb) > self.memory_limit_mb:
+                        reason = "memory"
+                except Exception as e:
+                    print(f"❌ Ошибка проверки браузера: {e}")
+                finally:
+                    # Здоровый браузер возвращается в пул при любом исходе проверки
+                    if reason is None:
+                        self.idle.put_nowait(worker)
+                if reason is not None:
+                    await self.retire(worker, reason)
+
+    async def close(self):
+        self.closed = True
+        if self.monitor_task is not None:
+            self.monitor_task.cancel()
+            self.monitor_task = None
+        workers, self.workers = list(self.workers), set()
+        while not self.idle.empty():
+            self.idle.get_nowait()
+        await asyncio.gather(*(asyncio.to_thread(worker.quit) for worker in workers))
+
+
+def screenshot(driver, html: str, tiles_wait: float = browser_tiles_wait) -> bytes:
+    """Открывает html и снимает скриншот, как только догрузятся тайлы (но не дольше tiles_wait)"""
+    with tempfile.NamedTemporaryFile('w', suffix='.html', delete=False, encoding='utf-8') as f:
+        f.write(html)
+        path = f.name
+    try:
+        driver.get(f"file://{path}")
+        deadline = time.monotonic() + tiles_wait
+        while time.monotonic() < deadline and not driver.execute_script(TILES_LOADED):
+            time.sleep(0.1)
+        return driver.get_screenshot_as_png()
+    finally:
+        os.unlink(path)
+
+
+browser_pool = BrowserPool(size=browser_pool_size, max_renders=browser_max_renders,
+                           memory_limit_mb=browser_memory_limit_mb, render_timeout=browser_render_timeout,
+                           queue_timeout=browser_queue_timeout, health_interval=browser_health_interval)
+metrics.register_gauge("browser.workers", lambda: len(browser_pool.workers))
+metrics.register_gauge("browser.idle", lambda: browser_pool.idle.qsize())
@@ -0,0 +1,365 @@
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import NamedTuple
+from sqlalchemy import delete, event, select
+from sqlalchemy.orm import Session as OrmSession
+
+from app.travel_database import User, GeocodeResult, Translation, HeatmapResult
+from app.travel_metrics import metrics
+from app.travel_session import Session, ReadSession
+from bot.config import user_cache_size, user_cache_ttl, geocode_cache_size, geocode_hit_ttl, geocode_miss_ttl, \
+    translation_cache_size, heatmap_cache_size, heatmap_cache_max_mb
+
+
+class UserCache:
+    """LRU-кэш пользователей по tg_id с ограниченным временем жизни записи.
+
+    Хранит отсоединенные от сессии объекты User - их можно только читать.
+    Для изменения пользователя загружайте его в своей сессии и после commit
+    вызывайте invalidate(tg_id).
+    """
+
+    def __init__(self, maxsize: int = 2048, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.tg_ids = {}
+
+    def get(self, tg_id: int):
+        item = self.entries.get(tg_id)
+        if item is None:
+            return None
+
+        user, expires_at = item
+        if expires_at < time.monotonic():
+            del self.entries[tg_id]
+            self.tg_ids.pop(user.user_id, None)
+            return None
+
+        self.entries.move_to_end(tg_id)
+        return user
+
+    def put(self, user: User):
+        self.entries[user.tg_id] = (user, time.monotonic() + self.ttl)
+        self.entries.move_to_end(user.tg_id)
+        self.tg_ids[user.user_id] = user.tg_id
+        while len(self.entries) > self.maxsize:
+            _, (evicted, _) = self.entries.popitem(last=False)
+            self.tg_ids.pop(evicted.user_id, None)
+
+    def invalidate(self, *tg_ids: int):
+        for tg_id in tg_ids:
+            item = self.entries.pop(tg_id, None)
+            if item is not None:
+                self.tg_ids.pop(item[0].user_id, None)
+
+    def invalidate_user_ids(self, user_ids):
+        self.invalidate(*(self.tg_ids[user_id] for user_id in user_ids if user_id in self.tg_ids))
+
+    def clear(self):
+        self.entries.clear()
+        self.tg_ids.clear()
+
+    async def resolve(self, tg_id: int):
+        """Возвращает пользователя из кэша или из базы (None, если его нет)"""
+        user = self.get(tg_id)
+        if user is not None:
+            metrics.inc("user_cache.hits")
+            return user
+
+        metrics.inc("user_cache.misses")
+        session = Session()
+        try:
+            user = await session.scalar(select(User).filter_by(tg_id=tg_id))
+        finally:
+            await session.close()
+
+        # Незарегистрированных не кэшируем, чтобы /start сразу увидел новую запись
+        if user is not None:
+            self.put(user)
+        return user
+
+
+user_cache = UserCache(maxsize=user_cache_size, ttl=user_cache_ttl)
+metrics.register_gauge("user_cache.size", lambda: len(user_cache.entries))
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def invalidate_changed_counters(session):
+    """Сбрасывает кэш пользователей, чьи счетчики изменились в транзакции"""
+    user_ids = session.info.pop('counters_changed', None)
+    if user_ids:
+        user_cache.invalidate_user_ids(user_ids)
+
+
+@event.listens_for(OrmSession, 'after_soft_rollback')
+def forget_changed_counters(session, previous_transaction):
+    session.info.pop('counters_changed', None)
+
+
+class GeocodeCache:
+    """Кэш геокодирования: LRU в памяти перед таблицей geocode_cache.
+
+    Значение - (lat, lon) или (None, None) для запомненного пустого ответа.
+    Пустые ответы живут меньше, чтобы новые объекты OSM подхватывались.
+    """
+
+    def __init__(self, maxsize: int = 4096, hit_ttl: float = 30 * 24 * 3600, miss_ttl: float = 24 * 3600):
+        self.maxsize = maxsize
+        self.hit_ttl = hit_ttl
+        self.miss_ttl = miss_ttl
+        self.entries = OrderedDict()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        query = query.lower().replace('ё', 'е')
+        query = re.sub(r'\s*,\s*', ', ', query)
+        return re.sub(r'\s+', ' ', query).strip(' ,')
+
+    def remember(self, key, value, expires_at: float):
+        self.entries[key] = (value, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    async def get(self, query: str, language: str):
+        """Возвращает закэшированный результат или None, если запроса нет в кэше"""
+        key = (self.normalize(query), language)
+        item = self.entries.get(key)
+        if item is not None:
+            value, expires_at = item
+            if expires_at > time.time():
+                self.entries.move_to_end(key)
+                metrics.inc("geocode_cache.hits" if value[0] is not None else "geocode_cache.negative_hits")
+                return value
+            del self.entries[key]
+
+        session = ReadSession()
+        try:
+            row = await session.get(GeocodeResult, key)
+        except Exception as e:
+            print(f"❌ Ошибка чтения кэша геокодирования: {e}")
+            row = None
+        finally:
+            await session.close()
+
+        if row is None or row.expires_at <= datetime.utcnow():
+            metrics.inc("geocode_cache.misses")
+            return None
+
+        value = (row.latitude, row.longitude)
+        self.remember(key, value, time.time() + (row.expires_at - datetime.utcnow()).total_seconds())
+        metrics.inc("geocode_cache.db_hits")
+        metrics.inc("geocode_cache.hits" if value[0] is not None else "geocode_cache.negative_hits")
+        return value
+
+    async def put(self, query: str, language: str, lat, lon):
+        key = (self.normalize(query), language)
+        ttl = self.hit_ttl if lat is not None else self.miss_ttl
+        self.remember(key, (lat, lon), time.time() + ttl)
+
+        session = Session()
+        try:
+            await session.merge(GeocodeResult(
+                query=key[0],
+                language=language,
+                latitude=lat,
+                longitude=lon,
+                created_at=datetime.utcnow(),
+                expires_at=datetime.utcnow() + timedelta(seconds=ttl)
+            ))
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            print(f"❌ Ошибка записи кэша геокодирования: {e}")
+        finally:
+            await session.close()
+
+    async def purge_expired(self) -> int:
+        """Удаляет просроченные строки из geocode_cache"""
+        session = Session()
+        try:
+            result = await session.execute(delete(GeocodeResult).where(GeocodeResult.expires_at <= datetime.utcnow()))
+            await session.commit()
+            print(f"🧹 Кэш геокодирования: удалено {result.rowcount} просроченных записей")
+            return result.rowcount
+        finally:
+            await session.close()
+
+
+geocode_cache = GeocodeCache(maxsize=geocode_cache_size, hit_ttl=geocode_hit_ttl, miss_ttl=geocode_miss_ttl)
+metrics.register_gauge("geocode_cache.size", lambda: len(geocode_cache.entries))
+
+
+class TranslationCache:
+    """Переводы названий: LRU в памяти перед таблицей translation_cache.
+
+    Названия городов и стран не меняются, поэтому записи живут бессрочно.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return ' '.join(text.split())
+
+    def remember(self, key, translated: str):
+        self.entries[key] = translated
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    async def get_many(self, texts, target: str) -> dict:
+        """Найденные переводы {исходный текст: перевод}; память, затем один запрос к базе"""
+        found = {}
+        missing = []
+        for text in texts:
+            key = (self.normalize(text), target)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                found[text] = self.entries[key]
+            else:
+                missing.append(text)
+
+        if missing:
+            session = ReadSession()
+            try:
+                rows = (await session.scalars(select(Translation).where(
+                    Translation.target == target,
+                    Translation.source.in_({self.normalize(text) for text in missing})
+                ))).all()
+            except Exception as e:
+                print(f"❌ Ошибка чтения кэша переводов: {e}")
+                rows = []
+            finally:
+                await session.close()
+
+            stored = {row.source: row.translated for row in rows}
+            for text in missing:
+                translated = stored.get(self.normalize(text))
+                if translated is not None:
+                    self.remember((self.normalize(text), target), translated)
+                    found[text] = translated
+
+        metrics.inc("translation_cache.hits", len(found))
+        metrics.inc("translation_cache.misses", len(texts) - len(found))
+        return found
+
+    async def put_many(self, translations: dict, target: str):
+        for text, translated in translations.items():
+            self.remember((self.normalize(text), target), translated)
+
+        session = Session()
+        try:
+            for text, translated in translations.items():
+                await session.merge(Translation(
+                    source=self.normalize(text),
+                    target=target,
+                    translated=translated,
+                    created_at=datetime.utcnow()
+                ))
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            print(f"❌ Ошибка записи кэша переводов: {e}")
+        finally:
+            await session.close()
+
+
+translation_cache = TranslationCache(maxsize=translation_cache_size)
+metrics.register_gauge("translation_cache.size", lambda: len(translation_cache.entries))
+
+
+class CachedHeatmap(NamedTuple):
+    data_version: int
+    png: bytes | None
+    file_id: str | None
+    caption: str
+
+
+class HeatmapCache:
+    """Готовые тепловые карты по (пользователь, фильтр) для текущей версии его данных.
+
+    В памяти лежат PNG и file_id, в таблице heatmap_cache - только file_id:
+    повторная отправка по file_id не требует ни рендера, ни загрузки картинки.
+    Запись с другой data_version считается устаревшей.
+    """
+
+    def __init__(self, maxsize: int = 512, max_bytes: int = 64 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def forget(self, key):
+        item = self.entries.pop(key, None)
+        if item is not None and item.png:
+            self.total_bytes -= len(item.png)
+
+    def remember(self, key, item: CachedHeatmap):
+        self.forget(key)
+        self.entries[key] = item
+        if item.png:
+            self.total_bytes += len(item.png)
+        while len(self.entries) > self.maxsize or self.total_bytes > self.max_bytes:
+            self.forget(next(iter(self.entries)))
+
+    async def get(self, user_id: int, filter_key: str, data_version: int):
+        key = (user_id, filter_key)
+        item = self.entries.get(key)
+        if item is not None:
+            if item.data_version == data_version:
+                self.entries.move_to_end(key)
+                metrics.inc("heatmap_cache.hits")
+                return item
+            self.forget(key)
+
+        session = ReadSession()
+        try:
+            row = await session.get(HeatmapResult, key)
+        except Exception as e:
+            print(f"❌ Ошибка чтения кэша тепловых карт: {e}")
+            row = None
+        finally:
+            await session.close()
+
+        if row is None or row.data_version != data_version:
+            metrics.inc("heatmap_cache.misses")
+            return None
+
+        item = CachedHeatmap(row.data_version, None, row.file_id, row.caption)
+        self.remember(key, item)
+        metrics.inc("heatmap_cache.db_hits")
+        metrics.inc("heatmap_cache.hits")
+        return item
+
+    async def put(self, user_id: int, filter_key: str, data_version: int, png: bytes, file_id: str, caption: str):
+        self.remember((user_id, filter_key), CachedHeatmap(data_version, png, file_id, caption))
+        if not file_id:
+            return
+
+        session = Session()
+        try:
+            await session.merge(HeatmapResult(
+                user_id=user_id,
+                filter=filter_key,
+                data_version=data_version,
+                file_id=file_id,
+                caption=caption,
+                created_at=datetime.utcnow()
+            ))
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            print(f"❌ Ошибка записи кэша тепловых карт: {e}")
+        finally:
+            await session.close()
+
+
+heatmap_cache = HeatmapCache(maxsize=heatmap_cache_size, max_bytes=int(heatmap_cache_max_mb * 1024 * 1024))
+metrics.register_gauge("heatmap_cache.size", lambda: len(heatmap_cache.entries))
+metrics.register_gauge("heatmap_cache.bytes", lambda: heatmap_cache.total_bytes)
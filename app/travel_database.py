@@ -1,6 +1,8 @@
 import enum
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Enum, BigInteger
-from sqlalchemy.orm import declarative_base
+from collections import Counter, defaultdict
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Enum, BigInteger, Index, Float
+from sqlalchemy import case, event, func, select, update
+from sqlalchemy.orm import declarative_base, Session as OrmSession
 from dotenv import load_dotenv
 from datetime import datetime
 load_dotenv()
@@ -10,7 +12,7 @@ Base = declarative_base()
 class User(Base):
     __tablename__ = 'users'
     user_id = Column(Integer, primary_key=True)
-    tg_id = Column(BigInteger)
+    tg_id = Column(BigInteger, index=True)
     name = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
     premium = Column(Boolean, default=False)
@@ -20,6 +22,8 @@ class User(Base):
     entries_count = Column(Integer, default=0)
     photos_count = Column(Integer, default=0)
     longest_trip = Column(Integer, default=0)
+    # Растет при любом изменении мест и путешествий - ключ кэша тепловых карт
+    data_version = Column(Integer, default=0)
 
 
 class Travel(Base):
@@ -34,6 +38,8 @@ class Travel(Base):
     travel_comment = Column(String)
     travel_rating = Column(Integer)
 
+    __table_args__ = (Index('ix_travels_user_id_start_date', 'user_id', 'start_date'),)
+
 
 class Entry(Base):
     __tablename__ = 'entries'
@@ -42,11 +48,26 @@ class Entry(Base):
     city = Column(String)
     place_title = Column(String)
     place_comment = Column(String)
-    latitude = Column(String)
-    longitude = Column(String)
+    latitude = Column(Float)
+    longitude = Column(Float)
     date = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow)
     place_rating = Column(Integer)
+    # pending - координаты ищет фоновый воркер, failed - не нашлись; None - задано сразу
+    geocode_status = Column(String(16), nullable=True)
+    # ISO-код страны по координатам (офлайн-газеттир)
+    country_code = Column(String(2), nullable=True)
+
+    __table_args__ = (
+        Index('ix_entries_travel_id_date', 'travel_id', 'date'),
+        Index('ix_entries_latitude_longitude', 'latitude', 'longitude'),
+        Index('ix_entries_geocode_status', 'geocode_status'),
+        Index('ix_entries_country_code', 'country_code'),
+    )
+
+
+GEOCODE_PENDING = 'pending'
+GEOCODE_FAILED = 'failed'
 
 
 class MediaTypeEnum(enum.Enum):
@@ -64,6 +85,8 @@ class Media(Base):
     duration = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (Index('ix_media_place_id_media_type', 'place_id', 'media_type'),)
+
 
 class Achievement(Base):
     __tablename__ = 'achievements'
@@ -74,6 +97,8 @@ class Achievement(Base):
     achievement_name = Column(String)
     unlocked_at = Column(DateTime)
 
+    __table_args__ = (Index('ix_achievements_user_id_code', 'user_id', 'code'),)
+
 
 class AchievementList(Base):
     __tablename__ = "achievement_list"
@@ -87,8 +112,135 @@ class UserSettings(Base):
     __tablename__ = 'user_settings'
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.user_id'))
+    user_id = Column(Integer, ForeignKey('users.user_id'), index=True)
     reminders_enabled = Column(Boolean, default=True)
     reminder_frequency = Column(Integer, default=30)
     last_reminder_date = Column(DateTime)
-    created_at = Column(DateTime, default=datetime.now)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class GeocodeResult(Base):
+    """Кэш ответов Nominatim; строка без координат - запомненный пустой ответ"""
+    __tablename__ = 'geocode_cache'
+
+    query = Column(String, primary_key=True)
+    language = Column(String(32), primary_key=True)
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class Translation(Base):
+    """Запомненные переводы названий (LibreTranslate)"""
+    __tablename__ = 'translation_cache'
+
+    source = Column(String, primary_key=True)
+    target = Column(String(8), primary_key=True)
+    translated = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class HeatmapResult(Base):
+    """file_id отправленной тепловой карты: повторный запрос с той же версией данных не рендерится"""
+    __tablename__ = 'heatmap_cache'
+
+    user_id = Column(Integer, ForeignKey('users.user_id'), primary_key=True)
+    filter = Column(String(64), primary_key=True)
+    data_version = Column(Integer, nullable=False)
+    file_id = Column(String, nullable=False)
+    caption = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# Денормализованные счетчики User обновляются в той же транзакции, что и вставка/удаление
+# строк: один UPDATE на пользователя за flush. Расхождения исправляет reconcile_user_counters
+def trip_days(travel):
+    if travel.start_date and travel.end_date:
+        return (travel.end_date - travel.start_date).days
+    return 0
+
+
+def is_photo(media):
+    return media.media_type in (MediaTypeEnum.photo, MediaTypeEnum.photo.value)
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def update_user_counters(session, flush_context):
+    deltas = defaultdict(Counter)
+    trip_lengths = {}
+    entry_signs = []
+    photo_signs = []
+    # Путешествия, чьи места изменились: их владельцам поднимаем data_version
+    touched_travels = set()
+
+    changes = [(obj, 1) for obj in session.new] + [(obj, -1) for obj in session.deleted]
+    for obj, sign in changes:
+        if isinstance(obj, Travel):
+            deltas[obj.user_id]['trip_count'] += sign
+            deltas[obj.user_id]['data_version'] = 1
+            # longest_trip при удалении не уменьшить без полного пересчета - это делает сверка
+            if sign > 0:
+                trip_lengths[obj.user_id] = max(trip_lengths.get(obj.user_id, 0), trip_days(obj))
+        elif isinstance(obj, Entry):
+            entry_signs.append((obj.travel_id, sign))
+            touched_travels.add(obj.travel_id)
+        elif isinstance(obj, Media) and is_photo(obj):
+            photo_signs.append((obj.place_id, sign))
+
+    for obj in session.dirty:
+        if isinstance(obj, Travel) and session.is_modified(obj):
+            deltas[obj.user_id]['data_version'] = 1
+        elif isinstance(obj, Entry) and session.is_modified(obj):
+            touched_travels.add(obj.travel_id)
+
+    if not deltas and not touched_travels and not photo_signs:
+        return
+
+    connection = session.connection()
+
+    if touched_travels:
+        owners = dict(connection.execute(
+            select(Travel.travel_id, Travel.user_id).where(Travel.travel_id.in_(touched_travels))
+        ).all())
+        for travel_id, sign in entry_signs:
+            deltas[owners.get(travel_id)]['entries_count'] += sign
+        for travel_id in touched_travels:
+            deltas[owners.get(travel_id)]['data_version'] = 1
+
+    if photo_signs:
+        owners = dict(connection.execute(
+            select(Entry.place_id, Travel.user_id).join(Travel, Entry.travel_id == Travel.travel_id)
+            .where(Entry.place_id.in_({place_id for place_id, _ in photo_signs}))
+        ).all())
+        for place_id, sign in photo_signs:
+            deltas[owners.get(place_id)]['photos_count'] += sign
+
+    changed = session.info.setdefault('counters_changed', set())
+    for user_id, counter in deltas.items():
+        if user_id is None:
+            continue
+
+        values = {name: func.coalesce(getattr(User, name), 0) + delta for name, delta in counter.items() if delta}
+        trip_length = trip_lengths.get(user_id, 0)
+        if trip_length > 0:
+            longest = func.coalesce(User.longest_trip, 0)
+            values['longest_trip'] = case((longest < trip_length, trip_length), else_=longest)
+
+        if values:
+            connection.execute(update(User).where(User.user_id == user_id).values(**values))
+            changed.add(user_id)
+
+
+async def bump_data_version(session, place_ids):
+    """Поднимает data_version владельцам мест после bulk UPDATE, который идет мимо after_flush"""
+    user_ids = set((await session.scalars(
+        select(Travel.user_id).join(Entry, Entry.travel_id == Travel.travel_id).where(Entry.place_id.in_(place_ids))
+    )).all())
+    if not user_ids:
+        return
+
+    await session.execute(
+        update(User).where(User.user_id.in_(user_ids)).values(data_version=func.coalesce(User.data_version, 0) + 1)
+    )
+    session.info.setdefault('counters_changed', set()).update(user_ids)
@@ -0,0 +1,225 @@
+import asyncio
+import importlib
+import multiprocessing
+import signal
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.travel_metrics import metrics
+from bot.config import executor_workers, executor_queue_size, executor_job_timeout, executor_max_tasks_per_child, \
+    executor_start_method
+
+# Модули с задачами для пула: импортируются в процессе заранее, а не на первой задаче
+PRELOAD = ("app.travel_heatmap", "app.travel_export_utils")
+
+
+class ExecutorBusy(Exception):
+    """Очередь тяжелых задач переполнена"""
+
+
+class JobTimeout(Exception):
+    """Задача не уложилась в свой таймаут"""
+
+
+class JobCancelled(Exception):
+    """Задачу вытеснила более новая с тем же ключом - пользователь запросил то же самое заново"""
+
+
+def prepare_worker(modules):
+    # Ctrl+C обрабатывает родитель, процессы пула просто останавливаются вместе с ним
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            print(f"❌ Процесс пула не смог импортировать {module}: {e}")
+
+
+def warm_up():
+    return None
+
+
+class ProcessExecutor:
+    """Пул процессов для CPU-тяжелых задач: рендер карт, сборка архивов экспорта.
+
+    В процессах одновременно выполняется не больше workers задач, остальные ждут
+    своей очереди в event loop; если ждущих уже queue_size - ExecutorBusy.
+    Отмененная в очереди задача не запускается вовсе, уже запущенная дорабатывает
+    в процессе, но результат выбрасывается. Задача дольше timeout считается
+    зависшей: процессы пула убиваются и поднимаются заново. workers=0 - задачи
+    выполняются в отдельном потоке без процессов.
+
+    Проверка сломанного пула и остановка процессов опираются на приватные
+    _broken и _processes ProcessPoolExecutor из CPython; без них пул только
+    закрывается через shutdown(cancel_futures=True), а зависший процесс дорабатывает сам.
+    """
+
+    def __init__(self, workers: int = 2, queue_size: int = 32, timeout: float = 60,
+                 max_tasks_per_child: int = 0, start_method: str = "spawn", preload=PRELOAD):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        self.start_method = start_method
+        self.preload = preload
+        self.pool = None
+        self.slots = asyncio.Semaphore(max(workers, 1))
+        # Задачи, ждущие слота; считаются сразу при постановке, а не когда задача asyncio начнет работу
+        self.waiting = set()
+        self.running = 0
+        self.jobs = {}
+        self.superseded = set()
+        # Пулы, убитые перезапуском: их BrokenProcessPool - не падение процесса, а чужой таймаут
+        self.terminated = weakref.WeakSet()
+
+    @property
+    def queued(self) -> int:
+        return len(self.waiting)
+
+    def start(self):
+        if self.pool is not None and getattr(self.pool, "_broken", False):
+            self.restart("процесс пула упал")
+        if self.pool is not None:
+            return self.pool
+        if not self.workers:
+            self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="executor")
+            return self.pool
+
+        options = {}
+        # Пересоздание процессов после N задач не работает с fork
+        if self.max_tasks_per_child and self.start_method != "fork":
+            options["max_tasks_per_child"] = self.max_tasks_per_child
+        self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                        mp_context=multiprocessing.get_context(self.start_method),
+                                        initializer=prepare_worker, initargs=(self.preload,), **options)
+        return self.pool
+
+    async def warm(self):
+        """Поднимает процессы заранее: первый пользователь не ждет их запуска и импортов"""
+        started = time.monotonic()
+        try:
+            await asyncio.gather(*(self.run(warm_up) for _ in range(max(self.workers, 1))))
+        except Exception as e:
+            print(f"❌ Не удалось прогреть пул процессов: {e}")
+            return
+        print(f"✅ Пул процессов готов: {self.workers} за {time.monotonic() - started:.1f} с")
+
+    def restart(self, reason: str):
+        """Убивает процессы пула (например, с зависшей задачей) и создает новый пул"""
+        pool, self.pool = self.pool, None
+        metrics.inc("executor.restarts")
+        print(f"🔄 Перезапуск пула процессов: {reason}")
+        if isinstance(pool, ProcessPoolExecutor):
+            if not getattr(pool, "_broken", False):
+                self.terminated.add(pool)
+            # У ProcessPoolExecutor нет публичного способа остановить занятый процесс
+            for process in list((getattr(pool, "_processes", None) or {}).values()):
+                process.terminate()
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self.start()
+
+    def release(self):
+        self.running -= 1
+        self.slots.release()
+
+    async def execute(self, func, args, name: str, timeout: float):
+        queued_at = time.monotonic()
+        await self.slots.acquire()
+        self.waiting.discard(asyncio.current_task())
+        metrics.observe("executor.queue_wait_seconds", time.monotonic() - queued_at)
+
+        loop = asyncio.get_running_loop()
+        self.running += 1
+        try:
+            pool = self.start()
+            future = pool.submit(func, *args)
+        except BaseException:
+            self.release()
+            raise
+
+        def done(_):
+            # Слот освобождается, когда задача действительно закончилась в процессе,
+            # а не когда ее перестали ждать
+            try:
+                loop.call_soon_threadsafe(self.release)
+            except RuntimeError:
+                pass
+
+        future.add_done_callback(done)
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            metrics.inc("executor.timeouts")
+            if self.workers:
+                self.restart(f"{name} дольше {timeout} с")
+            raise JobTimeout(f"задача {name} не уложилась в {timeout:g} с") from None
+        except asyncio.CancelledError:
+            metrics.inc("executor.cancelled")
+            raise
+        except BrokenProcessPool:
+            # Задачи, которые пул потерял при перезапуске из-за чужой зависшей задачи, считаются отдельно
+            metrics.inc("executor.restart_casualties" if pool in self.terminated else "executor.broken")
+            raise
+        except Exception:
+            metrics.inc(f"executor.errors.{name}")
+            raise
+        metrics.inc(f"executor.jobs.{name}")
+        metrics.observe(f"executor.run_seconds.{name}", time.monotonic() - started)
+        return result
+
+    async def run(self, func, *args, name: str = None, key=None, timeout: float = None):
+        """Выполняет func(*args) в пуле и возвращает результат.
+
+        func и аргументы передаются в процесс через pickle. Новая задача с тем же
+        key отменяет предыдущую: та завершается JobCancelled.
+        """
+        name = name or func.__name__
+        timeout = timeout or self.timeout
+        if self.queued >= self.queue_size:
+            metrics.inc("executor.rejected")
+            raise ExecutorBusy("сервер перегружен, попробуйте через минуту")
+
+        if key is not None:
+            previous = self.jobs.get(key)
+            if previous is not None and not previous.done():
+                metrics.inc("executor.superseded")
+                self.superseded.add(previous)
+                previous.cancel()
+
+        for attempt in range(2):
+            job = asyncio.ensure_future(self.execute(func, args, name, timeout))
+            self.waiting.add(job)
+            job.add_done_callback(self.waiting.discard)
+            if key is not None:
+                self.jobs[key] = job
+            try:
+                return await job
+            except asyncio.CancelledError:
+                if job in self.superseded:
+                    raise JobCancelled(f"задача {name} заменена более новой") from None
+                raise
+            except BrokenProcessPool:
+                # Процесс упал (OOM) или пул убили из-за чужой зависшей задачи - повторяем один раз,
+                # сломанный пул перезапустится при отправке
+                if attempt or not self.workers:
+                    raise
+            finally:
+                self.superseded.discard(job)
+                if key is not None and self.jobs.get(key) is job:
+                    del self.jobs[key]
+
+    async def close(self):
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            await asyncio.to_thread(pool.shutdown, wait=True, cancel_futures=True)
+
+
+process_executor = ProcessExecutor(workers=executor_workers, queue_size=executor_queue_size,
+                                   timeout=executor_job_timeout, max_tasks_per_child=executor_max_tasks_per_child,
+                                   start_method=executor_start_method)
+metrics.register_gauge("executor.queued", lambda: process_executor.queued)
+metrics.register_gauge("executor.running", lambda: process_executor.running)
@@ -1,10 +1,130 @@
 import asyncio
-import io
+import os
+import shutil
+import tempfile
 import zipfile
 from datetime import datetime
+from typing import NamedTuple
 from aiogram import Bot
-from sqlalchemy.orm import Session
-from app.travel_database import User, Travel, Entry, Media
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession as Session
+from app.travel_database import User, Travel, Entry, Media, MediaTypeEnum
+from app.travel_executor import process_executor
+from bot.config import export_build_timeout
+
+
+class UserRecord(NamedTuple):
+    user_id: int
+    name: str
+
+
+class TravelRecord(NamedTuple):
+    travel_id: int
+    country: str
+    start_date: datetime
+    end_date: datetime
+    travel_rating: int
+    travel_comment: str
+
+
+class EntryRecord(NamedTuple):
+    place_id: int
+    travel_id: int
+    city: str
+    place_title: str
+    date: datetime
+    place_rating: int
+    place_comment: str
+
+
+class PhotoRecord(NamedTuple):
+    media_id: int
+    place_id: int
+    file_id: str
+
+
+class EntryNode(NamedTuple):
+    entry: Entry
+    photos: tuple
+
+
+class TravelNode(NamedTuple):
+    travel: Travel
+    entries: tuple
+
+    @property
+    def photo_count(self) -> int:
+        return sum(len(node.photos) for node in self.entries)
+
+
+class ExportTree(NamedTuple):
+    """Неизменяемый снимок путешествий пользователя для всех видов экспорта"""
+    user: User
+    travels: tuple
+
+    @property
+    def place_count(self) -> int:
+        return sum(len(node.entries) for node in self.travels)
+
+    @property
+    def photo_count(self) -> int:
+        return sum(node.photo_count for node in self.travels)
+
+    def iter_photos(self):
+        for travel_node in self.travels:
+            for entry_node in travel_node.entries:
+                for photo in entry_node.photos:
+                    yield photo, entry_node.entry, travel_node.travel
+
+
+async def load_export_tree(session: Session, user: User) -> ExportTree:
+    """Загружает путешествия, места и фото пользователя тремя запросами"""
+    travels = (await session.scalars(
+        select(Travel).filter_by(user_id=user.user_id).order_by(Travel.start_date, Travel.travel_id)
+    )).all()
+
+    entries = (await session.scalars(
+        select(Entry).join(Travel, Entry.travel_id == Travel.travel_id)
+        .filter(Travel.user_id == user.user_id)
+        .order_by(Entry.date, Entry.place_id)
+    )).all()
+
+    photos = (await session.scalars(
+        select(Media).join(Entry, Media.place_id == Entry.place_id)
+        .join(Travel, Entry.travel_id == Travel.travel_id)
+        .filter(Travel.user_id == user.user_id, Media.media_type == MediaTypeEnum.photo)
+        .order_by(Media.media_id)
+    )).all()
+
+    photos_by_place = {}
+    for photo in photos:
+        photos_by_place.setdefault(photo.place_id, []).append(photo)
+
+    entries_by_travel = {}
+    for entry in entries:
+        node = EntryNode(entry, tuple(photos_by_place.get(entry.place_id, ())))
+        entries_by_travel.setdefault(entry.travel_id, []).append(node)
+
+    return ExportTree(user, tuple(
+        TravelNode(travel, tuple(entries_by_travel.get(travel.travel_id, ())))
+        for travel in travels
+    ))
+
+
+def detach(obj, record_type):
+    return record_type(*(getattr(obj, field) for field in record_type._fields))
+
+
+def snapshot_tree(tree: ExportTree) -> ExportTree:
+    """То же дерево на простых кортежах вместо объектов ORM - его можно передать в процесс пула"""
+    return ExportTree(detach(tree.user, UserRecord), tuple(
+        TravelNode(detach(travel_node.travel, TravelRecord), tuple(
+            EntryNode(detach(entry_node.entry, EntryRecord),
+                      tuple(detach(photo, PhotoRecord) for photo in entry_node.photos))
+            for entry_node in travel_node.entries
+        ))
+        for travel_node in tree.travels
+    ))
 
 
 async def download_photo(bot: Bot, file_id: str) -> bytes:
@@ -17,47 +137,52 @@ async def download_photo(bot: Bot, file_id: str) -> bytes:
         return None
 
 
+async def download_photo_to(bot: Bot, file_id: str, path: str) -> bool:
+    """Скачивает фото сразу в файл, не держа его в памяти"""
+    try:
+        photo_file = await bot.get_file(file_id)
+        await bot.download_file(photo_file.file_path, destination=path)
+        return True
+    except Exception as e:
+        print(f"❌ Ошибка скачивания фото {file_id}: {e}")
+        return False
+
+
+def photo_archive_name(entry, index: int) -> str:
+    return f"photos/{index:04d}_{entry.place_title}.jpg"
+
+
 async def create_zip_with_photos(
         bot: Bot,
-        user_tg_id: int,
-        session: Session,
+        tree: ExportTree,
         progress_callback=None
-) -> tuple[io.BytesIO, int]:
-    """Создает ZIP архив с фотографиями и возвращает (buffer, photo_count)"""
-    user = session.query(User).filter_by(tg_id=user_tg_id).first()
-    if not user:
-        return None, 0
+) -> tuple[str, int]:
+    """Создает ZIP архив с фотографиями во временном файле и возвращает (путь, photo_count).
 
-    zip_buffer = io.BytesIO()
+    Файл удаляет вызывающий. Фото скачиваются во временную папку, README, HTML
+    и текстовый отчет собираются в пуле процессов, а архив пишется на диск в потоке:
+    байты фото не копируются между процессами и не лежат в памяти.
+    """
+    snapshot = snapshot_tree(tree)
     photo_counter = 0
 
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        # 1. Создаем README
-        zip_file.writestr("README.txt", create_readme(user))
-
-        if progress_callback:
-            await progress_callback(photo_counter, "Подготовка структуры архива")
-
-        # 2. Собираем все фото сначала для подсчета
-        all_photos = []
-        travels = session.query(Travel).filter_by(user_id=user.user_id).all()
+    if progress_callback:
+        await progress_callback(photo_counter, "Подготовка структуры архива")
 
-        for travel in travels:
-            entries = session.query(Entry).filter_by(travel_id=travel.travel_id).all()
-            for entry in entries:
-                photos = session.query(Media).filter_by(place_id=entry.place_id, media_type='photo').all()
-                for photo in photos:
-                    all_photos.append((photo, entry, travel))
+    # 1. Все фото уже собраны в дереве экспорта
+    all_photos = list(snapshot.iter_photos())
 
-        # 3. Скачиваем фото с прогрессом
+    photo_dir = tempfile.mkdtemp(prefix="export_photos_")
+    try:
+        # 2. Скачиваем фото с прогрессом
         downloaded_photos = []
         for i, (photo, entry, travel) in enumerate(all_photos):
             if progress_callback:
                 await progress_callback(i + 1, f"Скачивание фото {i + 1}/{len(all_photos)}")
 
-            photo_data = await download_photo(bot, photo.file_id)
-            if photo_data:
-                downloaded_photos.append((photo_data, entry, travel, i))
+            path = os.path.join(photo_dir, f"{i:04d}.jpg")
+            if await download_photo_to(bot, photo.file_id, path):
+                downloaded_photos.append((path, entry, i))
                 photo_counter += 1
 
             await asyncio.sleep(0.1)  # Задержка между запросами
@@ -65,29 +190,55 @@ async def create_zip_with_photos(
         if progress_callback:
             await progress_callback(len(all_photos), "Создание HTML отчета")
 
-        # 4. Создаем HTML с скачанными фото
-        html_content = await create_html_with_downloaded_photos(user, session, downloaded_photos, zip_file)
-        zip_file.writestr("my_travels.html", html_content)
+        # 3. README, HTML и текстовый отчет собираются в отдельном процессе
+        photos = [(entry, index) for _, entry, index in downloaded_photos]
+        documents = await process_executor.run(build_export_documents, snapshot, photos, name="export_archive",
+                                               key=(snapshot.user.user_id, "export"), timeout=export_build_timeout)
 
-        # 5. Добавляем текстовый отчет
-        text_content = create_text_report(user, session)
-        zip_file.writestr("my_travels.txt", text_content)
+        # 4. Архив пишется на диск в потоке: фото копируются из файлов без сжатия
+        archive_path = await asyncio.to_thread(write_zip_archive, documents, [
+            (path, photo_archive_name(entry, index)) for path, entry, index in downloaded_photos
+        ])
+    finally:
+        shutil.rmtree(photo_dir, ignore_errors=True)
+    return archive_path, photo_counter
 
-    zip_buffer.seek(0)
-    return zip_buffer, photo_counter
 
+def build_export_documents(tree: ExportTree, photos: list) -> list:
+    """[(имя в архиве, текст)] README, HTML и текстового отчета; выполняется в пуле процессов"""
+    return [
+        ("README.txt", create_readme(tree.user)),
+        ("my_travels.html", create_html_with_downloaded_photos(tree, photos)),
+        ("my_travels.txt", create_text_report(tree)),
+    ]
 
-async def create_html_with_downloaded_photos(user: User, session: Session, downloaded_photos: list,
-                                             zip_file: zipfile.ZipFile) -> str:
-    """Создает HTML отчет с уже скачанными фото"""
-    travels = session.query(Travel).filter_by(user_id=user.user_id).all()
+
+def write_zip_archive(documents: list, photos: list) -> str:
+    """Пишет ZIP во временный файл: документы со сжатием, фото [(путь, имя в архиве)] как есть"""
+    fd, archive_path = tempfile.mkstemp(prefix="export_", suffix=".zip")
+    try:
+        with os.fdopen(fd, 'wb') as archive, zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for name, text in documents:
+                zip_file.writestr(name, text)
+            for path, name in photos:
+                # JPEG уже сжат - deflate только тратит CPU
+                zip_file.write(path, name, compress_type=zipfile.ZIP_STORED)
+    except BaseException:
+        os.remove(archive_path)
+        raise
+    return archive_path
+
+
+def create_html_with_downloaded_photos(tree: ExportTree, downloaded_photos: list) -> str:
+    """Создает HTML отчет со ссылками на скачанные фото [(entry, index)]"""
+    user = tree.user
 
     # Группируем фото по entry_id для удобства
     photos_by_entry = {}
-    for photo_data, entry, travel, index in downloaded_photos:
+    for entry, index in downloaded_photos:
         if entry.place_id not in photos_by_entry:
             photos_by_entry[entry.place_id] = []
-        photos_by_entry[entry.place_id].append((photo_data, entry, index))
+        photos_by_entry[entry.place_id].append((entry, index))
 
     html = f"""
     <!DOCTYPE html>
@@ -113,14 +264,14 @@ async def create_html_with_downloaded_photos(user: User, session: Session, downl
         <h1 class="country-header">🗺️ Мои путешествия - {user.name}</h1>
         <div class="stats">
             <p><b>📅 Архив создан:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}</p>
-            <p><b>📊 Всего путешествий:</b> {len(travels)}</p>
+            <p><b>📊 Всего путешествий:</b> {len(tree.travels)}</p>
             <p><b>🖼️ Фотографий в архиве:</b> {len(downloaded_photos)}</p>
         </div>
     """
 
     # Добавляем фото в ZIP и создаем HTML
-    for travel in travels:
-        entries = session.query(Entry).filter_by(travel_id=travel.travel_id).all()
+    for travel_node in tree.travels:
+        travel = travel_node.travel
 
         html += f"""
         <div class="travel">
@@ -130,7 +281,8 @@ async def create_html_with_downloaded_photos(user: User, session: Session, downl
             <p><b>💬 Комментарий:</b> {travel.travel_comment or 'Без комментария'}</p>
         """
 
-        for entry in entries:
+        for entry_node in travel_node.entries:
+            entry = entry_node.entry
             html += f"""
             <div class="place">
                 <h3>📍 {entry.place_title} - {entry.city}</h3>
@@ -144,9 +296,8 @@ async def create_html_with_downloaded_photos(user: User, session: Session, downl
             if entry_photos:
                 html += f'<div class="photos">'
 
-                for photo_data, entry_obj, photo_index in entry_photos:
-                    photo_filename = f"photos/{photo_index:04d}_{entry.place_title}.jpg"
-                    zip_file.writestr(photo_filename, photo_data)
+                for entry_obj, photo_index in entry_photos:
+                    photo_filename = photo_archive_name(entry, photo_index)
 
                     html += f"""
                     <div class="photo-container">
@@ -171,8 +322,8 @@ async def create_html_with_downloaded_photos(user: User, session: Session, downl
     return html
 
 
-async def create_html_report(bot: Bot, user: User, session: Session, zip_file: zipfile.ZipFile) -> str:
-    travels = session.query(Travel).filter_by(user_id=user.user_id).all()
+async def create_html_report(bot: Bot, tree: ExportTree, zip_file: zipfile.ZipFile) -> str:
+    user = tree.user
 
     html = f"""
     <!DOCTYPE html>
@@ -196,13 +347,13 @@ async def create_html_report(bot: Bot, user: User, session: Session, zip_file: z
     <body>
         <h1 class="country-header">🗺️ Мои путешествия - {user.name}</h1>
         <p>📅 Архив создан: {datetime.now().strftime('%d.%m.%Y %H:%M')}</p>
-        <p>📊 Всего путешествий: {len(travels)}</p>
+        <p>📊 Всего путешествий: {len(tree.travels)}</p>
     """
 
     photo_counter = 0
 
-    for travel in travels:
-        entries = session.query(Entry).filter_by(travel_id=travel.travel_id).all()
+    for travel_node in tree.travels:
+        travel = travel_node.travel
 
         html += f"""
         <div class="travel">
@@ -212,7 +363,8 @@ async def create_html_report(bot: Bot, user: User, session: Session, zip_file: z
             <p><b>💬 Комментарий:</b> {travel.travel_comment or 'Без комментария'}</p>
         """
 
-        for entry in entries:
+        for entry_node in travel_node.entries:
+            entry, photos = entry_node
             html += f"""
             <div class="place">
                 <h3>📍 {entry.place_title} - {entry.city}</h3>
@@ -221,7 +373,6 @@ async def create_html_report(bot: Bot, user: User, session: Session, zip_file: z
                 <p><b>💬 Комментарий:</b> {entry.place_comment or 'Без комментария'}</p>
             """
 
-            photos = session.query(Media).filter_by(place_id=entry.place_id, media_type='photo').all()
             if photos:
                 html += '<div class="photos">'
 
@@ -253,8 +404,8 @@ async def create_html_report(bot: Bot, user: User, session: Session, zip_file: z
         <div style="margin-top: 40px; padding: 20px; background: #e3f2fd; border-radius: 10px;">
             <h3>📊 Статистика архива</h3>
             <p>🖼️ Всего фотографий: {photo_counter}</p>
-            <p>🌍 Путешествий: {len(travels)}</p>
-            <p>📍 Мест: {sum(len(session.query(Entry).filter_by(travel_id=t.travel_id).all()) for t in travels)}</p>
+            <p>🌍 Путешествий: {len(tree.travels)}</p>
+            <p>📍 Мест: {tree.place_count}</p>
         </div>
     </body>
     </html>
@@ -263,49 +414,37 @@ async def create_html_report(bot: Bot, user: User, session: Session, zip_file: z
     return html
 
 
-def create_text_report(user: User, session: Session) -> str:
+def create_text_report(tree: ExportTree) -> str:
     """Создает текстовый отчет"""
-    travels = session.query(Travel).filter_by(user_id=user.user_id).all()
-
-    content = f"🚗 АРХИВ ПУТЕШЕСТВИЙ - {user.name}\n"
+    content = f"🚗 АРХИВ ПУТЕШЕСТВИЙ - {tree.user.name}\n"
     content += "=" * 60 + "\n\n"
     content += f"📅 Создан: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\n"
 
-    total_photos = 0
-    total_places = 0
-
-    for travel in travels:
-        entries = session.query(Entry).filter_by(travel_id=travel.travel_id).all()
-        travel_photos = 0
+    for travel_node in tree.travels:
+        travel = travel_node.travel
 
         content += f"🌍 {travel.country}\n"
         content += f"   📅 {travel.start_date} - {travel.end_date}\n"
         content += f"   ⭐ Оценка: {travel.travel_rating or 'Не оценено'}/10\n"
         content += f"   💬 {travel.travel_comment or 'Без комментария'}\n\n"
 
-        for entry in entries:
-            photos_count = session.query(Media).filter_by(
-                place_id=entry.place_id,
-                media_type='photo'
-            ).count()
-            travel_photos += photos_count
+        for entry_node in travel_node.entries:
+            entry = entry_node.entry
+            photos_count = len(entry_node.photos)
 
             content += f"   📍 {entry.place_title} - {entry.city}\n"
             content += f"      📅 {entry.date} | ⭐ {entry.place_rating or 'Не оценено'}/10\n"
             content += f"      💬 {entry.place_comment or 'Без комментария'}\n"
             content += f"      🖼️ Фото: {photos_count}\n\n"
 
-        content += f"   📊 Итого по поездке: {len(entries)} мест, {travel_photos} фото\n"
+        content += f"   📊 Итого по поездке: {len(travel_node.entries)} мест, {travel_node.photo_count} фото\n"
         content += "   " + "─" * 40 + "\n\n"
 
-        total_photos += travel_photos
-        total_places += len(entries)
-
     content += "=" * 60 + "\n"
     content += f"📈 ОБЩАЯ СТАТИСТИКА:\n"
-    content += f"   🌍 Путешествий: {len(travels)}\n"
-    content += f"   📍 Мест: {total_places}\n"
-    content += f"   🖼️ Фотографий: {total_photos}\n"
+    content += f"   🌍 Путешествий: {len(tree.travels)}\n"
+    content += f"   📍 Мест: {tree.place_count}\n"
+    content += f"   🖼️ Фотографий: {tree.photo_count}\n"
 
     return content
 
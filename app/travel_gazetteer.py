@@ -0,0 +1,351 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import urllib.request
+import zipfile
+from pathlib import Path
+
+from typing import NamedTuple
+
+import numpy as np
+from sqlalchemy import event
+
+from app.travel_database import Entry
+from app.travel_metrics import metrics
+from bot.config import gazetteer_dir, gazetteer_index_dir, gazetteer_full_dir, gazetteer_seed_dir, \
+    reverse_geocode_max_km
+
+# Источник - выгрузка городов GeoNames (cities15000.txt и т.п.) и countries.txt
+# с названиями стран. Индекс собирается в .npy и открывается через mmap
+INDEX_ARRAYS = ('keys', 'cities', 'lat', 'lon', 'country', 'population', 'grid_cells', 'grid_offsets', 'grid_cities')
+INDEX_VERSION = 2
+
+# Сетка для обратного геокодирования: ячейки 1x1 градус
+GRID_COLUMNS = 360
+
+GEONAMES_URL = "https://download.geonames.org/export/dump"
+# Меньше городов - это встроенный образец, а не выгрузка GeoNames: обратное геокодирование
+# находит только крупные города
+FULL_INDEX_MIN_CITIES = 10000
+
+# Названия на других алфавитах пользователи не вводят - их не индексируем
+NAME_RE = re.compile(r"^[\w\s\-'.,()]+$")
+FOREIGN_SCRIPT_RE = re.compile(r'[^\u0000-ɏЀ-ӿ]')
+CYRILLIC_RE = re.compile('[а-яА-ЯёЁ]')
+
+
+def normalize_name(name: str) -> str:
+    name = name.lower().replace('ё', 'е').replace('-', ' ')
+    return re.sub(r'\s+', ' ', name).strip(' .,')
+
+
+def name_hash(name: str) -> int:
+    digest = hashlib.blake2b(normalize_name(name).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def indexable(name: str) -> bool:
+    return bool(name) and bool(NAME_RE.match(name)) and not FOREIGN_SCRIPT_RE.search(name)
+
+
+def display_name(names) -> str:
+    """Русское название, если оно есть среди вариантов, иначе первое"""
+    return next((name for name in names if CYRILLIC_RE.search(name)), names[0])
+
+
+def grid_cell(lat, lon):
+    row = np.clip(np.floor(np.asarray(lat, dtype=np.float64)) + 90, 0, 179).astype(np.int32)
+    column = (np.floor(np.asarray(lon, dtype=np.float64)).astype(np.int32) + 180) % GRID_COLUMNS
+    return row * GRID_COLUMNS + column
+
+
+def save_array(path: Path, array):
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+def build_index(source_dir: Path, index_dir: Path):
+    """Собирает индекс: отсортированные хэши названий -> номер города -> координаты"""
+    codes = []
+    country_names = {}
+    country_display = {}
+    with open(source_dir / 'countries.txt', encoding='utf-8') as f:
+        for line in f:
+            code, _, names = line.rstrip('\n').partition('\t')
+            if not code:
+                continue
+            codes.append(code)
+            country_display[code] = display_name(names.split(',')) if names else code
+            for name in [code, *names.split(',')]:
+                country_names[normalize_name(name)] = code
+
+    code_ids = {code: i for i, code in enumerate(codes)}
+    lat, lon, country, population = [], [], [], []
+    keys, cities, city_names = [], [], []
+    with open(source_dir / 'cities.txt', encoding='utf-8') as f:
+        for line in f:
+            columns = line.rstrip('\n').split('\t')
+            if len(columns) < 15:
+                continue
+
+            code = columns[8]
+            if code not in code_ids:
+                code_ids[code] = len(codes)
+                codes.append(code)
+
+            city = len(lat)
+            lat.append(float(columns[4]))
+            lon.append(float(columns[5]))
+            country.append(code_ids[code])
+            population.append(int(columns[14] or 0))
+
+            city_names.append(display_name([columns[1], *columns[3].split(',')]))
+            names = {columns[1], columns[2], *columns[3].split(',')}
+            for key in {name_hash(name) for name in names if indexable(name)}:
+                keys.append(key)
+                cities.append(city)
+
+    keys = np.array(keys, dtype=np.uint64)
+    order = np.argsort(keys, kind='stable')
+
+    # Города, разложенные по ячейкам сетки: grid_cells[i] занимает grid_cities[offsets[i]:offsets[i + 1]]
+    cells = grid_cell(lat, lon)
+    by_cell = np.argsort(cells, kind='stable')
+    grid_cells, counts = np.unique(cells[by_cell], return_counts=True)
+
+    arrays = {
+        'keys': keys[order],
+        'cities': np.array(cities, dtype=np.uint32)[order],
+        'lat': np.array(lat, dtype=np.float32),
+        'lon': np.array(lon, dtype=np.float32),
+        'country': np.array(country, dtype=np.uint16),
+        'population': np.array(population, dtype=np.uint32),
+        'grid_cells': grid_cells.astype(np.int32),
+        'grid_offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.uint32),
+        'grid_cities': by_cell.astype(np.uint32),
+    }
+
+    index_dir.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        save_array(index_dir / f'{name}.npy', array)
+
+    # countries.json пишется последним и служит меткой готового индекса
+    meta = index_dir / 'countries.json'
+    tmp = meta.with_suffix('.tmp')
+    tmp.write_text(json.dumps({
+        'version': INDEX_VERSION,
+        'codes': codes,
+        'names': country_names,
+        'display': country_display,
+        'cities': city_names,
+    }, ensure_ascii=False), encoding='utf-8')
+    os.replace(tmp, meta)
+    print(f"🗺️ Индекс газеттира собран: {len(lat)} городов, {len(keys)} названий")
+
+
+def download(url: str) -> bytes:
+    print(f"⬇️ {url}")
+    request = urllib.request.Request(url, headers={"User-Agent": "TravelBot/1.0"})
+    with urllib.request.urlopen(request, timeout=120) as response:
+        return response.read()
+
+
+def download_geonames(dest: Path, dataset: str = "cities15000"):
+    """Скачивает выгрузку городов GeoNames и собирает из нее индекс в dest/index.
+
+    Русские названия стран берутся из встроенного countries.txt, остальные
+    страны получают английское название из countryInfo.txt.
+    """
+    dest.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(io.BytesIO(download(f"{GEONAMES_URL}/{dataset}.zip"))) as archive:
+        cities = archive.read(f"{dataset}.txt")
+
+    countries = {}
+    with open(Path(gazetteer_seed_dir) / 'countries.txt', encoding='utf-8') as f:
+        for line in f:
+            code, _, names = line.rstrip('\n').partition('\t')
+            if code:
+                countries[code] = names.split(',') if names else []
+    for line in download(f"{GEONAMES_URL}/countryInfo.txt").decode('utf-8').splitlines():
+        columns = line.split('\t')
+        if line.startswith('#') or len(columns) < 5:
+            continue
+        names = countries.setdefault(columns[0], [])
+        if columns[4] not in names:
+            names.append(columns[4])
+
+    # countries.txt раньше cities.txt: по cities.txt конфиг понимает, что полный справочник на месте
+    tmp = dest / 'countries.tmp'
+    tmp.write_text(''.join(f"{code}\t{','.join(names)}\n" for code, names in countries.items()), encoding='utf-8')
+    os.replace(tmp, dest / 'countries.txt')
+    tmp = dest / 'cities.tmp'
+    tmp.write_bytes(cities)
+    os.replace(tmp, dest / 'cities.txt')
+    build_index(dest, dest / 'index')
+
+
+class Place(NamedTuple):
+    country_code: str
+    country: str
+    city: str
+    distance_km: float
+
+
+class Gazetteer:
+    """Офлайн-справочник городов: город и страна -> координаты без сети"""
+
+    def __init__(self, source_dir, index_dir):
+        self.source_dir = Path(source_dir)
+        self.index_dir = Path(index_dir)
+        self.arrays = None
+        self.codes = []
+        self.code_ids = {}
+        self.country_names = {}
+        self.country_display = {}
+        self.city_names = []
+
+    def load(self):
+        if self.arrays is not None:
+            return
+
+        sources = [self.source_dir / 'cities.txt', self.source_dir / 'countries.txt']
+        if not all(source.exists() for source in sources):
+            print(f"❌ Газеттир не найден в {self.source_dir}")
+            self.arrays = {}
+            return
+
+        meta = self.index_dir / 'countries.json'
+        if not meta.exists() or meta.stat().st_mtime < max(source.stat().st_mtime for source in sources):
+            build_index(self.source_dir, self.index_dir)
+
+        info = json.loads(meta.read_text(encoding='utf-8'))
+        if info.get('version') != INDEX_VERSION:
+            build_index(self.source_dir, self.index_dir)
+            info = json.loads(meta.read_text(encoding='utf-8'))
+
+        self.codes = info['codes']
+        self.code_ids = {code: i for i, code in enumerate(self.codes)}
+        self.country_names = info['names']
+        self.country_display = info['display']
+        self.city_names = info['cities']
+        self.arrays = {name: np.load(self.index_dir / f'{name}.npy', mmap_mode='r') for name in INDEX_ARRAYS}
+        if not self.full:
+            print(f"⚠️ В газеттире всего {len(self.city_names)} городов ({self.source_dir}): обратное геокодирование "
+                  f"найдет только крупные города. Полный справочник: python -m app.travel_gazetteer download")
+
+    @property
+    def full(self) -> bool:
+        """Загружена настоящая выгрузка GeoNames, а не встроенный образец"""
+        self.load()
+        return len(self.city_names) >= FULL_INDEX_MIN_CITIES
+
+    def country_code(self, country: str):
+        self.load()
+        return self.country_names.get(normalize_name(country)) if country else None
+
+    def lookup(self, city: str, country: str = None):
+        """Координаты самого крупного города с таким названием (в стране, если она известна)"""
+        self.load()
+        if not self.arrays or not city:
+            return None, None
+
+        metrics.inc("gazetteer.lookups")
+        keys = self.arrays['keys']
+        key = np.uint64(name_hash(city))
+        lo = np.searchsorted(keys, key, side='left')
+        hi = np.searchsorted(keys, key, side='right')
+        if lo == hi:
+            return None, None
+
+        candidates = np.asarray(self.arrays['cities'][lo:hi])
+        code = self.country_code(country)
+        if code is not None:
+            candidates = candidates[self.arrays['country'][candidates] == self.code_ids[code]]
+            if not len(candidates):
+                return None, None
+
+        best = candidates[np.argmax(self.arrays['population'][candidates])]
+        metrics.inc("gazetteer.hits")
+        return float(self.arrays['lat'][best]), float(self.arrays['lon'][best])
+
+    def nearby(self, lat: float, lon: float, radius: int):
+        """Номера городов в ячейках сетки вокруг точки (radius ячеек в каждую сторону)"""
+        rows = np.arange(int(np.floor(lat)) - radius, int(np.floor(lat)) + radius + 1)
+        columns = np.arange(int(np.floor(lon)) - radius, int(np.floor(lon)) + radius + 1)
+        rows = rows[(rows >= -90) & (rows < 90)]
+        cells = np.unique(grid_cell(np.repeat(rows, len(columns)), np.tile(columns, len(rows))))
+
+        grid_cells = self.arrays['grid_cells']
+        positions = np.searchsorted(grid_cells, cells)
+        found = positions < len(grid_cells)
+        found[found] = grid_cells[positions[found]] == cells[found]
+        positions = positions[found]
+        if not len(positions):
+            return np.empty(0, dtype=np.uint32)
+
+        offsets = self.arrays['grid_offsets']
+        return np.concatenate([self.arrays['grid_cities'][offsets[p]:offsets[p + 1]] for p in positions])
+
+    def reverse(self, lat: float, lon: float, max_km: float = reverse_geocode_max_km):
+        """Ближайший город к точке не дальше max_km или None - без обращения к сети"""
+        self.load()
+        if not self.arrays or lat is None or lon is None:
+            return None
+
+        metrics.inc("gazetteer.reverse_lookups")
+        # Градус широты ~111 км; долготные ячейки у полюсов уже, поэтому радиус берем с запасом
+        radius = int(max_km / (111 * max(np.cos(np.radians(lat)), 0.05))) + 1
+        candidates = self.nearby(lat, lon, min(radius, 180))
+        if not len(candidates):
+            return None
+
+        lat1, lon1 = np.radians(lat), np.radians(lon)
+        lat2 = np.radians(self.arrays['lat'][candidates].astype(np.float64))
+        lon2 = np.radians(self.arrays['lon'][candidates].astype(np.float64))
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        distances = 6371 * 2 * np.arcsin(np.sqrt(a))
+
+        nearest = int(np.argmin(distances))
+        if distances[nearest] > max_km:
+            return None
+
+        city = int(candidates[nearest])
+        code = self.codes[int(self.arrays['country'][city])]
+        metrics.inc("gazetteer.reverse_hits")
+        return Place(code, self.country_display.get(code, code), self.city_names[city], float(distances[nearest]))
+
+    def country_code_at(self, lat, lon):
+        place = self.reverse(lat, lon)
+        return place.country_code if place else None
+
+
+gazetteer = Gazetteer(gazetteer_dir, gazetteer_index_dir)
+
+
+@event.listens_for(Entry, 'before_insert')
+def fill_country_code(mapper, connection, entry):
+    """Код страны новых мест с координатами берется из газеттира"""
+    if entry.country_code is None and entry.latitude is not None:
+        entry.country_code = gazetteer.country_code_at(entry.latitude, entry.longitude)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Индекс офлайн-газеттира")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("build", help="пересобрать индекс из GAZETTEER_DIR (по умолчанию)")
+    download_parser = commands.add_parser("download", help="скачать города GeoNames и собрать индекс")
+    download_parser.add_argument("--dataset", default="cities15000",
+                                 choices=["cities500", "cities1000", "cities5000", "cities15000"],
+                                 help="выгрузка GeoNames: города с населением от N человек")
+    download_parser.add_argument("--dest", default=os.getenv("GAZETTEER_DIR", gazetteer_full_dir))
+    args = parser.parse_args()
+
+    if args.command == "download":
+        download_geonames(Path(args.dest), args.dataset)
+    else:
+        build_index(Path(gazetteer_dir), Path(gazetteer_index_dir))
@@ -1,9 +1,371 @@
-from geopy.geocoders import Nominatim
+import asyncio
+import math
+import re
+from collections import Counter
 
-geolocator = Nominatim(user_agent="travel_bot")
+import aiohttp
 
-def geocode_place(place_name: str):
-    location = geolocator.geocode(place_name)
-    if location:
-        return location.latitude, location.longitude
-    return None, None
+from app.travel_breaker import CircuitBreaker
+from app.travel_cache import geocode_cache, translation_cache
+from app.travel_gazetteer import gazetteer, normalize_name
+from app.travel_http import get_http_session
+from app.travel_metrics import metrics
+from app.travel_nominatim import NominatimScheduler, INTERACTIVE
+from bot.config import mail, nominatim_url, libretranslate_url, geocode_request_timeout, geocode_budget, translate_timeout, nominatim_interval, \
+    geocode_concurrency, geocode_max_city_distance_km, breaker_failure_threshold, breaker_reset_timeout
+
+NOMINATIM_URL = nominatim_url
+NOMINATIM_LANGUAGE = "ru,en"
+LIBRETRANSLATE_URL = libretranslate_url
+
+# Ответы, означающие, что сервис сейчас недоступен для нас (а не ошибку в запросе)
+UNAVAILABLE_STATUSES = {403, 429}
+
+nominatim_breaker = CircuitBreaker("nominatim", breaker_failure_threshold, breaker_reset_timeout)
+libretranslate_breaker = CircuitBreaker("libretranslate", breaker_failure_threshold, breaker_reset_timeout)
+
+
+def geocoder_available() -> bool:
+    """False, пока предохранитель Nominatim разомкнут - сеть не поможет, только кэш и газеттир"""
+    return nominatim_breaker.available()
+
+
+async def fetch_translations(texts: list, target_lang: str, timeout: float):
+    """Один запрос к LibreTranslate на весь список строк; None при ошибке"""
+    if not libretranslate_breaker.allow():
+        return None
+
+    data = {
+        "q": texts,
+        "source": "auto",
+        "target": target_lang,
+        "format": "text"
+    }
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        async with get_http_session().post(
+                LIBRETRANSLATE_URL, json=data, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            if response.status != 200:
+                print(f"❌ LibreTranslate error: {response.status}")
+                if response.status >= 500 or response.status in UNAVAILABLE_STATUSES:
+                    libretranslate_breaker.failure(loop.time() - started)
+                else:
+                    libretranslate_breaker.success(loop.time() - started)
+                return None
+
+            translated = (await response.json()).get('translatedText')
+            libretranslate_breaker.success(loop.time() - started)
+            if isinstance(translated, str):
+                translated = [translated]
+            if not isinstance(translated, list) or len(translated) != len(texts):
+                print(f"❌ LibreTranslate: неожиданный ответ {translated!r}")
+                return None
+            return translated
+
+    except asyncio.TimeoutError:
+        libretranslate_breaker.failure(loop.time() - started, "timeouts")
+        print(f"❌ LibreTranslate timeout для {texts}")
+        return None
+    except Exception as e:
+        libretranslate_breaker.failure(loop.time() - started)
+        print(f"❌ Translation failed: {e}")
+        return None
+
+
+async def translate_many(texts: list, target_lang='en', timeout: float = translate_timeout) -> list:
+    """Переводит список строк: кэш, затем один запрос к LibreTranslate на все недостающие"""
+    unique = list(dict.fromkeys(text for text in texts if text and text.strip()))
+    if not unique:
+        return list(texts)
+
+    found = await translation_cache.get_many(unique, target_lang)
+    missing = [text for text in unique if text not in found]
+    if missing:
+        metrics.inc("translate.requests")
+        translated = await fetch_translations(missing, target_lang, timeout)
+        if translated is not None:
+            fresh = dict(zip(missing, translated))
+            await translation_cache.put_many(fresh, target_lang)
+            found.update(fresh)
+
+    return [found.get(text, text) for text in texts]
+
+
+async def translate_text(text, target_lang='en', timeout: float = translate_timeout):
+    return (await translate_many([text], target_lang, timeout))[0]
+
+
+async def translate_text_safe(text, target_lang='en', timeout: float = translate_timeout):
+    if not text or text.strip() == "":
+        return text
+    try:
+        return await translate_text(text, target_lang, timeout)
+    except Exception:
+        return text
+
+
+def has_cyrillic(text):
+    return bool(re.search('[а-яА-Я]', text)) if text else False
+
+
+async def try_nominatim(query, timeout: float = geocode_request_timeout, priority: int = INTERACTIVE):
+    cached = await geocode_cache.get(query, NOMINATIM_LANGUAGE)
+    if cached is not None:
+        return cached
+
+    # Nominatim недоступен - не ждем очередь, отвечают только кэш и офлайн-уровни
+    if not nominatim_breaker.available():
+        return None, None
+
+    result = await nominatim_scheduler.request(geocode_cache.normalize(query), query, priority, timeout)
+    return result if result is not None else (None, None)
+
+
+async def fetch_and_cache(query, timeout: float):
+    result = await fetch_nominatim(query, timeout)
+    # Ошибки и таймауты не кэшируем - только ответы Nominatim
+    if result is not None:
+        await geocode_cache.put(query, NOMINATIM_LANGUAGE, *result)
+    return result
+
+
+async def fetch_nominatim(query, timeout: float):
+    """Запрос к Nominatim: (lat, lon), (None, None) если ничего не найдено, None при ошибке"""
+    if not nominatim_breaker.allow():
+        return None
+
+    params = {
+        "q": query,
+        "format": "json",
+        "limit": 1,
+        "addressdetails": 1,
+        "accept-language": NOMINATIM_LANGUAGE
+    }
+    headers = {
+        "User-Agent": f"TravelBot/1.0 ({mail})",
+        "Accept-Language": "ru-RU,ru;q=0.9,en;q=0.8"
+    }
+
+    print(f"🔍 Nominatim запрос: {query}")
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        async with get_http_session().get(
+                NOMINATIM_URL, params=params, headers=headers,
+                timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            if response.status != 200:
+                print(f"❌ Nominatim error {response.status}: {(await response.text())[:200]}")
+                if response.status >= 500 or response.status in UNAVAILABLE_STATUSES:
+                    nominatim_breaker.failure(loop.time() - started)
+                else:
+                    nominatim_breaker.success(loop.time() - started)
+                return None
+
+            data = await response.json(content_type=None)
+            nominatim_breaker.success(loop.time() - started)
+            if not data:
+                print(f"❌ Nominatim: нет результатов для '{query}'")
+                return None, None
+
+            result = data[0]
+            lat = float(result['lat'])
+            lon = float(result['lon'])
+            display_name = result.get('display_name', 'N/A')[:100]
+            print(f"✅ Найдено: {lat}, {lon} -> {display_name}")
+            return lat, lon
+
+    except asyncio.TimeoutError:
+        nominatim_breaker.failure(loop.time() - started, "timeouts")
+        print(f"❌ Nominatim timeout для '{query}'")
+        return None
+    except Exception as e:
+        nominatim_breaker.failure(loop.time() - started)
+        print(f"❌ Nominatim failed для '{query}': {e}")
+        return None
+
+
+nominatim_scheduler = NominatimScheduler(fetch_and_cache, interval=nominatim_interval, available=geocoder_available)
+metrics.register_gauge("nominatim.queue_depth", lambda: nominatim_scheduler.queue.qsize())
+metrics.register_gauge("nominatim.inflight", lambda: len(nominatim_scheduler.inflight))
+
+
+async def geocode_place(query):
+    if not query or query.strip() == "":
+        return None, None
+
+    return await try_nominatim(query)
+
+
+def build_queries(country, city, place_title):
+    """Варианты запроса (имя варианта, строка) в исходном порядке приоритета"""
+    queries = []
+    if country and city and place_title:
+        queries.extend([
+            ("country_city_place", f"{country}, {city}, {place_title}"),
+            ("city_country_place", f"{city}, {country}, {place_title}"),
+            ("place_city_country", f"{place_title}, {city}, {country}"),
+        ])
+    if city and place_title:
+        queries.extend([
+            ("city_place", f"{city}, {place_title}"),
+            ("place_city", f"{place_title}, {city}"),
+        ])
+    if place_title:
+        queries.append(("place", place_title))
+    return queries
+
+
+async def build_translated_queries(country, city, place_title, timeout: float):
+    """Варианты запроса на английском; все кириллические поля переводятся одним запросом"""
+    fields = [place_title, city, country]
+    cyrillic = [field for field in fields if has_cyrillic(field)]
+    translated = dict(zip(cyrillic, await translate_many(cyrillic, timeout=timeout)))
+    place_en, city_en, country_en = (translated.get(field, field) for field in fields)
+    if place_en == place_title:
+        return []
+    return [
+        ("en_country_city_place", f"{country_en}, {city_en}, {place_en}"),
+        ("en_city_place", f"{city_en}, {place_en}"),
+        ("en_place", place_en)
+    ]
+
+
+class VariantStats:
+    """Сколько раз вариант запроса доходил до ответа и сколько раз побеждал"""
+
+    def __init__(self):
+        self.attempts = Counter()
+        self.wins = Counter()
+
+    def score(self, variant: str) -> float:
+        # Оценка Лапласа: новые варианты стартуют с 0.5 и не теряют исходный порядок
+        return (self.wins[variant] + 1) / (self.attempts[variant] + 2)
+
+    def rank(self, candidates):
+        return sorted(candidates, key=lambda candidate: -self.score(candidate[0]))
+
+    def attempt(self, variant: str):
+        self.attempts[variant] += 1
+        metrics.inc(f"geocode.variant_attempts.{variant}")
+
+    def win(self, variant: str):
+        self.wins[variant] += 1
+        metrics.inc(f"geocode.variant_wins.{variant}")
+
+
+variant_stats = VariantStats()
+
+
+def distance_km(lat1, lon1, lat2, lon2) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371 * 2 * math.asin(math.sqrt(a))
+
+
+def plausible(lat, lon, center) -> bool:
+    """Ответ не дальше geocode_max_city_distance_km от центра города из газеттира (если проверка включена)"""
+    if not geocode_max_city_distance_km or center[0] is None:
+        return True
+    return distance_km(lat, lon, *center) <= geocode_max_city_distance_km
+
+
+def gazetteer_fallback(country, city):
+    """Координаты центра города из офлайн-газеттира, когда сеть ничего не дала"""
+    lat, lon = gazetteer.lookup(city, country)
+    if lat is not None:
+        metrics.inc("geocode.gazetteer_fallbacks")
+        print(f"📍 Координаты города из офлайн-газеттира: {city} -> {lat}, {lon}")
+    return lat, lon
+
+
+async def geocoding(country, city, place_title, budget: float = geocode_budget, priority: int = INTERACTIVE):
+    """Ищет координаты места, перебирая варианты запроса в пределах общего бюджета времени"""
+    print(f"🎯 Геокодируем: {country}, {city}, {place_title}")
+
+    # Место - сам город: газеттир отвечает без сети
+    if city and (not place_title or normalize_name(place_title) == normalize_name(city)):
+        lat, lon = gazetteer.lookup(city, country)
+        if lat is not None:
+            return lat, lon
+
+    found = await geocode_candidates(country, city, place_title, budget, priority)
+    if found is None:
+        return gazetteer_fallback(country, city)
+
+    lat, lon, variant = found
+    print(f"🏁 Координаты дал вариант {variant}")
+    return lat, lon
+
+
+async def geocode_candidates(country, city, place_title, budget: float = geocode_budget,
+                             priority: int = INTERACTIVE):
+    """Параллельно проверяет лучшие варианты запроса и возвращает (lat, lon, вариант) первого годного.
+
+    Одновременно идет не больше geocode_concurrency запросов; остальные отменяются,
+    как только найден первый годный ответ.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + budget
+    center = gazetteer.lookup(city, country) if city and geocode_max_city_distance_km else (None, None)
+    candidates = variant_stats.rank(build_queries(country, city, place_title))
+    need_translation = has_cyrillic(place_title) or has_cyrillic(city)
+    running = {}
+    seen = set()
+    order = 0
+
+    def launch():
+        nonlocal order
+        while candidates and len(running) < geocode_concurrency:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            variant, query = candidates.pop(0)
+            key = geocode_cache.normalize(query)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            task = asyncio.create_task(
+                try_nominatim(query, timeout=min(geocode_request_timeout, remaining), priority=priority))
+            running[task] = (order, variant)
+            order += 1
+
+    try:
+        launch()
+        while running or candidates or need_translation:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                metrics.inc("geocode.budget_exhausted")
+                print(f"⏱️ Бюджет геокодирования исчерпан: {place_title}")
+                return None
+
+            if not running:
+                if candidates:
+                    launch()
+                    continue
+                # Русские варианты ничего не дали - добавляем английские
+                need_translation = False
+                translated = await build_translated_queries(
+                    country, city, place_title, timeout=min(translate_timeout, remaining))
+                candidates.extend(variant_stats.rank(translated))
+                launch()
+                continue
+
+            done, _ = await asyncio.wait(running, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=lambda t: running[t][0]):
+                _, variant = running.pop(task)
+                variant_stats.attempt(variant)
+                lat, lon = task.result()
+                if not (lat and lon):
+                    continue
+                if not plausible(lat, lon, center):
+                    metrics.inc("geocode.implausible")
+                    print(f"❌ Ответ для варианта {variant} слишком далеко от города {city}: {lat}, {lon}")
+                    continue
+                variant_stats.win(variant)
+                return lat, lon, variant
+            launch()
+        return None
+    finally:
+        for task in running:
+            task.cancel()
@@ -0,0 +1,192 @@
+import asyncio
+from typing import NamedTuple
+
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from sqlalchemy import select, update
+
+from app.travel_database import Entry, Travel, GEOCODE_PENDING, GEOCODE_FAILED, bump_data_version
+from app.travel_gazetteer import gazetteer
+from app.travel_geocode import geocoding
+from app.travel_metrics import metrics
+from app.travel_nominatim import INTERACTIVE, BACKGROUND
+from app.travel_session import Session
+from bot.config import geocode_workers, geocode_queue_size, geocode_retries, geocode_retry_delay
+
+
+class GeocodeJob(NamedTuple):
+    place_id: int
+    country: str
+    city: str
+    place_title: str
+    chat_id: int = None
+    message_id: int = None
+    priority: int = INTERACTIVE
+    attempt: int = 0
+
+
+class GeocodeWorker:
+    """Фоновое определение координат для мест, сохраненных со статусом pending.
+
+    Найденные координаты записываются в Entry, а сообщение о статусе у пользователя
+    редактируется. После перезапуска незавершенные места подбираются из базы.
+    Упавшее задание повторяется до retries раз, потом место помечается failed.
+    """
+
+    def __init__(self, workers: int = 2, queue_size: int = 1000, retries: int = 2, retry_delay: float = 30):
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.tasks = []
+        self.bot = None
+
+    def start(self, bot):
+        self.bot = bot
+        self.tasks = [asyncio.create_task(self.run()) for _ in range(self.workers)]
+        asyncio.create_task(self.requeue_pending())
+
+    def submit(self, job: GeocodeJob) -> bool:
+        """Ставит задание в очередь; False, если очередь переполнена"""
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            metrics.inc("geocode_worker.rejected")
+            return False
+        metrics.inc("geocode_worker.submitted")
+        return True
+
+    async def requeue_pending(self):
+        session = Session()
+        try:
+            rows = (await session.execute(
+                select(Entry.place_id, Travel.country, Entry.city, Entry.place_title)
+                .join(Travel, Entry.travel_id == Travel.travel_id)
+                .where(Entry.geocode_status == GEOCODE_PENDING)
+            )).all()
+        except Exception as e:
+            print(f"❌ Ошибка загрузки мест без координат: {e}")
+            return
+        finally:
+            await session.close()
+
+        queued = 0
+        for row in rows:
+            if not self.submit(GeocodeJob(row.place_id, row.country, row.city, row.place_title, priority=BACKGROUND)):
+                # Остальные останутся pending и вернутся в очередь при следующем запуске
+                break
+            queued += 1
+        if rows:
+            print(f"📍 В очередь геокодирования возвращено мест: {queued} из {len(rows)}")
+
+    async def run(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.process(job)
+            except Exception as e:
+                print(f"❌ Ошибка фонового геокодирования места {job.place_id}: {e}")
+                await self.retry(job)
+            finally:
+                self.queue.task_done()
+
+    async def retry(self, job: GeocodeJob):
+        if job.attempt < self.retries:
+            metrics.inc("geocode_worker.retried")
+            asyncio.create_task(self.resubmit(job._replace(attempt=job.attempt + 1)))
+        else:
+            await self.give_up(job)
+
+    async def resubmit(self, job: GeocodeJob):
+        await asyncio.sleep(self.retry_delay * job.attempt)
+        if not self.submit(job):
+            await self.give_up(job)
+
+    async def give_up(self, job: GeocodeJob):
+        """Помечает место failed и предлагает пользователю указать координаты вручную"""
+        metrics.inc("geocode_worker.gave_up")
+        session = Session()
+        try:
+            result = await session.execute(
+                update(Entry)
+                .where(Entry.place_id == job.place_id, Entry.geocode_status == GEOCODE_PENDING)
+                .values(geocode_status=GEOCODE_FAILED)
+            )
+            await session.commit()
+        except Exception as e:
+            # Место останется pending и вернется в очередь при следующем запуске
+            print(f"❌ Не удалось пометить место {job.place_id} без координат: {e}")
+            return
+        finally:
+            await session.close()
+
+        if result.rowcount and job.chat_id and job.message_id:
+            await self.notify(job, None, None)
+
+    async def process(self, job: GeocodeJob):
+        lat, lon = await geocoding(job.country, job.city, job.place_title, priority=job.priority)
+        found = lat is not None and lon is not None
+        if found:
+            values = dict(latitude=lat, longitude=lon, geocode_status=None,
+                          country_code=gazetteer.country_code_at(lat, lon))
+        else:
+            values = dict(geocode_status=GEOCODE_FAILED)
+
+        session = Session()
+        try:
+            # Условие на статус: координаты, заданные пользователем вручную, не перетираем
+            result = await session.execute(
+                update(Entry)
+                .where(Entry.place_id == job.place_id, Entry.geocode_status == GEOCODE_PENDING)
+                .values(**values)
+            )
+            if found and result.rowcount:
+                # Место появилось на карте - кэш тепловых карт владельца устарел
+                await bump_data_version(session, [job.place_id])
+            await session.commit()
+        finally:
+            await session.close()
+
+        if result.rowcount == 0:
+            return
+        metrics.inc("geocode_worker.resolved" if found else "geocode_worker.failed")
+
+        if job.chat_id and job.message_id:
+            await self.notify(job, lat, lon)
+
+    async def notify(self, job: GeocodeJob, lat, lon):
+        try:
+            if lat is not None:
+                await self.bot.edit_message_text(
+                    f"📍 Координаты места <b>{job.place_title}</b> определены: {lat:.5f}, {lon:.5f}\n"
+                    "🗺️ <i>Место будет отображаться на карте</i>",
+                    chat_id=job.chat_id,
+                    message_id=job.message_id,
+                    parse_mode="HTML"
+                )
+            else:
+                await self.bot.edit_message_text(
+                    f"⚠️ Не удалось автоматически определить координаты места <b>{job.place_title}</b>\n\n"
+                    "Без координат место не будет отображаться на карте",
+                    chat_id=job.chat_id,
+                    message_id=job.message_id,
+                    parse_mode="HTML",
+                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                        [InlineKeyboardButton(text="📍 Указать координаты", callback_data=f"fix_coords:{job.place_id}")]
+                    ])
+                )
+        except Exception as e:
+            print(f"❌ Не удалось обновить сообщение о координатах: {e}")
+
+
+geocode_worker = GeocodeWorker(workers=geocode_workers, queue_size=geocode_queue_size, retries=geocode_retries,
+                               retry_delay=geocode_retry_delay)
+metrics.register_gauge("geocode_worker.queue_depth", lambda: geocode_worker.queue.qsize())
+
+
+async def geocode_later(message: Message, place_id: int, country, city, place_title):
+    """Отправляет сообщение о статусе и ставит место в очередь фонового геокодирования"""
+    status = await message.answer(f"📍 Определяю координаты места <b>{place_title}</b> в фоне...", parse_mode="HTML")
+    job = GeocodeJob(place_id, country, city, place_title, status.chat.id, status.message_id)
+    if not geocode_worker.submit(job):
+        # Очередь переполнена - сразу предлагаем указать координаты вручную
+        await geocode_worker.give_up(job)
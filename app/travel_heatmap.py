@@ -0,0 +1,341 @@
+import asyncio
+import io
+import math
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from app.travel_executor import process_executor
+from app.travel_metrics import metrics
+from app.travel_tiles import tile_store, download_tile
+from bot.config import heatmap_width, heatmap_height, heatmap_tile_cache_size, heatmap_renderer, \
+    heatmap_render_timeout, heatmap_tile_server_port
+
+TILE_SIZE = 256
+MAX_ZOOM = 15
+BACKGROUND = (242, 239, 233)
+ATTRIBUTION = "© OpenStreetMap contributors © CARTO"
+
+# Как у folium HeatMap: radius=15, blur=10, min_opacity=0.3
+HEAT_RADIUS = 15
+HEAT_BLUR = 10
+MIN_OPACITY = 0.3
+GRADIENT = ((0.0, (0, 0, 255)), (0.4, (0, 0, 255)), (0.6, (0, 255, 0)), (0.8, (255, 165, 0)), (1.0, (255, 0, 0)))
+MARKER_RADIUS = 3
+MARKER_COLOR = (0, 128, 0)
+MARKER_OPACITY = 0.6
+# Плотность считается на сетке в DENSITY_SCALE раз мельче картинки
+DENSITY_SCALE = 4
+
+
+def build_palette():
+    """Таблицы R, G, B и непрозрачности для каждого из 256 уровней интенсивности"""
+    stops = np.array([stop for stop, _ in GRADIENT])
+    colors = np.array([color for _, color in GRADIENT], dtype=np.float64)
+    levels = np.linspace(0, 1, 256)
+    channels = [np.round(np.interp(levels, stops, colors[:, channel])).astype(int).tolist() for channel in range(3)]
+    alpha = np.where(levels > 0.01, np.maximum(levels, MIN_OPACITY) * 255, 0)
+    return channels, np.round(alpha).astype(int).tolist()
+
+
+PALETTE, OPACITY = build_palette()
+
+
+def project(lat, lon, zoom: int):
+    """Web Mercator: координаты в пикселях мира на уровне zoom"""
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -85.05112878, 85.05112878)
+    lon = np.asarray(lon, dtype=np.float64)
+    scale = TILE_SIZE * 2 ** zoom
+    x = (lon + 180) / 360 * scale
+    sin = np.sin(np.radians(lat))
+    y = (0.5 - np.log((1 + sin) / (1 - sin)) / (4 * math.pi)) * scale
+    return x, y
+
+
+def heatmap_zoom(lats, lons, width: int = heatmap_width, height: int = heatmap_height) -> int:
+    """Масштаб карты по разбросу точек, не крупнее того, при котором все точки помещаются в кадр"""
+    lat_span = max(lats) - min(lats)
+    lon_span = max(lons) - min(lons)
+
+    if lat_span == 0 and lon_span == 0:
+        zoom_level = 12
+    elif lat_span < 0.1 and lon_span < 0.1:
+        zoom_level = 10
+    elif lat_span < 0.5 and lon_span < 0.5:
+        zoom_level = 8
+    elif lat_span < 2 and lon_span < 2:
+        zoom_level = 7
+    elif lat_span < 10 and lon_span < 10:
+        zoom_level = 6
+    elif lat_span < 30 and lon_span < 30:
+        zoom_level = 5
+    else:
+        zoom_level = 3
+
+    if len(lats) <= 3:
+        zoom_level = min(zoom_level + 2, MAX_ZOOM)
+    elif len(lats) <= 10:
+        zoom_level = min(zoom_level + 1, 12)
+
+    margin = 2 * (HEAT_RADIUS + HEAT_BLUR)
+    while zoom_level > 1:
+        x, y = project(lats, lons, zoom_level)
+        if np.ptp(x) <= width - margin and np.ptp(y) <= height - margin:
+            break
+        zoom_level -= 1
+    return zoom_level
+
+
+class TileCache:
+    """LRU декодированных тайлов подложки в памяти"""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        tile = self.entries.get(key)
+        if tile is not None:
+            self.entries.move_to_end(key)
+        return tile
+
+    def put(self, key, tile: np.ndarray):
+        self.entries[key] = tile
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+tile_cache = TileCache(maxsize=heatmap_tile_cache_size)
+metrics.register_gauge("heatmap.tile_cache.size", lambda: len(tile_cache.entries))
+
+
+def decode_tile(source) -> np.ndarray:
+    """RGB-массив тайла из файлоподобного объекта (BytesIO, mmap)"""
+    with Image.open(source) as image:
+        return np.asarray(image.convert('RGB'))
+
+
+def decode_and_store(zoom: int, x: int, y: int, data: bytes) -> np.ndarray:
+    tile = decode_tile(io.BytesIO(data))
+    # На диск попадают только тайлы, которые декодировались
+    if tile_store.enabled:
+        tile_store.put(zoom, x, y, data)
+    return tile
+
+
+async def fetch_tile(zoom: int, x: int, y: int):
+    """Тайл подложки (256x256x3): память, затем диск, в сеть - только за холодными.
+
+    None, если получить не удалось.
+    """
+    key = (zoom, x, y)
+    tile = tile_cache.get(key)
+    if tile is not None:
+        metrics.inc("heatmap.tile_cache.hits")
+        return tile
+
+    metrics.inc("heatmap.tile_cache.misses")
+    if tile_store.enabled:
+        tile = await asyncio.to_thread(tile_store.read, zoom, x, y, decode_tile)
+    if tile is None:
+        data = await download_tile(zoom, x, y)
+        if data is None:
+            return None
+        try:
+            tile = await asyncio.to_thread(decode_and_store, zoom, x, y, data)
+        except Exception as e:
+            print(f"❌ Не удалось декодировать тайл {zoom}/{x}/{y}: {e}")
+            return None
+
+    tile_cache.put(key, tile)
+    return tile
+
+
+def view_origin(lats, lons, zoom: int, width: int, height: int):
+    """Пиксель мира, соответствующий левому верхнему углу картинки (центр - середина охвата точек)"""
+    x, y = project(lats, lons, zoom)
+    return int(round((x.min() + x.max()) / 2 - width / 2)), int(round((y.min() + y.max()) / 2 - height / 2))
+
+
+def tiles_for_view(zoom: int, left: int, top: int, width: int, height: int):
+    """Тайлы (x, y), покрывающие кадр; по долготе мир повторяется"""
+    count = 2 ** zoom
+    return [(tx, ty)
+            for ty in range(top // TILE_SIZE, (top + height - 1) // TILE_SIZE + 1) if 0 <= ty < count
+            for tx in range(left // TILE_SIZE, (left + width - 1) // TILE_SIZE + 1)]
+
+
+@lru_cache(maxsize=4)
+def background(width: int, height: int) -> np.ndarray:
+    return np.full((height, width, 3), BACKGROUND, dtype=np.uint8)
+
+
+def compose_basemap(tiles: dict, zoom: int, left: int, top: int, width: int, height: int) -> np.ndarray:
+    """Склеивает тайлы в подложку кадра; недостающие остаются фоном"""
+    canvas = background(width, height).copy()
+    for (tx, ty), tile in tiles.items():
+        if tile is None:
+            continue
+        x0 = tx * TILE_SIZE - left
+        y0 = ty * TILE_SIZE - top
+        cx0, cy0 = max(x0, 0), max(y0, 0)
+        cx1, cy1 = min(x0 + TILE_SIZE, width), min(y0 + TILE_SIZE, height)
+        if cx0 < cx1 and cy0 < cy1:
+            canvas[cy0:cy1, cx0:cx1] = tile[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+    return canvas
+
+
+@lru_cache(maxsize=16)
+def gaussian_matrix(size: int, sigma: float) -> np.ndarray:
+    """Матрица свертки с гауссовым ядром вдоль одной оси"""
+    offsets = np.arange(size, dtype=np.float32)
+    return np.exp(-(offsets[:, None] - offsets[None, :]) ** 2 / (2 * sigma ** 2))
+
+
+def density(x: np.ndarray, y: np.ndarray, width: int, height: int) -> Image.Image:
+    """Интенсивность тепла 0..255 для каждого пикселя кадра (картинка в оттенках серого).
+
+    Точки раскладываются по сетке гистограммой, затем размываются гауссом
+    двумя матричными умножениями (ядро разделимо). Одна точка дает 1 в центре.
+    """
+    grid_width, grid_height = -(-width // DENSITY_SCALE), -(-height // DENSITY_SCALE)
+    # Точки за краем кадра тоже греют его, поэтому сетка шире на радиус ядра
+    pad = -(-(HEAT_RADIUS + HEAT_BLUR) // DENSITY_SCALE)
+    counts, _, _ = np.histogram2d(
+        y / DENSITY_SCALE + pad, x / DENSITY_SCALE + pad,
+        bins=(grid_height + 2 * pad, grid_width + 2 * pad),
+        range=((0, grid_height + 2 * pad), (0, grid_width + 2 * pad))
+    )
+    sigma = (HEAT_RADIUS + HEAT_BLUR) / 3 / DENSITY_SCALE
+    heat = gaussian_matrix(counts.shape[0], sigma) @ counts.astype(np.float32) @ gaussian_matrix(counts.shape[1], sigma)
+    heat = np.clip(heat[pad:pad + grid_height, pad:pad + grid_width], 0, 1)
+
+    levels = Image.fromarray(np.round(heat * 255).astype(np.uint8))
+    return levels.resize((width, height), Image.BILINEAR)
+
+
+def marker_mask(x: np.ndarray, y: np.ndarray, width: int, height: int) -> Image.Image:
+    """Маска кружков мест: все пиксели всех кружков считаются одним массивом"""
+    offsets = np.arange(-MARKER_RADIUS, MARKER_RADIUS + 1)
+    dy, dx = np.meshgrid(offsets, offsets, indexing='ij')
+    disk = dx ** 2 + dy ** 2 <= MARKER_RADIUS ** 2
+    rows = (np.round(y).astype(np.int64)[:, None] + dy[disk][None, :]).ravel()
+    columns = (np.round(x).astype(np.int64)[:, None] + dx[disk][None, :]).ravel()
+    inside = (rows >= 0) & (rows < height) & (columns >= 0) & (columns < width)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    mask[rows[inside], columns[inside]] = round(MARKER_OPACITY * 255)
+    return Image.fromarray(mask)
+
+
+def render_frame(basemap: np.ndarray, x: np.ndarray, y: np.ndarray) -> bytes:
+    """Накладывает тепло и маркеры на подложку и кодирует PNG.
+
+    Цвет и прозрачность берутся из таблиц по уровню интенсивности, смешивание
+    делает Pillow - по кадру не ходит ни одного цикла на Python.
+    """
+    height, width = basemap.shape[:2]
+    heat = density(x, y, width, height)
+    colors = Image.merge('RGB', [heat.point(channel) for channel in PALETTE])
+
+    image = Image.fromarray(basemap)
+    image.paste(colors, (0, 0), heat.point(OPACITY))
+    markers = marker_mask(x, y, width, height)
+    box = markers.getbbox()
+    if box:
+        image.paste(MARKER_COLOR, box, markers.crop(box))
+
+    draw = ImageDraw.Draw(image)
+    text_width = draw.textlength(ATTRIBUTION)
+    draw.rectangle((width - text_width - 8, height - 16, width, height), fill=(255, 255, 255))
+    draw.text((width - text_width - 4, height - 14), ATTRIBUTION, fill=(80, 80, 80))
+
+    output = io.BytesIO()
+    image.save(output, format='PNG', compress_level=1)
+    return output.getvalue()
+
+
+def render_view(tiles: dict, zoom: int, left: int, top: int, width: int, height: int,
+                x: np.ndarray, y: np.ndarray) -> bytes:
+    """Весь CPU-рендер кадра; выполняется в пуле процессов"""
+    return render_frame(compose_basemap(tiles, zoom, left, top, width, height), x, y)
+
+
+async def render_folium_heatmap(points, width: int = heatmap_width, height: int = heatmap_height) -> bytes:
+    """PNG тепловой карты folium: страница рендерится в браузере из пула"""
+    import folium
+    from folium.plugins import HeatMap
+    from app.travel_browser import browser_pool
+
+    lats = [point[0] for point in points]
+    lons = [point[1] for point in points]
+    # С локальным тайл-сервером браузер берет подложку из дискового кэша
+    if heatmap_tile_server_port:
+        tiles = f"http://127.0.0.1:{heatmap_tile_server_port}/{{z}}/{{x}}/{{y}}.png"
+    else:
+        tiles = 'CartoDB positron'
+    m = folium.Map(
+        location=[sum(lats) / len(lats), sum(lons) / len(lons)],
+        zoom_start=heatmap_zoom(lats, lons, width, height),
+        control_scale=True,
+        tiles=tiles,
+        attr=ATTRIBUTION
+    )
+
+    HeatMap(
+        points,
+        min_opacity=MIN_OPACITY,
+        max_zoom=18,
+        radius=HEAT_RADIUS,
+        blur=HEAT_BLUR,
+        gradient={'0.4': 'blue', '0.6': 'lime', '0.8': 'orange', '1.0': 'red'}
+    ).add_to(m)
+
+    for lat, lon in points:
+        folium.CircleMarker(
+            location=[lat, lon],
+            radius=MARKER_RADIUS,
+            color='green',
+            fill=True,
+            fill_color='green',
+            fill_opacity=MARKER_OPACITY
+        ).add_to(m)
+
+    return await browser_pool.render(m.get_root().render())
+
+
+async def render_heatmap(points, width: int = heatmap_width, height: int = heatmap_height, key=None) -> bytes:
+    """PNG тепловой карты по списку [lat, lon]; без браузера, если не выбран рендер folium.
+
+    key - ключ задачи в пуле процессов: новая карта с тем же ключом отменяет недорисованную.
+    """
+    if heatmap_renderer == "folium":
+        return await render_folium_heatmap(points, width, height)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    lats = [point[0] for point in points]
+    lons = [point[1] for point in points]
+    # Точки по обе стороны антимеридиана (Чукотка и Аляска) рисуем рядом, а не через весь мир
+    if max(lons) - min(lons) > 180:
+        lons = [lon + 360 if lon < 0 else lon for lon in lons]
+    zoom = heatmap_zoom(lats, lons, width, height)
+    left, top = view_origin(lats, lons, zoom, width, height)
+
+    needed = tiles_for_view(zoom, left, top, width, height)
+    count = 2 ** zoom
+    fetched = await asyncio.gather(*(fetch_tile(zoom, tx % count, ty) for tx, ty in needed))
+    tiles = dict(zip(needed, fetched))
+    if any(tile is None for tile in fetched):
+        metrics.inc("heatmap.basemap_incomplete")
+
+    x, y = project(lats, lons, zoom)
+    x = x - left
+    y = y - top
+
+    png = await process_executor.run(render_view, tiles, zoom, left, top, width, height, x, y,
+                                     name="heatmap", key=key, timeout=heatmap_render_timeout)
+    metrics.observe("heatmap.render_seconds", loop.time() - started)
+    return png
@@ -0,0 +1,22 @@
+import aiohttp
+
+from bot.config import http_pool_size
+
+http_session: aiohttp.ClientSession | None = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Общая сессия aiohttp с пулом keep-alive соединений для внешних API"""
+    global http_session
+    if http_session is None or http_session.closed:
+        connector = aiohttp.TCPConnector(limit=http_pool_size, ttl_dns_cache=300)
+        http_session = aiohttp.ClientSession(connector=connector)
+    return http_session
+
+
+async def close_http_session():
+    global http_session
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+    http_session = None
+
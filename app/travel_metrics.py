@@ -0,0 +1,61 @@
+import bisect
+from collections import defaultdict
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self) -> dict:
+        buckets = {str(bound): count for bound, count in zip(self.buckets, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {"count": self.count, "sum": round(self.total, 6), "buckets": buckets}
+
+
+class Metrics:
+    """Счетчики, гауги и гистограммы процесса для /metrics"""
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name: str, value: float = 1):
+        self.counters[name] += value
+
+    def register_gauge(self, name: str, func):
+        """Гауг вычисляется при снятии снимка"""
+        self.gauges[name] = func
+
+    def observe(self, name: str, value: float, buckets=None):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(buckets or self.LATENCY_BUCKETS)
+        histogram.observe(value)
+
+    def snapshot(self) -> dict:
+        gauges = {}
+        for name, func in self.gauges.items():
+            try:
+                gauges[name] = func()
+            except Exception as e:
+                print(f"❌ Ошибка гауга {name}: {e}")
+
+        return {
+            "counters": dict(self.counters),
+            "gauges": gauges,
+            "histograms": {name: h.snapshot() for name, h in self.histograms.items()},
+        }
+
+
+metrics = Metrics()
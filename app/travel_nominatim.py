@@ -0,0 +1,119 @@
+import asyncio
+import itertools
+
+from app.travel_metrics import metrics
+
+# Приоритеты очереди: меньше - раньше
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class NominatimJob:
+    __slots__ = ('key', 'query', 'priority', 'deadline', 'future', 'queued_at', 'waiters', 'started')
+
+    def __init__(self, key, query, priority, deadline, future, queued_at):
+        self.key = key
+        self.query = query
+        self.priority = priority
+        self.deadline = deadline
+        self.future = future
+        self.queued_at = queued_at
+        self.waiters = 0
+        self.started = False
+
+
+class NominatimScheduler:
+    """Единая очередь запросов к Nominatim на процесс.
+
+    Запросы уходят по одному и не чаще одного в interval секунд, интерактивные
+    раньше фоновых. Одинаковые запросы в полете склеиваются в один вызов fetch.
+    Задание, все ожидающие которого ушли по дедлайну или отменены, в сеть не отправляется.
+    """
+
+    def __init__(self, fetch, interval: float = 1.0, available=None):
+        self.fetch = fetch
+        self.interval = interval
+        # Если зависимость недоступна, задания завершаются сразу, не занимая слот
+        self.available = available
+        self.queue = asyncio.PriorityQueue()
+        self.inflight = {}
+        self.sequence = itertools.count()
+        self.worker = None
+        self.last_call = 0.0
+
+    def submit(self, key, query, priority: int, deadline: float) -> NominatimJob:
+        loop = asyncio.get_running_loop()
+        job = self.inflight.get(key)
+        if job is not None and not job.future.done():
+            metrics.inc("nominatim.coalesced")
+            job.deadline = max(job.deadline, deadline)
+            if priority < job.priority:
+                # Повторно ставим в очередь с более высоким приоритетом, старая запись пропустится
+                job.priority = priority
+                self.queue.put_nowait((priority, next(self.sequence), job))
+            return job
+
+        job = NominatimJob(key, query, priority, deadline, loop.create_future(), loop.time())
+        self.inflight[key] = job
+        self.queue.put_nowait((priority, next(self.sequence), job))
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self.run())
+        return job
+
+    async def request(self, key, query, priority: int = INTERACTIVE, timeout: float = 10):
+        """Результат fetch для запроса или None, если дедлайн истек раньше"""
+        loop = asyncio.get_running_loop()
+        job = self.submit(key, query, priority, loop.time() + timeout)
+        job.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(job.future), timeout)
+        except asyncio.TimeoutError:
+            metrics.inc("nominatim.deadline_exceeded")
+            return None
+        finally:
+            job.waiters -= 1
+            # Ждать больше некому - снимаем задание из очереди, пока оно не ушло в сеть
+            if job.waiters == 0 and not job.started and not job.future.done():
+                metrics.inc("nominatim.withdrawn")
+                self.finish(job, None)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            priority, sequence, job = await self.queue.get()
+            if job.future.done() or priority != job.priority:
+                continue
+
+            if loop.time() >= job.deadline:
+                metrics.inc("nominatim.expired_in_queue")
+                self.finish(job, None)
+                continue
+
+            if self.available is not None and not self.available():
+                metrics.inc("nominatim.rejected_unavailable")
+                self.finish(job, None)
+                continue
+
+            wait = self.last_call + self.interval - loop.time()
+            if wait > 0:
+                # Пока ждем слот, может прийти более срочный запрос - после паузы выбираем заново
+                await asyncio.sleep(wait)
+                self.queue.put_nowait((priority, sequence, job))
+                continue
+
+            remaining = job.deadline - loop.time()
+            metrics.observe("nominatim.queue_wait_seconds", loop.time() - job.queued_at)
+            self.last_call = loop.time()
+            job.started = True
+            try:
+                result = await self.fetch(job.query, remaining)
+            except Exception as e:
+                print(f"❌ Ошибка запроса Nominatim '{job.query}': {e}")
+                result = None
+            self.finish(job, result)
+
+    def finish(self, job, result):
+        if self.inflight.get(job.key) is job:
+            del self.inflight[job.key]
+        if not job.future.done():
+            job.future.set_result(result)
@@ -1,41 +1,45 @@
 import asyncio
 from datetime import datetime, timedelta
 from aiogram import Bot
-from app.travel_session import Session
-from app.travel_database import User
+from app.travel_session import Session, engine
+from app.travel_cache import user_cache
+from app.travel_database import User, Travel, Entry, Media, MediaTypeEnum
+from sqlalchemy import Integer, func, or_, select, update
+from app.travel_gazetteer import gazetteer
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 async def deactivate_expired_premium():
     session = Session()
     try:
         now = datetime.now()
-        expired_users = session.query(User).filter(
+        expired_users = (await session.scalars(select(User).filter(
             User.premium == True,
             User.end_premium <= now
-        ).all()
+        ))).all()
 
         for user in expired_users:
             user.premium = False
             print(f"🔒 Деактивирован премиум для пользователя {user.tg_id}")
 
         if expired_users:
-            session.commit()
+            await session.commit()
+            user_cache.invalidate(*(user.tg_id for user in expired_users))
             print(f"🔒 Деактивировано {len(expired_users)} просроченных премиумов")
 
     except Exception as e:
         print(f"❌ Ошибка деактивации премиумов: {e}")
     finally:
-        session.close()
+        await session.close()
 
 async def check_premium_expiry(bot: Bot):
     session = Session()
     try:
         now = datetime.now()
-        expiring_users = session.query(User).filter(
+        expiring_users = (await session.scalars(select(User).filter(
             User.premium == True,
             User.end_premium <= now + timedelta(days=3),
             User.end_premium > now
-        ).all()
+        ))).all()
 
         print(f"🔍 Проверка истекающих премиумов: найдено {len(expiring_users)} пользователей")
 
@@ -60,7 +64,124 @@ async def check_premium_expiry(bot: Bot):
     except Exception as e:
         print(f"❌ Ошибка в check_premium_expiry: {e}")
     finally:
-        session.close()
+        await session.close()
+
+def trip_days_sql(dialect: str):
+    """Длительность путешествия в днях в SQL, как trip_days() в Python"""
+    if dialect == "sqlite":
+        days = func.cast(func.julianday(Travel.end_date) - func.julianday(Travel.start_date), Integer)
+    else:
+        days = func.cast(func.extract('day', Travel.end_date - Travel.start_date), Integer)
+    return func.coalesce(days, 0)
+
+def actual_user_counters(dialect: str) -> dict:
+    """Коррелированные подзапросы с реальными значениями счетчиков для UPDATE users"""
+    return {
+        User.trip_count: select(func.count(Travel.travel_id))
+            .where(Travel.user_id == User.user_id).scalar_subquery(),
+        User.entries_count: select(func.count(Entry.place_id))
+            .join(Travel, Entry.travel_id == Travel.travel_id)
+            .where(Travel.user_id == User.user_id).scalar_subquery(),
+        User.photos_count: select(func.count(Media.media_id))
+            .join(Entry, Media.place_id == Entry.place_id).join(Travel, Entry.travel_id == Travel.travel_id)
+            .where(Travel.user_id == User.user_id, Media.media_type == MediaTypeEnum.photo).scalar_subquery(),
+        User.longest_trip: select(func.coalesce(func.max(trip_days_sql(dialect)), 0))
+            .where(Travel.user_id == User.user_id).scalar_subquery(),
+    }
+
+async def reconcile_user_counters(batch_size: int = 200):
+    """Сверяет счетчики пользователей с реальными данными пачками по user_id.
+
+    Подсчет и запись идут одним UPDATE на пачку: изменение, закоммиченное между
+    чтением агрегатов и записью, не затирается устаревшим значением.
+    """
+    last_id = 0
+    checked = 0
+    fixed = 0
+
+    while True:
+        session = Session()
+        try:
+            user_ids = (await session.scalars(
+                select(User.user_id).filter(User.user_id > last_id).order_by(User.user_id).limit(batch_size)
+            )).all()
+            if not user_ids:
+                break
+
+            actual = actual_user_counters(engine.dialect.name)
+            changed = (await session.scalars(
+                update(User)
+                .where(User.user_id.in_(user_ids),
+                       or_(*(column.is_distinct_from(value) for column, value in actual.items())))
+                .values(actual)
+                .returning(User.tg_id)
+                .execution_options(synchronize_session=False)
+            )).all()
+
+            await session.commit()
+            user_cache.invalidate(*changed)
+
+            checked += len(user_ids)
+            fixed += len(changed)
+            last_id = user_ids[-1]
+        finally:
+            await session.close()
+
+        await asyncio.sleep(0)
+
+    print(f"🔄 Сверка счетчиков: проверено {checked}, исправлено {fixed}")
+    return checked, fixed
+
+# До какого place_id места уже проверены текущим индексом газеттира: новые и измененные
+# места получают код страны сразу, а неразрешенные (море, глушь) этим же индексом не разрешатся
+backfill_progress = {"index": None, "last_id": 0}
+
+async def backfill_entry_countries(batch_size: int = 500):
+    """Заполняет country_code у мест с координатами по офлайн-газеттиру пачками по place_id"""
+    if not gazetteer.full:
+        # По встроенному образцу почти ничего не разрешится, а проход повторялся бы каждую ночь
+        print("⚠️ Коды стран мест не заполняются: нет полного газеттира")
+        return 0, 0
+
+    index = (str(gazetteer.index_dir), len(gazetteer.city_names))
+    if backfill_progress["index"] != index:
+        backfill_progress.update(index=index, last_id=0)
+    last_id = backfill_progress["last_id"]
+    checked = 0
+    filled = 0
+
+    while True:
+        session = Session()
+        try:
+            rows = (await session.execute(
+                select(Entry.place_id, Entry.latitude, Entry.longitude)
+                .filter(Entry.place_id > last_id, Entry.latitude.isnot(None), Entry.country_code.is_(None))
+                .order_by(Entry.place_id).limit(batch_size)
+            )).all()
+            if not rows:
+                break
+
+            values = []
+            for row in rows:
+                code = gazetteer.country_code_at(row.latitude, row.longitude)
+                if code:
+                    values.append({"place_id": row.place_id, "country_code": code})
+
+            # Массовый UPDATE по первичному ключу - один executemany на пачку
+            if values:
+                await session.execute(update(Entry), values)
+                await session.commit()
+
+            checked += len(rows)
+            filled += len(values)
+            last_id = backfill_progress["last_id"] = rows[-1].place_id
+        finally:
+            await session.close()
+
+        await asyncio.sleep(0)
+
+    print(f"🌍 Коды стран мест: проверено {checked}, заполнено {filled}")
+    return checked, filled
 
 async def premium_management_scheduler(bot: Bot):
     print("🚀 Запуск системы управления премиум подписками...")
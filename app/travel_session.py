@@ -1,6 +1,21 @@
 ﻿import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import time
+from contextvars import ContextVar
+from sqlalchemy import event, exc
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from app.travel_metrics import metrics
+from bot.config import (db_pool_size, db_max_overflow, db_pool_timeout, db_pool_recycle,
+                        db_pool_pre_ping, db_statement_cache_size, db_echo,
+                        sqlite_readers, sqlite_write_timeout, sqlite_synchronous,
+                        sqlite_mmap_size, sqlite_cache_size, sqlite_busy_timeout,
+                        database_replica_url, replica_sticky_seconds)
+
+# tg_id пользователя, чей апдейт сейчас обрабатывается (выставляет middleware)
+current_user_id = ContextVar('current_user_id', default=None)
+recent_writers = {}
 
 
 def get_database_path():
@@ -13,33 +28,176 @@ def get_database_path():
     return "sqlite:///travel_bot.db"
 
 
-database_url = os.getenv('DATABASE_URL', get_database_path())
-connect_args = {}
+def normalize_url(url: str) -> str:
+    if url.startswith('postgres://'):
+        return url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+
+def get_database_url():
+    return normalize_url(os.getenv('DATABASE_URL') or get_database_path())
+
+
+def to_async_url(url: str) -> str:
+    """Подставляет асинхронный драйвер в URL базы данных"""
+    if url.startswith('sqlite://'):
+        return url.replace('sqlite://', 'sqlite+aiosqlite://', 1)
+    if url.startswith('postgresql://'):
+        return url.replace('postgresql://', 'postgresql+asyncpg://', 1)
+    return url
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """Пул, который считает ожидания свободного соединения"""
+
+    def __init__(self, creator, pool_size: int = 5, max_overflow: int = 10, **kwargs):
+        # Свой лимит переполнения: приватный _max_overflow SQLAlchemy не трогаем
+        self.max_overflow = max_overflow
+        super().__init__(creator, pool_size=pool_size, max_overflow=max_overflow, **kwargs)
+
+    def _do_get(self):
+        exhausted = self.checkedin() == 0 and 0 <= self.max_overflow <= self.overflow()
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            metrics.inc("db.pool.timeouts")
+            raise
+        finally:
+            if exhausted:
+                metrics.inc("db.pool.waits")
+                metrics.observe("db.pool.wait_seconds", time.perf_counter() - start)
 
-if 'sqlite' in database_url:
-    connect_args = {'check_same_thread': False}
 
-engine = create_engine(database_url, connect_args=connect_args, echo=True)
-Session = sessionmaker(bind=engine)
+def register_pool_metrics(name: str, pool):
+    metrics.register_gauge(f"db.{name}.pool.size", pool.size)
+    metrics.register_gauge(f"db.{name}.pool.checked_out", pool.checkedout)
+    metrics.register_gauge(f"db.{name}.pool.checked_in", pool.checkedin)
+    metrics.register_gauge(f"db.{name}.pool.overflow", pool.overflow)
 
-print(f"📦 Database URL: {database_url}")
 
-database_url = os.getenv('DATABASE_URL')
+def create_db_engine(url: str, name: str = "main", **overrides):
+    """Единая фабрика движков: настройки пула берутся из окружения"""
+    options = {
+        'echo': db_echo,
+        'pool_pre_ping': db_pool_pre_ping,
+        'query_cache_size': db_statement_cache_size,
+    }
+    connect_args = {}
+
+    if ':memory:' not in url:
+        options.update(
+            poolclass=MeteredQueuePool,
+            pool_size=db_pool_size,
+            max_overflow=db_max_overflow,
+            pool_timeout=db_pool_timeout,
+            pool_recycle=db_pool_recycle,
+        )
+
+    if url.startswith('postgresql'):
+        connect_args['statement_cache_size'] = db_statement_cache_size
+
+    options['connect_args'] = connect_args
+    options.update(overrides)
+
+    db_engine = create_async_engine(to_async_url(url), **options)
+    if isinstance(db_engine.pool, MeteredQueuePool):
+        register_pool_metrics(name, db_engine.pool)
+    return db_engine
+
+
+def apply_sqlite_pragmas(db_engine, read_only: bool = False):
+    @event.listens_for(db_engine.sync_engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={sqlite_synchronous}")
+        cursor.execute(f"PRAGMA mmap_size={sqlite_mmap_size}")
+        cursor.execute(f"PRAGMA cache_size={sqlite_cache_size}")
+        cursor.execute(f"PRAGMA busy_timeout={sqlite_busy_timeout}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+
+class RoutingSession(OrmSession):
+    """Читает через пул читателей, пока транзакция ничего не записала.
+
+    После первой записи (flush или DML) транзакция до конца работает через
+    писателя, чтобы видеть собственные незакоммиченные изменения.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+        if read_engine is engine or self.info.get('wrote'):
+            return engine.sync_engine
+        return read_engine.sync_engine
+
+
+def mark_recent_write():
+    tg_id = current_user_id.get()
+    if tg_id is None:
+        return
+
+    now = time.monotonic()
+    recent_writers[tg_id] = now + replica_sticky_seconds
+    if len(recent_writers) > 10000:
+        for key in [key for key, deadline in recent_writers.items() if deadline < now]:
+            del recent_writers[key]
+
+
+def wrote_recently() -> bool:
+    """Пользователь недавно писал - реплика может еще не догнать primary"""
+    deadline = recent_writers.get(current_user_id.get())
+    return deadline is not None and deadline >= time.monotonic()
+
+
+class ReplicaSession(RoutingSession):
+    """Сессия read-only хендлеров: читает с реплики, кроме окна после собственной записи пользователя"""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if replica_engine is None or self._flushing or isinstance(clause, UpdateBase):
+            return super().get_bind(mapper, clause, **kwargs)
+
+        if wrote_recently():
+            metrics.inc("db.replica.sticky_reads")
+            return super().get_bind(mapper, clause, **kwargs)
+
+        metrics.inc("db.replica.reads")
+        return replica_engine.sync_engine
+
 
-if database_url and database_url.startswith('postgres://'):
-    database_url = database_url.replace('postgres://', 'postgresql://', 1)
+@event.listens_for(RoutingSession, 'after_commit')
+def remember_write(session):
+    if session.info.get('wrote'):
+        mark_recent_write()
 
-if not database_url:
-    database_url = 'sqlite:///travel_bot.db'
 
-connect_args = {}
-if 'sqlite' in database_url:
-    connect_args = {'check_same_thread': False}
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def reset_write_routing(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('wrote', None)
 
-engine = create_engine(database_url, connect_args=connect_args)
-Session = sessionmaker(bind=engine)
 
+database_url = get_database_url()
 print(f"📦 Database URL: {database_url}")
 
-engine = create_engine(database_url, connect_args=connect_args, echo=True)
-Session = sessionmaker(bind=engine)
+if database_url.startswith('sqlite') and ':memory:' not in database_url:
+    # Единственное соединение писателя: пул выстраивает запись в асинхронную очередь FIFO,
+    # поэтому писатели не конкурируют за блокировку, а читатели работают параллельно в WAL
+    engine = create_db_engine(database_url, name="writer", pool_size=1, max_overflow=0,
+                              pool_timeout=sqlite_write_timeout)
+    read_engine = create_db_engine(database_url, name="reader", pool_size=sqlite_readers, max_overflow=0)
+    apply_sqlite_pragmas(engine)
+    apply_sqlite_pragmas(read_engine, read_only=True)
+else:
+    engine = create_db_engine(database_url)
+    read_engine = engine
+
+replica_engine = None
+if database_replica_url and not database_url.startswith('sqlite'):
+    replica_engine = create_db_engine(normalize_url(database_replica_url), name="replica")
+
+Session = async_sessionmaker(sync_session_class=RoutingSession, expire_on_commit=False)
+ReadSession = async_sessionmaker(sync_session_class=ReplicaSession, expire_on_commit=False)
@@ -16,6 +16,7 @@ class EntryState(StatesGroup):
     adding_more_video = State()
     place_rating = State()
     another_place = State()
+    fixing_location = State()
 
 class TravelFinish(StatesGroup):
     travel_comment = State()
@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import io
+import mmap
+import os
+import threading
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+import aiohttp
+from aiohttp import web
+from PIL import Image, ImageDraw
+
+from app.travel_http import get_http_session
+from app.travel_metrics import metrics
+from bot.config import mail, heatmap_tile_url, heatmap_tile_timeout, heatmap_tile_dir, heatmap_tile_disk_mb
+
+
+class DiskTileCache:
+    """LRU тайлов подложки на диске: файлы {z}/{x}/{y}.png общим размером не больше max_mb.
+
+    Порядок вытеснения живет в памяти и при первом обращении восстанавливается
+    по mtime файлов (попадание обновляет mtime). Файлы читаются через mmap и
+    декодируются прямо из отображенной памяти, без промежуточной копии.
+    """
+
+    def __init__(self, directory: str, max_mb: float = 512):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.entries = OrderedDict()
+        self.total = 0
+        self.loaded = False
+        # Читают и пишут из потоков asyncio.to_thread
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def path(self, zoom: int, x: int, y: int) -> str:
+        return os.path.join(self.directory, str(zoom), str(x), f"{y}.png")
+
+    def load(self):
+        """Индекс по уже лежащим на диске тайлам; вызывается под lock"""
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if name.endswith(".tmp"):
+                    # Недописанный тайл от прошлого запуска
+                    os.remove(path)
+                    continue
+                try:
+                    zoom, x = (int(part) for part in os.path.relpath(root, self.directory).split(os.sep))
+                    y = int(name.removesuffix(".png"))
+                    stat = os.stat(path)
+                except (ValueError, OSError):
+                    continue
+                found.append((stat.st_mtime, (zoom, x, y), stat.st_size))
+
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.total += size
+        self.loaded = True
+        self.evict()
+
+    def evict(self):
+        while self.total > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total -= size
+            metrics.inc("tiles.disk.evictions")
+            try:
+                os.remove(self.path(*key))
+            except FileNotFoundError:
+                pass
+
+    def forget(self, key):
+        with self.lock:
+            self.total -= self.entries.pop(key, 0)
+
+    def read(self, zoom: int, x: int, y: int, parse=bytes):
+        """parse(mmap файла тайла) или None, если тайла нет или он испорчен"""
+        key = (zoom, x, y)
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            if key not in self.entries:
+                metrics.inc("tiles.disk.misses")
+                return None
+            self.entries.move_to_end(key)
+
+        path = self.path(*key)
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                result = parse(mapped)
+            os.utime(path)
+        except (OSError, ValueError) as e:
+            # Файл удалили снаружи, он пустой или не декодируется - считаем промахом
+            print(f"❌ Тайл {zoom}/{x}/{y} на диске не читается: {e}")
+            self.forget(key)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            metrics.inc("tiles.disk.misses")
+            return None
+        metrics.inc("tiles.disk.hits")
+        return result
+
+    def put(self, zoom: int, x: int, y: int, data: bytes):
+        key = (zoom, x, y)
+        path = self.path(*key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Запись через временный файл: читатель не увидит половину тайла
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            self.total += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            self.evict()
+
+
+tile_store = DiskTileCache(heatmap_tile_dir, heatmap_tile_disk_mb)
+metrics.register_gauge("tiles.disk.count", lambda: len(tile_store.entries))
+metrics.register_gauge("tiles.disk.mb", lambda: round(tile_store.total / 1024 / 1024, 1))
+
+
+async def download_tile(zoom: int, x: int, y: int, url: str = None) -> bytes | None:
+    """PNG тайла с тайл-сервера; None, если получить не удалось"""
+    url = (url or heatmap_tile_url).format(s="abcd"[(x + y) % 4], z=zoom, x=x, y=y)
+    metrics.inc("tiles.downloads")
+    try:
+        async with get_http_session().get(
+                url, headers={"User-Agent": f"TravelBot/1.0 ({mail})"},
+                timeout=aiohttp.ClientTimeout(total=heatmap_tile_timeout)) as response:
+            if response.status != 200:
+                print(f"❌ Тайл {zoom}/{x}/{y}: HTTP {response.status}")
+                metrics.inc("tiles.download_errors")
+                return None
+            return await response.read()
+    except Exception as e:
+        print(f"❌ Не удалось загрузить тайл {zoom}/{x}/{y}: {e}")
+        metrics.inc("tiles.download_errors")
+        return None
+
+
+@lru_cache(maxsize=1024)
+def synthetic_tile(zoom: int, x: int, y: int) -> bytes:
+    """Детерминированный тайл-заглушка: фон подложки, рамка и номер тайла"""
+    image = Image.new('RGB', (256, 256), (242, 239, 233))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 255, 255), outline=(220, 216, 208))
+    draw.text((6, 6), f"{zoom}/{x}/{y}", fill=(180, 176, 168))
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+class TileServer:
+    """Локальный тайл-сервер: GET /{z}/{x}/{y}.png.
+
+    С дисковым кэшем (store) работает как кэширующий прокси к HEATMAP_TILE_URL -
+    так folium в браузере берет тайлы с диска. В офлайн-режиме промахи не идут
+    в сеть, а заменяются синтетическими тайлами: карты рендерятся без интернета
+    в тестах и бенчмарках. latency_ms - искусственная задержка каждого ответа.
+    """
+
+    def __init__(self, store: DiskTileCache = None, offline: bool = False, latency_ms: float = 0):
+        self.store = store
+        self.offline = offline
+        self.latency_ms = latency_ms
+        self.calls = Counter()
+        self.runner = None
+        self.url = None
+
+    @property
+    def url_template(self) -> str:
+        return f"{self.url}/{{z}}/{{x}}/{{y}}.png"
+
+    async def tile(self, request: web.Request):
+        try:
+            zoom, x, y = (int(request.match_info[name]) for name in ("z", "x", "y"))
+        except ValueError:
+            raise web.HTTPNotFound()
+        if not (0 <= zoom <= 22 and 0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom):
+            raise web.HTTPNotFound()
+
+        self.calls["tiles"] += 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+
+        data = None
+        if self.store is not None and self.store.enabled:
+            data = await asyncio.to_thread(self.store.read, zoom, x, y)
+        if data is None and self.offline:
+            self.calls["tiles.synthetic"] += 1
+            data = synthetic_tile(zoom, x, y)
+        elif data is None:
+            self.calls["tiles.upstream"] += 1
+            data = await download_tile(zoom, x, y)
+            if data is None:
+                raise web.HTTPBadGateway()
+            if self.store is not None and self.store.enabled:
+                await asyncio.to_thread(self.store.put, zoom, x, y, data)
+
+        return web.Response(body=data, content_type="image/png", headers={"Cache-Control": "max-age=86400"})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_get("/{z}/{x}/{y}.png", self.tile)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+async def serve(host: str, port: int, offline: bool):
+    server = TileServer(None if offline else tile_store, offline=offline)
+    await server.start(host, port)
+    print(f"🗺️ Тайл-сервер: {server.url_template} ({'офлайн' if offline else 'прокси ' + heatmap_tile_url})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный тайл-сервер для подложки тепловых карт")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--offline", action="store_true", help="не ходить в сеть, отдавать синтетические тайлы")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.offline))
@@ -2,16 +2,14 @@ import asyncio
 import re
 from datetime import datetime, timedelta
 from typing import List
-from venv import logger
 
-import requests
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
-from sqlalchemy import func
-from bot.config import mail
+from sqlalchemy import func, select
 
 from app.travel_database import User, Entry, Travel, Achievement, Media
 from app.travel_session import Session
+from app.travel_cache import user_cache
 
 
 def validate_country(country: str) -> bool:
@@ -72,28 +70,62 @@ def validate_rating(rating_str: str) -> bool:
     except ValueError:
         return False
 
+def parse_coordinates(text: str):
+    """Разбирает "широта, долгота" или "широта долгота"; None, если формат или диапазон неверны"""
+    if not text:
+        return None
+    parts = text.replace(',', ' ').split()
+    if len(parts) != 2:
+        return None
+    try:
+        lat, lon = float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+        return None
+    return lat, lon
+
 def validate_date_within_travel(visit_date: datetime, travel_start: datetime, travel_end: datetime) -> bool:
     return travel_start <= visit_date <= travel_end
 
-def user_has_premium(tg_id: int) -> bool:
+async def user_has_premium(tg_id: int) -> bool:
+    user = await user_cache.resolve(tg_id)
+    return bool(user and user.premium)
+
+def media_limit(user) -> int:
+    return 8 if user and user.premium else 3
+
+async def can_add_media(tg_id: int, place_id: int) -> bool:
+    user = await user_cache.resolve(tg_id)
     session = Session()
     try:
-        user = session.query(User).filter_by(tg_id=tg_id).first()
-        if user and user.premium:
-            return True
-        return False
+        media_count = await session.scalar(
+            select(func.count(Media.media_id)).filter(Media.place_id == place_id)
+        )
+        return media_count < media_limit(user)
     finally:
-        session.close()
+        await session.close()
+
+async def save_media_batch(tg_id: int, place_id: int, media: list) -> tuple[int, int, int]:
+    """Сохраняет пачку медиа [(тип, file_id)] одной транзакцией с одной проверкой лимита.
 
-def can_add_media(tg_id: int, place_id: int) -> bool:
+    Возвращает (сохранено, всего медиа у места, лимит)
+    """
+    user = await user_cache.resolve(tg_id)
+    limit = media_limit(user)
     session = Session()
     try:
-        user = session.query(User).filter_by(tg_id=tg_id).first()
-        media_count = session.query(Media).filter_by(place_id=place_id).count()
-        limit = 8 if user.premium else 3
-        return media_count < limit
+        media_count = await session.scalar(
+            select(func.count(Media.media_id)).filter(Media.place_id == place_id)
+        )
+        accepted = media[:max(0, limit - media_count)]
+        if accepted:
+            session.add_all([Media(place_id=place_id, media_type=media_type, file_id=file_id)
+                             for media_type, file_id in accepted])
+            await session.commit()
+        return len(accepted), media_count + len(accepted), limit
     finally:
-        session.close()
+        await session.close()
 
 
 def date_difference(start_date, end_date):
@@ -110,29 +142,29 @@ def date_difference(start_date, end_date):
         print(f"❌ Ошибка вычисления длительности: {e}")
         return 0
 
-def check_achievements(user, session):
+async def check_achievements(user, session):
     new_achievements = []
 
     try:
-        finished_travels = session.query(Travel).filter(
+        finished_travels = await session.scalar(select(func.count(Travel.travel_id)).filter(
             Travel.user_id == user.user_id,
             Travel.end_date != None
-        ).count()
+        ))
 
-        places_count = session.query(Entry).join(Travel).filter(
+        places_count = await session.scalar(select(func.count(Entry.place_id)).join(Travel).filter(
             Travel.user_id == user.user_id
-        ).count()
+        ))
 
-        photos_count = session.query(Media).join(Entry).join(Travel).filter(
+        photos_count = await session.scalar(select(func.count(Media.media_id)).join(Entry).join(Travel).filter(
             Travel.user_id == user.user_id,
             Media.media_type == 'photo'
-        ).count()
+        ))
 
-        travels_with_dates = session.query(Travel).filter(
+        travels_with_dates = (await session.scalars(select(Travel).filter(
             Travel.user_id == user.user_id,
             Travel.end_date != None,
             Travel.start_date != None
-        ).all()
+        ))).all()
 
         has_long_trip_7 = False
         has_long_trip_30 = False
@@ -146,14 +178,14 @@ def check_achievements(user, session):
             elif duration >= 7:
                 has_long_trip_7 = True
 
-        has_10_rating = session.query(Entry).join(Travel).filter(
+        has_10_rating = await session.scalar(select(Entry.place_id).join(Travel).filter(
             Travel.user_id == user.user_id,
             Entry.place_rating == 10
-        ).first() is not None
+        ).limit(1)) is not None
 
-        countries_count = session.query(func.distinct(Travel.country)).filter(
+        countries_count = await session.scalar(select(func.count(func.distinct(Travel.country))).filter(
             Travel.user_id == user.user_id
-        ).count()
+        ))
 
         achievement_conditions = [
             ("FIRST_TRAVEL", "🎯 Первый шаг", "Завершите свое первое путешествие", finished_travels >= 1),
@@ -182,7 +214,7 @@ def check_achievements(user, session):
 
         for code, title, desc, achieved in achievement_conditions:
             if achieved:
-                exists = session.query(Achievement).filter_by(user_id=user.user_id, code=code).first()
+                exists = await session.scalar(select(Achievement).filter_by(user_id=user.user_id, code=code))
                 if not exists:
                     print(f"🎉 Новое достижение: {title}")
                     ach = Achievement(
@@ -277,8 +309,9 @@ class ProgressManager:
             sent_message = await bot.send_message(chat_id, text, parse_mode="HTML")
             return sent_message.message_id
 
-    async def update_progress(self, bot, chat_id: int, operation: str, percentage: int, step: str = ""):
-        """Обновляет прогресс-бар"""
+    async def update_progress(self, bot, chat_id: int, operation: str, percentage: int, step: str = "",
+                              reply_markup=None):
+        """Обновляет прогресс-бар; reply_markup - кнопки под ним (например, отмена)"""
         try:
             if chat_id not in self.progress_messages:
                 return
@@ -301,7 +334,8 @@ class ProgressManager:
                 chat_id=chat_id,
                 message_id=self.progress_messages[chat_id],
                 text=text,
-                parse_mode="HTML"
+                parse_mode="HTML",
+                reply_markup=reply_markup
             )
 
         except Exception as e:
@@ -355,11 +389,10 @@ class RateLimiter:
         # Дефолтные лимиты для разных категорий
         self.default_limits = {
             "default": {"max_requests": 10, "time_window": 60},
-            "heatmap": {"max_requests": 3, "time_window": 300},
+            "heatmap": {"max_requests": 10, "time_window": 60},
             "media_upload": {"max_requests": 10, "time_window": 120},
             "stats": {"max_requests": 5, "time_window": 60},
             "export": {"max_requests": 1, "time_window": 300},
-            "geocoding_api": {"max_requests": 50, "time_window": 60},
         }
 
     def is_allowed(self, user_id: int, category: str = "default", max_requests: int = None,
@@ -392,138 +425,6 @@ export_limiter = rate_limiter
 
 progress_manager = ProgressManager()
 
-def translate_text(text, target_lang='en'):
-    try:
-        url = "https://libretranslate.com/translate"
-        data = {
-            "q": text,
-            "source": "auto",
-            "target": target_lang,
-            "format": "text"
-        }
-        headers = {
-            "Content-Type": "application/json"
-        }
-
-        response = requests.post(url, json=data, headers=headers, timeout=10)
-        if response.status_code == 200:
-            result = response.json()
-            return result.get('translatedText', text)
-        else:
-            print(f"❌ LibreTranslate error: {response.status_code}")
-            return text
-
-    except Exception as e:
-        print(f"❌ Translation failed: {e}")
-        return text
-
-
-def translate_text_safe(text, target_lang='en'):
-    if not text or text.strip() == "":
-        return text
-    try:
-        return translate_text(text, target_lang)
-    except:
-        return text
-
-
-def has_cyrillic(text):
-    return bool(re.search('[а-яА-Я]', text)) if text else False
-
-def try_nominatim(query):
-    try:
-        url = "https://nominatim.openstreetmap.org/search"
-        params = {
-            "q": query,
-            "format": "json",
-            "limit": 1,
-            "addressdetails": 1,
-            "accept-language": "ru,en"
-        }
-        headers = {
-            "User-Agent": f"TravelBot/1.0 ({mail})",
-            "Accept-Language": "ru-RU,ru;q=0.9,en;q=0.8"
-        }
-
-        print(f"🔍 Nominatim запрос: {query}")
-        response = requests.get(url, params=params, headers=headers, timeout=20)
-
-        if response.status_code == 200:
-            data = response.json()
-            if data:
-                result = data[0]
-                lat = float(result['lat'])
-                lon = float(result['lon'])
-                display_name = result.get('display_name', 'N/A')[:100]
-                print(f"✅ Найдено: {lat}, {lon} -> {display_name}")
-                return lat, lon
-            else:
-                print(f"❌ Nominatim: нет результатов для '{query}'")
-                return None, None
-        else:
-            print(f"❌ Nominatim error {response.status_code}: {response.text[:200]}")
-            return None, None
-
-    except requests.exceptions.Timeout:
-        print(f"❌ Nominatim timeout для '{query}'")
-        return None, None
-    except Exception as e:
-        print(f"❌ Nominatim failed для '{query}': {e}")
-        return None, None
-
-
-def geocode_place(query):
-    if not query or query.strip() == "":
-        return None, None
-
-    lat, lon = try_nominatim(query)
-    if lat and lon:
-        return lat, lon
-
-    return None, None
-
-def geocoding(country, city, place_title):
-    if not rate_limiter.is_allowed("geocoding_api", "geocoding_api"):
-        logger.warning("Geocoding API rate limit exceeded")
-        return None, None
-
-    print(f"🎯 Геокодируем: {country}, {city}, {place_title}")
-
-    queries = []
-    if country and city and place_title:
-        queries.extend([
-            f"{country}, {city}, {place_title}",
-            f"{city}, {country}, {place_title}",
-            f"{place_title}, {city}, {country}",
-        ])
-    if city and place_title:
-        queries.extend([
-            f"{city}, {place_title}",
-            f"{place_title}, {city}",
-        ])
-    if place_title:
-        queries.append(place_title)
-    if has_cyrillic(place_title) or has_cyrillic(city):
-        place_en = translate_text_safe(place_title)
-        city_en = translate_text_safe(city)
-        country_en = translate_text_safe(country)
-
-        if place_en != place_title:
-            queries.extend([
-                f"{country_en}, {city_en}, {place_en}",
-                f"{city_en}, {place_en}",
-                place_en
-            ])
-    for query in queries:
-        if not query or query.strip() == "":
-            continue
-
-        lat, lon = try_nominatim(query)
-        if lat and lon:
-            return lat, lon
-
-    return None, None
-
 async def save_place_with_coordinates(msg: Message, state: FSMContext, lat: float, lon: float):
     data = await state.get_data()
     session = Session()
@@ -538,13 +439,13 @@ async def save_place_with_coordinates(msg: Message, state: FSMContext, lat: floa
             longitude=lon
         )
 
-        user = session.query(User).filter_by(tg_id=msg.from_user.id).first()
+        user = await user_cache.resolve(msg.from_user.id)
         session.add(entry)
-        session.commit()
+        await session.commit()
         await state.update_data(place_id=entry.place_id)
 
-        new_achievements = check_achievements(user, session)
-        session.commit()
+        new_achievements = await check_achievements(user, session)
+        await session.commit()
 
         for ach in new_achievements:
             await msg.answer(
@@ -563,7 +464,7 @@ async def save_place_with_coordinates(msg: Message, state: FSMContext, lat: floa
         await msg.answer("❌ Ошибка при сохранении места")
         return
     finally:
-        session.close()
+        await session.close()
 
 CONTINENTS = {
     'europe': {
@@ -658,12 +559,12 @@ def normalize_country_name(country):
         return ""
     return country.lower().strip()
 
-def get_user_continents(user_id, session):
-    user_countries = session.query(
-        func.distinct(Travel.country)
-    ).filter(Travel.user_id == user_id).all()
+async def get_user_continents(user_id, session):
+    user_countries = (await session.scalars(
+        select(func.distinct(Travel.country)).filter(Travel.user_id == user_id)
+    )).all()
 
-    user_countries = [country[0] for country in user_countries if country[0]]
+    user_countries = [country for country in user_countries if country]
 
     available_continents = set()
 
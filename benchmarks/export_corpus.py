@@ -0,0 +1,43 @@
+"""Выгружает реальные тройки (страна, город, место) из базы бота в CSV для geocode_bench.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.export_corpus corpus.csv --limit 1000
+"""
+import argparse
+import asyncio
+import csv
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import func, select
+
+from app.travel_database import Entry, Travel
+from app.travel_session import ReadSession, engine
+
+
+async def export_corpus(path: str, limit: int):
+    session = ReadSession()
+    try:
+        rows = (await session.execute(select(Travel.country, Entry.city, Entry.place_title).join(
+            Travel, Entry.travel_id == Travel.travel_id
+        ).where(
+            Entry.city.isnot(None), Entry.place_title.isnot(None)
+        ).distinct().order_by(func.random()).limit(limit))).all()
+    finally:
+        await session.close()
+        await engine.dispose()
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["country", "city", "place_title"])
+        writer.writerows(rows)
+    print(f"💾 Выгружено мест: {len(rows)} -> {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Выгрузка корпуса мест для бенчмарка геокодирования")
+    parser.add_argument("path")
+    parser.add_argument("--limit", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(export_corpus(args.path, args.limit))
@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+import random
+from collections import Counter
+
+from aiohttp import web
+
+from app.travel_gazetteer import gazetteer
+
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y',
+    'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
+}
+
+
+def transliterate(text: str) -> str:
+    return ''.join(TRANSLIT.get(ch.lower(), ch).capitalize() if ch.isupper() else TRANSLIT.get(ch, ch)
+                   for ch in text)
+
+
+class FakeServices:
+    """Локальная замена Nominatim и LibreTranslate для бенчмарков.
+
+    Задержка - логнормальная с медианой latency_ms. Часть запросов отвечает
+    503 (error_rate), 429 (throttle_rate) или зависает (timeout_rate).
+    Ответ Nominatim детерминирован по тексту запроса: found_rate запросов
+    находят точку рядом с городом из газеттира, far_rate из них - точку
+    в сотнях километров от него.
+    """
+
+    def __init__(self, latency_ms: float = 300, latency_sigma: float = 0.5, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, timeout_rate: float = 0.0, found_rate: float = 0.8,
+                 far_rate: float = 0.05, translate_latency_ms: float = 150, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.timeout_rate = timeout_rate
+        self.found_rate = found_rate
+        self.far_rate = far_rate
+        self.translate_latency_ms = translate_latency_ms
+        self.seed = seed
+        self.hang_seconds = 60
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.runner = None
+        self.url = None
+
+    async def delay(self, median_ms: float):
+        await asyncio.sleep(median_ms / 1000 * self.random.lognormvariate(0, self.latency_sigma))
+
+    def failure(self):
+        """Ответ-сбой для этого запроса или None"""
+        roll = self.random.random()
+        if roll < self.error_rate:
+            return web.Response(status=503, text="Service Unavailable")
+        if roll < self.error_rate + self.throttle_rate:
+            return web.Response(status=429, text="Too Many Requests")
+        return None
+
+    def answer(self, query: str):
+        """Детерминированный ответ на запрос: (lat, lon) или None"""
+        digest = hashlib.sha1(f"{self.seed}:{query.lower()}".encode('utf-8')).digest()
+        rng = random.Random(digest)
+        if rng.random() >= self.found_rate:
+            return None
+
+        center = (None, None)
+        for part in reversed([part.strip() for part in query.split(',')]):
+            center = gazetteer.lookup(part)
+            if center[0] is not None:
+                break
+
+        if center[0] is None:
+            return rng.uniform(-60, 70), rng.uniform(-180, 180)
+        if rng.random() < self.far_rate:
+            return center[0] + rng.choice((-1, 1)) * rng.uniform(3, 8), center[1] + rng.uniform(-8, 8)
+        return center[0] + rng.uniform(-0.05, 0.05), center[1] + rng.uniform(-0.05, 0.05)
+
+    async def search(self, request: web.Request):
+        self.calls["nominatim"] += 1
+        if self.random.random() < self.timeout_rate:
+            self.calls["nominatim.timeouts"] += 1
+            await asyncio.sleep(self.hang_seconds)
+
+        await self.delay(self.latency_ms)
+        response = self.failure()
+        if response is not None:
+            self.calls["nominatim.errors"] += 1
+            return response
+
+        query = request.query.get("q", "")
+        found = self.answer(query)
+        if found is None:
+            return web.json_response([])
+        lat, lon = found
+        return web.json_response([{"lat": str(lat), "lon": str(lon), "display_name": f"fake: {query}"}])
+
+    async def translate(self, request: web.Request):
+        self.calls["libretranslate"] += 1
+        await self.delay(self.translate_latency_ms)
+        response = self.failure()
+        if response is not None:
+            self.calls["libretranslate.errors"] += 1
+            return response
+
+        data = await request.json()
+        texts = data.get("q")
+        if isinstance(texts, list):
+            return web.json_response({"translatedText": [transliterate(text) for text in texts]})
+        return web.json_response({"translatedText": transliterate(texts or "")})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_get("/search", self.search)
+        app.router.add_post("/translate", self.translate)
+        # Зависшие запросы не должны задерживать остановку
+        self.runner = web.AppRunner(app, access_log=None, shutdown_timeout=1)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,264 @@
+"""Бенчмарк геокодирования на локальной замене Nominatim и LibreTranslate.
+
+Прогоняет корпус (страна, город, место) через geocoding() и другие стратегии
+и печатает p50/p95/p99 задержки, число запросов к сервисам на место,
+долю попаданий в кэш и долю найденных координат.
+
+    python -m benchmarks.geocode_bench --latency-ms 400 --error-rate 0.05 --passes 2
+
+Реальные сервисы не трогаются: адреса подменяются через NOMINATIM_URL и
+LIBRETRANSLATE_URL, а кэш живет во временной базе SQLite.
+"""
+import argparse
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import NamedTuple
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+# Ответ считается попавшим в город, если он не дальше этого от центра города из газеттира
+NEAR_CITY_KM = 100
+
+
+class Strategy(NamedTuple):
+    run: object
+    # Атрибуты app.travel_geocode, подменяемые на время прогона стратегии
+    overrides: dict
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк геокодирования на фейковом Nominatim")
+    parser.add_argument("--corpus", default=str(BENCH_DIR / "corpus.csv"),
+                        help="CSV с колонками country,city,place_title")
+    parser.add_argument("--strategy", action="append",
+                        help="стратегия из STRATEGIES (можно несколько раз); по умолчанию все")
+    parser.add_argument("--passes", type=int, default=2,
+                        help="проходов по корпусу без сброса кэша: первый холодный, дальше теплые")
+    parser.add_argument("--concurrency", type=int, default=4, help="сколько мест геокодируется одновременно")
+    parser.add_argument("--interval", type=float, default=0.05,
+                        help="NOMINATIM_INTERVAL для прогона (в проде 1 секунда)")
+    parser.add_argument("--latency-ms", type=float, default=300, help="медиана задержки Nominatim")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="разброс логнормальной задержки")
+    parser.add_argument("--translate-latency-ms", type=float, default=150, help="медиана задержки LibreTranslate")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="доля зависших запросов")
+    parser.add_argument("--found-rate", type=float, default=0.8, help="доля запросов, для которых есть ответ")
+    parser.add_argument("--far-rate", type=float, default=0.05, help="доля ответов далеко от города")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    parser.add_argument("--verbose", action="store_true", help="не глушить вывод геокодера")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def prepare_environment(args) -> int:
+    """Настраивает окружение до импорта приложения: конфиг читается при импорте"""
+    port = free_port()
+    os.environ["NOMINATIM_URL"] = f"http://127.0.0.1:{port}/search"
+    os.environ["LIBRETRANSLATE_URL"] = f"http://127.0.0.1:{port}/translate"
+    os.environ["NOMINATIM_INTERVAL"] = str(args.interval)
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='geocode_bench_')}/bench.db"
+    os.environ.pop("DATABASE_REPLICA_URL", None)
+    return port
+
+
+def load_corpus(path: str) -> list:
+    with open(path, encoding='utf-8', newline='') as f:
+        return [(row["country"], row["city"], row["place_title"]) for row in csv.DictReader(f)]
+
+
+def percentile(values, q: float) -> float:
+    import numpy as np
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+async def geocoding_strategy(country, city, place_title):
+    from app.travel_geocode import geocoding
+    return await geocoding(country, city, place_title)
+
+
+async def network_only_strategy(country, city, place_title):
+    """Только варианты запроса к Nominatim, без офлайн-газеттира"""
+    from app.travel_geocode import geocode_candidates
+    found = await geocode_candidates(country, city, place_title)
+    return (found[0], found[1]) if found else (None, None)
+
+
+STRATEGIES = {
+    "geocoding": Strategy(geocoding_strategy, {}),
+    "sequential": Strategy(geocoding_strategy, {"geocode_concurrency": 1}),
+    "network_only": Strategy(network_only_strategy, {}),
+}
+
+
+async def reset_state():
+    """Холодный старт стратегии: пустые кэши, статистика вариантов и замкнутые предохранители"""
+    from sqlalchemy import delete
+    import app.travel_geocode as travel_geocode
+    from app.travel_breaker import CircuitBreaker
+    from app.travel_cache import geocode_cache, translation_cache
+    from app.travel_database import GeocodeResult, Translation
+    from app.travel_session import Session
+
+    geocode_cache.entries.clear()
+    translation_cache.entries.clear()
+    session = Session()
+    try:
+        await session.execute(delete(GeocodeResult))
+        await session.execute(delete(Translation))
+        await session.commit()
+    finally:
+        await session.close()
+
+    travel_geocode.variant_stats = travel_geocode.VariantStats()
+    for breaker in (travel_geocode.nominatim_breaker, travel_geocode.libretranslate_breaker):
+        fresh = CircuitBreaker(breaker.name, breaker.failure_threshold, breaker.reset_timeout)
+        breaker.__dict__.update(fresh.__dict__)
+
+
+async def drain():
+    """Ждет запросы, которые хеджирование уже отпустило, но Nominatim еще обрабатывает"""
+    from app.travel_geocode import nominatim_scheduler
+    while nominatim_scheduler.inflight or not nominatim_scheduler.queue.empty():
+        await asyncio.sleep(0.05)
+
+
+def counters_delta(before: dict, after: dict) -> Counter:
+    return Counter({name: after.get(name, 0) - before.get(name, 0) for name in after})
+
+
+async def replay(strategy: Strategy, corpus: list, fake, concurrency: int, verbose: bool) -> dict:
+    from app.travel_metrics import metrics
+    from app.travel_geocode import distance_km
+    from app.travel_gazetteer import gazetteer
+
+    latencies = []
+    found = 0
+    near_city = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    counters_before = dict(metrics.counters)
+    calls_before = Counter(fake.calls)
+
+    async def run_one(country, city, place_title):
+        nonlocal found, near_city
+        async with semaphore:
+            started = time.perf_counter()
+            lat, lon = await strategy.run(country, city, place_title)
+            latencies.append(time.perf_counter() - started)
+        if lat is not None:
+            found += 1
+            center = gazetteer.lookup(city, country)
+            if center[0] is None or distance_km(lat, lon, *center) <= NEAR_CITY_KM:
+                near_city += 1
+
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    started = time.perf_counter()
+    with output:
+        await asyncio.gather(*(run_one(*row) for row in corpus))
+        elapsed = time.perf_counter() - started
+        await drain()
+
+    counters = counters_delta(counters_before, dict(metrics.counters))
+    calls = fake.calls - calls_before
+    lookups = counters["geocode_cache.hits"] + counters["geocode_cache.negative_hits"] + \
+        counters["geocode_cache.misses"]
+    places = len(corpus)
+    return {
+        "places": places,
+        "seconds": round(elapsed, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "nominatim_per_place": round(calls["nominatim"] / places, 2),
+        "translate_per_place": round(calls["libretranslate"] / places, 2),
+        "upstream_errors": calls["nominatim.errors"] + calls["libretranslate.errors"],
+        "cache_hit_rate": round((counters["geocode_cache.hits"] + counters["geocode_cache.negative_hits"]) /
+                                lookups, 3) if lookups else 0.0,
+        "success_rate": round(found / places, 3),
+        "near_city_rate": round(near_city / places, 3),
+        "gazetteer_fallbacks": int(counters["geocode.gazetteer_fallbacks"]),
+        "budget_exhausted": int(counters["geocode.budget_exhausted"]),
+    }
+
+
+def print_report(results: list, columns: list = None):
+    columns = columns or ["strategy", "pass", "p50_ms", "p95_ms", "p99_ms", "nominatim_per_place",
+                          "translate_per_place", "cache_hit_rate", "success_rate", "near_city_rate",
+                          "upstream_errors", "seconds"]
+    widths = [max(len(column), *(len(str(row[column])) for row in results)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in results:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+async def main(args, port: int):
+    import app.travel_geocode as travel_geocode
+    from app.travel_database import Base
+    from app.travel_gazetteer import gazetteer
+    from app.travel_http import close_http_session
+    from app.travel_session import engine
+    from benchmarks.fake_services import FakeServices
+
+    names = args.strategy or list(STRATEGIES)
+    unknown = [name for name in names if name not in STRATEGIES]
+    if unknown:
+        raise SystemExit(f"❌ Неизвестные стратегии: {', '.join(unknown)}; есть: {', '.join(STRATEGIES)}")
+
+    corpus = load_corpus(args.corpus)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    gazetteer.load()
+
+    fake = FakeServices(latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+                        error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                        timeout_rate=args.timeout_rate, found_rate=args.found_rate, far_rate=args.far_rate,
+                        translate_latency_ms=args.translate_latency_ms, seed=args.seed)
+    await fake.start(port=port)
+    print(f"🧪 Фейковые сервисы: {fake.url}, корпус: {len(corpus)} мест")
+
+    results = []
+    try:
+        for name in names:
+            strategy = STRATEGIES[name]
+            await reset_state()
+            saved = {attr: getattr(travel_geocode, attr) for attr in strategy.overrides}
+            for attr, value in strategy.overrides.items():
+                setattr(travel_geocode, attr, value)
+            try:
+                for number in range(1, args.passes + 1):
+                    result = await replay(strategy, corpus, fake, args.concurrency, args.verbose)
+                    results.append({"strategy": name, "pass": number, **result})
+            finally:
+                for attr, value in saved.items():
+                    setattr(travel_geocode, attr, value)
+    finally:
+        await close_http_session()
+        await fake.stop()
+        await engine.dispose()
+
+    print_report(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"💾 Результаты сохранены в {args.json}")
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    asyncio.run(main(arguments, prepare_environment(arguments)))
@@ -0,0 +1,130 @@
+"""Бенчмарк рендера тепловых карт на локальном тайл-сервере.
+
+Рендерит наборы точек вокруг городов газеттира в трех состояниях кэша тайлов:
+cold (пустые память и диск), disk (тайлы только на диске) и memory, и печатает
+p50/p95/p99 задержки и число запросов к тайл-серверу на карту.
+
+    python -m benchmarks.heatmap_bench --maps 30 --tile-latency-ms 80
+
+Сеть не нужна: подложку отдает офлайн TileServer с синтетическими тайлами,
+дисковый кэш живет во временной папке.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+from benchmarks.geocode_bench import free_port, percentile, print_report
+
+PHASES = ("cold", "disk", "memory")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк рендера тепловых карт на локальном тайл-сервере")
+    parser.add_argument("--maps", type=int, default=30, help="сколько разных карт рендерить в каждой фазе")
+    parser.add_argument("--points", type=int, default=40, help="мест на карте")
+    parser.add_argument("--cities", type=int, default=3, help="городов, вокруг которых разбросаны места")
+    parser.add_argument("--concurrency", type=int, default=2, help="сколько карт рендерится одновременно")
+    parser.add_argument("--tile-latency-ms", type=float, default=80, help="задержка ответа тайл-сервера")
+    parser.add_argument("--workers", type=int, default=2, help="EXECUTOR_WORKERS для прогона")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    return parser.parse_args()
+
+
+def prepare_environment(args) -> int:
+    """Настраивает окружение до импорта приложения: конфиг читается при импорте"""
+    port = free_port()
+    os.environ["HEATMAP_TILE_URL"] = f"http://127.0.0.1:{port}/{{z}}/{{x}}/{{y}}.png"
+    os.environ["HEATMAP_TILE_DIR"] = tempfile.mkdtemp(prefix="heatmap_bench_")
+    os.environ["HEATMAP_RENDERER"] = "native"
+    os.environ["EXECUTOR_WORKERS"] = str(args.workers)
+    return port
+
+
+def point_sets(args) -> list:
+    """Наборы [lat, lon]: места разбросаны в паре десятков километров вокруг случайных городов"""
+    from app.travel_gazetteer import gazetteer
+
+    rng = random.Random(args.seed)
+    lats, lons = gazetteer.arrays['lat'], gazetteer.arrays['lon']
+    sets = []
+    for _ in range(args.maps):
+        centers = [(float(lats[i]), float(lons[i])) for i in rng.sample(range(len(lats)), args.cities)]
+        sets.append([[lat + rng.gauss(0, 0.15), lon + rng.gauss(0, 0.15)]
+                     for lat, lon in (rng.choice(centers) for _ in range(args.points))])
+    return sets
+
+
+async def replay(sets: list, server, concurrency: int) -> dict:
+    from app.travel_heatmap import render_heatmap
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    tiles_before = server.calls["tiles"]
+
+    async def run_one(points):
+        async with semaphore:
+            started = time.perf_counter()
+            await render_heatmap(points)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_one(points) for points in sets))
+    return {
+        "maps": len(sets),
+        "seconds": round(time.perf_counter() - started, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "tiles_per_map": round((server.calls["tiles"] - tiles_before) / len(sets), 2),
+    }
+
+
+async def main(args, port: int):
+    from app.travel_executor import process_executor
+    from app.travel_gazetteer import gazetteer
+    from app.travel_heatmap import tile_cache
+    from app.travel_http import close_http_session
+    from app.travel_tiles import TileServer, tile_store
+
+    gazetteer.load()
+    if not gazetteer.arrays or len(gazetteer.arrays['lat']) < args.cities:
+        raise SystemExit("❌ В газеттире слишком мало городов")
+    sets = point_sets(args)
+
+    server = TileServer(offline=True, latency_ms=args.tile_latency_ms)
+    await server.start(port=port)
+    print(f"🧪 Тайл-сервер: {server.url}, дисковый кэш: {tile_store.directory}, карт: {len(sets)}")
+    await process_executor.warm()
+
+    results = []
+    try:
+        for phase in PHASES:
+            # disk - память пуста, но тайлы уже лежат на диске после cold
+            if phase in ("cold", "disk"):
+                tile_cache.entries.clear()
+            result = await replay(sets, server, args.concurrency)
+            results.append({"strategy": "native", "pass": phase, **result})
+    finally:
+        await close_http_session()
+        await server.stop()
+        await process_executor.close()
+
+    print_report(results, ["strategy", "pass", "p50_ms", "p95_ms", "p99_ms", "tiles_per_map", "seconds"])
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"💾 Результаты сохранены в {args.json}")
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    asyncio.run(main(arguments, prepare_environment(arguments)))
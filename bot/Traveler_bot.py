@@ -3,21 +3,29 @@ import logging
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from handlers.reminder import send_reminders
 from aiogram import Bot, Dispatcher
-from bot.config import token
+from bot.config import token, heatmap_renderer, heatmap_tile_server_port
 from app.travel_session import engine
 from app.travel_database import Base
-from app.travel_scheduler import premium_management_scheduler
+from app.travel_scheduler import premium_management_scheduler, reconcile_user_counters, backfill_entry_countries
 from aiogram.types import ErrorEvent, Message, CallbackQuery
 from datetime import datetime, timedelta
 from handlers import routers
 from app.travel_utils import rate_limiter
+from app.travel_cache import user_cache, geocode_cache
+from app.travel_http import close_http_session
+from app.travel_gazetteer import gazetteer
+from app.travel_geocode_worker import geocode_worker
+from app.travel_executor import process_executor
+from app.travel_album import album_middleware
+from app.travel_session import current_user_id
+
+logger = logging.getLogger(__name__)
 
 bot = Bot(token=token)
 dp = Dispatcher()
 
 
 async def global_error_handler(event: ErrorEvent):
-    logger = logging.getLogger(__name__)
     logger.error(f"Global error: {event.exception}", exc_info=True)
 
     try:
@@ -97,6 +105,30 @@ async def rate_limit_middleware(handler, event, data):
     return await handler(event, data)
 
 
+async def user_middleware(handler, event, data):
+    """Один раз на апдейт находит пользователя и передает его хендлерам как user"""
+    from_user = data.get("event_from_user")
+    if from_user:
+        current_user_id.set(from_user.id)
+    data["user"] = await user_cache.resolve(from_user.id) if from_user else None
+    return await handler(event, data)
+
+
+def pending_migrations(connection):
+    """Ревизия базы и head цепочки Alembic, если база отстает, иначе None"""
+    import os
+    from alembic.config import Config
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    config = Config(os.path.join(root, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(root, "migrations"))
+    head = ScriptDirectory.from_config(config).get_current_head()
+    current = MigrationContext.configure(connection).get_current_revision()
+    return (current, head) if current != head else None
+
+
 async def setup_bot():
     try:
         for router in routers:
@@ -104,20 +136,51 @@ async def setup_bot():
 
         scheduler = AsyncIOScheduler()
         scheduler.add_job(send_reminders, 'cron', hour=12, minute=0, args=[bot])
+        scheduler.add_job(reconcile_user_counters, 'cron', hour=4, minute=0)
+        scheduler.add_job(geocode_cache.purge_expired, 'cron', hour=4, minute=30)
+        scheduler.add_job(backfill_entry_countries, 'cron', hour=4, minute=45)
         scheduler.start()
 
         dp.error.register(global_error_handler)
+        dp.shutdown.register(close_http_session)
+        # Альбом собирается до фильтров и лимита: один апдейт на все его фото и видео
+        dp.message.outer_middleware(album_middleware)
         dp.message.middleware(rate_limit_middleware)
         dp.callback_query.middleware(rate_limit_middleware)
+        dp.message.middleware(user_middleware)
+        dp.callback_query.middleware(user_middleware)
+
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            # create_all не добавляет колонки в существующие таблицы - без миграций запросы упадут
+            pending = await conn.run_sync(pending_migrations)
+        if pending:
+            logger.warning(
+                f"⚠️ База на ревизии {pending[0] or '(нет)'}, а миграции уже на {pending[1]} - выполните alembic upgrade head"
+            )
 
-        import asyncio
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, lambda: Base.metadata.create_all(bind=engine))
+        # Сборка индекса газеттира при первом запуске не должна держать event loop
+        await asyncio.to_thread(gazetteer.load)
 
         asyncio.create_task(premium_management_scheduler(bot))
+        geocode_worker.start(bot)
+
+        # Процессы пула поднимаются в фоне, чтобы не задерживать старт
+        asyncio.create_task(process_executor.warm())
+        dp.shutdown.register(process_executor.close)
+
+        if heatmap_renderer == "folium":
+            # Браузеры поднимаются в фоне: первый рендер не платит за их запуск
+            from app.travel_browser import browser_pool
+            asyncio.create_task(browser_pool.start())
+            dp.shutdown.register(browser_pool.close)
+
+            if heatmap_tile_server_port:
+                from app.travel_tiles import TileServer, tile_store
+                tile_server = TileServer(tile_store)
+                await tile_server.start(port=heatmap_tile_server_port)
+                dp.shutdown.register(tile_server.stop)
 
-        import logging
-        logger = logging.getLogger(__name__)
         logger.info("✅ Бот настроен и готов к работе!")
 
     except Exception as e:
@@ -3,4 +3,105 @@ import os
 token = os.getenv("token")
 admin_id = int(os.getenv("admin_id", 0))
 mail = os.getenv("mail")
-card = os.getenv("card")
\ No newline at end of file
+card = os.getenv("card")
+
+# Пул соединений с базой данных
+db_pool_size = int(os.getenv("DB_POOL_SIZE", 5))
+db_max_overflow = int(os.getenv("DB_MAX_OVERFLOW", 10))
+db_pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", 30))
+db_pool_recycle = int(os.getenv("DB_POOL_RECYCLE", 1800))
+db_pool_pre_ping = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+db_statement_cache_size = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 500))
+db_echo = os.getenv("DB_ECHO", "0") == "1"
+
+# Профиль SQLite: WAL, отдельные соединения на чтение, один писатель
+sqlite_readers = int(os.getenv("SQLITE_READERS", 4))
+sqlite_write_timeout = float(os.getenv("SQLITE_WRITE_TIMEOUT", 60))
+sqlite_synchronous = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+sqlite_mmap_size = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+sqlite_cache_size = int(os.getenv("SQLITE_CACHE_SIZE", -64 * 1024))
+sqlite_busy_timeout = int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000))
+
+# Реплика Postgres для read-only хендлеров
+database_replica_url = os.getenv("DATABASE_REPLICA_URL")
+replica_sticky_seconds = float(os.getenv("REPLICA_STICKY_SECONDS", 10))
+
+# Кэш пользователей по tg_id
+user_cache_size = int(os.getenv("USER_CACHE_SIZE", 2048))
+user_cache_ttl = float(os.getenv("USER_CACHE_TTL", 60))
+
+# Внешние HTTP-сервисы (Nominatim, LibreTranslate)
+nominatim_url = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+libretranslate_url = os.getenv("LIBRETRANSLATE_URL", "https://libretranslate.com/translate")
+http_pool_size = int(os.getenv("HTTP_POOL_SIZE", 20))
+geocode_request_timeout = float(os.getenv("GEOCODE_REQUEST_TIMEOUT", 6))
+geocode_budget = float(os.getenv("GEOCODE_BUDGET", 20))
+translate_timeout = float(os.getenv("TRANSLATE_TIMEOUT", 4))
+nominatim_interval = float(os.getenv("NOMINATIM_INTERVAL", 1.0))
+geocode_concurrency = int(os.getenv("GEOCODE_CONCURRENCY", 3))
+# Отбрасывать ответы Nominatim дальше N км от центра города из газеттира; 0 - не отбрасывать
+geocode_max_city_distance_km = float(os.getenv("GEOCODE_MAX_CITY_DISTANCE_KM", 0))
+breaker_failure_threshold = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+breaker_reset_timeout = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))
+
+# Кэш геокодирования: LRU в памяти перед таблицей geocode_cache
+geocode_cache_size = int(os.getenv("GEOCODE_CACHE_SIZE", 4096))
+geocode_hit_ttl = float(os.getenv("GEOCODE_HIT_TTL", 30 * 24 * 3600))
+geocode_miss_ttl = float(os.getenv("GEOCODE_MISS_TTL", 24 * 3600))
+translation_cache_size = int(os.getenv("TRANSLATION_CACHE_SIZE", 4096))
+
+# Офлайн-газеттир городов (формат GeoNames)
+# Полный справочник скачивает python -m app.travel_gazetteer download в data/geonames;
+# пока его нет, работает маленький встроенный data/gazetteer
+gazetteer_full_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "geonames")
+gazetteer_seed_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "gazetteer")
+gazetteer_dir = os.getenv("GAZETTEER_DIR", gazetteer_full_dir if os.path.exists(os.path.join(gazetteer_full_dir, "cities.txt")) else gazetteer_seed_dir)
+gazetteer_index_dir = os.getenv("GAZETTEER_INDEX_DIR", os.path.join(gazetteer_dir, "index"))
+reverse_geocode_max_km = float(os.getenv("REVERSE_GEOCODE_MAX_KM", 75))
+
+# Тепловая карта: рендер в процессе, подложка из тайлов CartoDB
+heatmap_width = int(os.getenv("HEATMAP_WIDTH", 1024))
+heatmap_height = int(os.getenv("HEATMAP_HEIGHT", 768))
+heatmap_tile_url = os.getenv("HEATMAP_TILE_URL", "https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}.png")
+heatmap_tile_timeout = float(os.getenv("HEATMAP_TILE_TIMEOUT", 5))
+heatmap_tile_cache_size = int(os.getenv("HEATMAP_TILE_CACHE_SIZE", 256))
+# Дисковый кэш тайлов (z/x/y.png) с вытеснением по размеру; 0 - не хранить тайлы на диске
+heatmap_tile_dir = os.getenv("HEATMAP_TILE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "tiles"))
+heatmap_tile_disk_mb = float(os.getenv("HEATMAP_TILE_DISK_MB", 512))
+# Порт локального тайл-сервера поверх дискового кэша (для рендера folium); 0 - не запускать
+heatmap_tile_server_port = int(os.getenv("HEATMAP_TILE_SERVER_PORT", 0))
+# native - NumPy + Pillow, folium - скриншот страницы в пуле headless-браузеров
+heatmap_renderer = os.getenv("HEATMAP_RENDERER", "native")
+# Готовые карты (PNG и file_id Telegram) по версии данных пользователя
+heatmap_cache_size = int(os.getenv("HEATMAP_CACHE_SIZE", 512))
+heatmap_cache_max_mb = float(os.getenv("HEATMAP_CACHE_MAX_MB", 64))
+
+# Пул headless-браузеров для рендера folium
+browser_name = os.getenv("BROWSER_NAME", "firefox")
+browser_pool_size = int(os.getenv("BROWSER_POOL_SIZE", 2))
+browser_max_renders = int(os.getenv("BROWSER_MAX_RENDERS", 50))
+browser_memory_limit_mb = float(os.getenv("BROWSER_MEMORY_LIMIT_MB", 600))
+browser_render_timeout = float(os.getenv("BROWSER_RENDER_TIMEOUT", 20))
+browser_queue_timeout = float(os.getenv("BROWSER_QUEUE_TIMEOUT", 30))
+browser_health_interval = float(os.getenv("BROWSER_HEALTH_INTERVAL", 60))
+browser_tiles_wait = float(os.getenv("BROWSER_TILES_WAIT", 5))
+
+# Пул процессов для CPU-тяжелых задач: рендер карт, сборка архивов экспорта
+# EXECUTOR_WORKERS=0 - выполнять их в отдельном потоке, без процессов
+executor_workers = int(os.getenv("EXECUTOR_WORKERS", 2))
+executor_queue_size = int(os.getenv("EXECUTOR_QUEUE_SIZE", 32))
+executor_job_timeout = float(os.getenv("EXECUTOR_JOB_TIMEOUT", 60))
+executor_max_tasks_per_child = int(os.getenv("EXECUTOR_MAX_TASKS_PER_CHILD", 200))
+executor_start_method = os.getenv("EXECUTOR_START_METHOD", "spawn")
+heatmap_render_timeout = float(os.getenv("HEATMAP_RENDER_TIMEOUT", 20))
+export_build_timeout = float(os.getenv("EXPORT_BUILD_TIMEOUT", 180))
+
+# Сохранять место сразу, а координаты искать фоновым воркером
+geocode_in_background = os.getenv("GEOCODE_IN_BACKGROUND", "1") == "1"
+geocode_workers = int(os.getenv("GEOCODE_WORKERS", 2))
+geocode_queue_size = int(os.getenv("GEOCODE_QUEUE_SIZE", 1000))
+# Повторы места, на котором воркер упал (ошибка базы, исключение геокодера), с паузой retry_delay * номер попытки
+geocode_retries = int(os.getenv("GEOCODE_RETRIES", 2))
+geocode_retry_delay = float(os.getenv("GEOCODE_RETRY_DELAY", 30))
+# Доступ к /metrics вебхук-сервера: заголовок X-Metrics-Token или ?token=; без токена эндпоинт выключен
+metrics_token = os.getenv("METRICS_TOKEN")
@@ -2,6 +2,7 @@ from math import floor
 
 from aiogram import F, Router
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from sqlalchemy import select
 
 from app.travel_session import Session
 from app.travel_database import Achievement, User
@@ -13,16 +14,15 @@ router = Router()
 
 
 @router.callback_query(F.data == "achievements")
-async def view_achievements(callback: CallbackQuery):
+async def view_achievements(callback: CallbackQuery, user: User | None):
     session = Session()
 
-    user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
     if not user:
         await callback.answer("Пользователь не найден.", show_alert=True)
-        session.close()
+        await session.close()
         return
 
-    unlocked_achievements = session.query(Achievement).filter_by(user_id=user.user_id).all()
+    unlocked_achievements = (await session.scalars(select(Achievement).filter_by(user_id=user.user_id))).all()
     unlocked_codes = {a.code for a in unlocked_achievements}
 
     total = len(ALL_ACHIEVEMENTS)
@@ -47,16 +47,15 @@ async def view_achievements(callback: CallbackQuery):
             reply_markup=kb.achievements_keyboard
         )
     finally:
-        session.close()
+        await session.close()
 
 
 @router.callback_query(F.data == "refresh_achievements")
-async def refresh_achievements(callback: CallbackQuery):
+async def refresh_achievements(callback: CallbackQuery, user: User | None):
     session = Session()
     try:
         print("=== REFRESH ACHIEVEMENTS STARTED ===")
 
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
         if not user:
             print("❌ User not found")
             await callback.answer("Пользователь не найден.", show_alert=True)
@@ -66,7 +65,7 @@ async def refresh_achievements(callback: CallbackQuery):
 
         # Проверяем новые достижения
         try:
-            new_achievements = check_achievements(user, session)
+            new_achievements = await check_achievements(user, session)
             print(f"✅ Checked achievements, found {len(new_achievements)} new")
         except Exception as e:
             print(f"❌ Error in check_achievements: {e}")
@@ -77,7 +76,7 @@ async def refresh_achievements(callback: CallbackQuery):
 
         # Получаем обновленный список
         try:
-            unlocked_achievements = session.query(Achievement).filter_by(user_id=user.user_id).all()
+            unlocked_achievements = (await session.scalars(select(Achievement).filter_by(user_id=user.user_id))).all()
             unlocked_codes = {a.code for a in unlocked_achievements}
             print(f"📊 Unlocked achievements: {len(unlocked_codes)}")
         except Exception as e:
@@ -139,5 +138,5 @@ async def refresh_achievements(callback: CallbackQuery):
         traceback.print_exc()
         await callback.answer("❌ Ошибка обновления", show_alert=True)
     finally:
-        session.close()
+        await session.close()
         print("=== REFRESH ACHIEVEMENTS COMPLETED ===")
\ No newline at end of file
@@ -2,9 +2,10 @@ from aiogram import F, Router
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
-from sqlalchemy import desc, func
-from app.travel_session import Session
+from sqlalchemy import desc, func, select
+from app.travel_session import ReadSession
 from app.travel_database import User, Travel, Entry, Achievement
+from app.travel_scheduler import reconcile_user_counters
 from app.traveler_keyboard import menu_keyboard
 
 router = Router()
@@ -59,20 +60,20 @@ async def admin_command(message: Message):
 
 @router.callback_query(F.data == "admin_stats")
 async def admin_stats(callback: CallbackQuery):
-    session = Session()
+    session = ReadSession()
     try:
-        total_users = session.query(User).count()
-        total_travels = session.query(Travel).count()
-        total_entries = session.query(Entry).count()
-        active_users = session.query(User).join(Travel).distinct().count()
-        premium_users = session.query(User).filter(User.premium == True).count()
+        total_users = await session.scalar(select(func.count(User.user_id)))
+        total_travels = await session.scalar(select(func.count(Travel.travel_id)))
+        total_entries = await session.scalar(select(func.count(Entry.place_id)))
+        active_users = await session.scalar(select(func.count(func.distinct(Travel.user_id))))
+        premium_users = await session.scalar(select(func.count(User.user_id)).filter(User.premium == True))
 
-        total_achievements = session.query(Achievement).count()
+        total_achievements = await session.scalar(select(func.count(Achievement.achievement_id)))
 
-        active_users_stats = session.query(
+        active_users_stats = (await session.execute(select(
             User.name,
             func.count(Travel.travel_id).label('travel_count')
-        ).join(Travel).group_by(User.user_id).order_by(desc('travel_count')).limit(5).all()
+        ).join(Travel).group_by(User.user_id).order_by(desc('travel_count')).limit(5))).all()
 
         stats_text = (
             "📊 <b>Общая статистика бота</b>\n\n"
@@ -100,14 +101,18 @@ async def admin_stats(callback: CallbackQuery):
             reply_markup=get_admin_back_keyboard()
         )
     finally:
-        session.close()
+        await session.close()
 
 
 @router.callback_query(F.data == "admin_users")
 async def admin_users(callback: CallbackQuery):
-    session = Session()
+    session = ReadSession()
     try:
-        users = session.query(User).order_by(desc(User.created_at)).limit(15).all()
+        travel_count = (select(func.count(Travel.travel_id)).where(Travel.user_id == User.user_id)
+                        .correlate(User).scalar_subquery())
+        users = (await session.execute(
+            select(User, travel_count).order_by(desc(User.created_at)).limit(15)
+        )).all()
 
         if not users:
             await callback.message.edit_text(
@@ -118,8 +123,7 @@ async def admin_users(callback: CallbackQuery):
 
         users_text = "👥 <b>Последние 15 пользователей</b>\n\n"
 
-        for i, user in enumerate(users, 1):
-            user_travels = session.query(Travel).filter_by(user_id=user.user_id).count()
+        for i, (user, user_travels) in enumerate(users, 1):
             premium_status = "💎" if user.premium else "🔹"
             created = user.created_at.strftime("%d.%m.%Y") if user.created_at else "N/A"
 
@@ -141,14 +145,20 @@ async def admin_users(callback: CallbackQuery):
             reply_markup=get_admin_back_keyboard()
         )
     finally:
-        session.close()
+        await session.close()
 
 
 @router.callback_query(F.data == "admin_travels")
 async def admin_travels(callback: CallbackQuery):
-    session = Session()
+    session = ReadSession()
     try:
-        travels = session.query(Travel).order_by(desc(Travel.created_at)).limit(10).all()
+        entries_count = (select(func.count(Entry.place_id)).where(Entry.travel_id == Travel.travel_id)
+                         .correlate(Travel).scalar_subquery())
+        travels = (await session.execute(
+            select(Travel, User.user_id, User.name, entries_count)
+            .outerjoin(User, User.user_id == Travel.user_id)
+            .order_by(desc(Travel.created_at)).limit(10)
+        )).all()
 
         if not travels:
             await callback.message.edit_text(
@@ -159,10 +169,8 @@ async def admin_travels(callback: CallbackQuery):
 
         travels_text = "✈️ <b>Последние 10 путешествий</b>\n\n"
 
-        for i, travel in enumerate(travels, 1):
-            user = session.query(User).filter_by(user_id=travel.user_id).first()
-            user_name = user.name if user else "Неизвестно"
-            entries_count = session.query(Entry).filter_by(travel_id=travel.travel_id).count()
+        for i, (travel, owner_id, owner_name, entries_count) in enumerate(travels, 1):
+            user_name = owner_name if owner_id is not None else "Неизвестно"
 
             travels_text += (
                 f"{i}. 🌍 <b>{travel.country}</b>\n"
@@ -182,20 +190,22 @@ async def admin_travels(callback: CallbackQuery):
             reply_markup=get_admin_back_keyboard()
         )
     finally:
-        session.close()
+        await session.close()
 
 
 @router.callback_query(F.data == "admin_achievements")
 async def admin_achievements(callback: CallbackQuery):
-    session = Session()
+    session = ReadSession()
     try:
-        achievements_stats = session.query(
+        achievements_stats = (await session.execute(select(
             Achievement.achievement_name,
             func.count(Achievement.achievement_id).label('count')
-        ).group_by(Achievement.achievement_name).all()
+        ).group_by(Achievement.achievement_name))).all()
 
-        total_achievements_given = session.query(Achievement).count()
-        unique_users_with_achievements = session.query(Achievement.user_id).distinct().count()
+        total_achievements_given, unique_users_with_achievements = (await session.execute(select(
+            func.count(Achievement.achievement_id),
+            func.count(func.distinct(Achievement.user_id))
+        ))).one()
 
         achievements_text = (
             "🏆 <b>Статистика достижений</b>\n\n"
@@ -219,7 +229,7 @@ async def admin_achievements(callback: CallbackQuery):
             reply_markup=get_admin_back_keyboard()
         )
     finally:
-        session.close()
+        await session.close()
 
 
 @router.callback_query(F.data == "admin_manage")
@@ -244,9 +254,29 @@ async def admin_broadcast(callback: CallbackQuery):
 
 @router.callback_query(F.data == "admin_recalc_stats")
 async def admin_recalc_stats(callback: CallbackQuery):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("❌ Недостаточно прав", show_alert=True)
+        return
+
     await callback.message.edit_text(
         "🔄 <b>Пересчет статистики</b>\n\n"
-        "Функция в разработке...",
+        "⏳ Сверяем счетчики пользователей...",
+        parse_mode='HTML'
+    )
+
+    try:
+        checked, fixed = await reconcile_user_counters()
+        text = (
+            "🔄 <b>Пересчет статистики</b>\n\n"
+            f"👥 Проверено пользователей: <b>{checked}</b>\n"
+            f"🛠️ Исправлено счетчиков: <b>{fixed}</b>"
+        )
+    except Exception as e:
+        print(f"❌ Ошибка пересчета статистики: {e}")
+        text = f"❌ Ошибка при пересчете статистики: {str(e)}"
+
+    await callback.message.edit_text(
+        text,
         reply_markup=get_admin_back_keyboard(),
         parse_mode='HTML'
     )
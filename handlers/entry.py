@@ -5,29 +5,36 @@ from aiogram import F, Router
 from aiogram.dispatcher.middlewares import data
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
+from sqlalchemy import select, update
 
 from app.travel_session import Session
+from app.travel_cache import user_cache
 from app.travel_states import EntryState
-from app.travel_database import Entry, Travel, User
+from app.travel_database import Entry, Travel, User, GEOCODE_PENDING, bump_data_version
 from app.travel_utils import (
     validate_city,
     validate_place_title,
     validate_comment,
     validate_rating,
-    geocoding,
+    parse_coordinates,
     save_place_with_coordinates, progress_manager, check_achievements, validate_date_within_travel, validate_date
 )
+from app.travel_geocode import geocoding, geocoder_available
+from app.travel_geocode_worker import geocode_later
+from app.travel_gazetteer import gazetteer
+from bot.config import geocode_in_background
 import app.traveler_keyboard as kb
 
 router = Router()
 
 
-async def save_place_with_coordinates_local(msg: Message, state: FSMContext, lat: float, lon: float):
+async def save_place_with_coordinates_local(msg: Message, state: FSMContext, lat: float, lon: float,
+                                            geocode_status: str = None):
     data = await state.get_data()
     session = Session()
     try:
         visit_date = datetime.strptime(data["visitation_date"], "%d.%m.%Y")
-        travel = session.query(Travel).filter_by(travel_id=data["travel_id"]).first()
+        travel = await session.scalar(select(Travel).filter_by(travel_id=data["travel_id"]))
 
         if travel and not validate_date_within_travel(visit_date, travel.start_date, travel.end_date):
             await msg.answer(
@@ -44,16 +51,17 @@ async def save_place_with_coordinates_local(msg: Message, state: FSMContext, lat
             place_comment=None if data.get("place_comment") == "-" else data.get("place_comment"),
             date=visit_date,
             latitude=lat,
-            longitude=lon
+            longitude=lon,
+            geocode_status=geocode_status
         )
 
-        user = session.query(User).filter_by(tg_id=msg.from_user.id).first()
+        user = await user_cache.resolve(msg.from_user.id)
         session.add(entry)
-        session.commit()
+        await session.commit()
         await state.update_data(place_id=entry.place_id)
 
-        new_achievements = check_achievements(user, session)
-        session.commit()
+        new_achievements = await check_achievements(user, session)
+        await session.commit()
 
         for ach in new_achievements:
             await msg.answer(
@@ -68,7 +76,20 @@ async def save_place_with_coordinates_local(msg: Message, state: FSMContext, lat
         await msg.answer("❌ Ошибка при сохранении места")
         return False
     finally:
-        session.close()
+        await session.close()
+
+@router.message(EntryState.city, F.location)
+async def city_location_input(msg: Message, state: FSMContext):
+    lat, lon = msg.location.latitude, msg.location.longitude
+    place = gazetteer.reverse(lat, lon)
+    if place is None:
+        await msg.answer("❌ Не удалось определить город по геолокации. Введите название города:")
+        return
+
+    # Координаты уже есть - на шаге комментария геокодирование не понадобится
+    await state.update_data(city=place.city, latitude=lat, longitude=lon)
+    await msg.answer(f"🏙️ {place.city}, {place.country}\n\n📅 Когда вы посещаете этот город?")
+    await state.set_state(EntryState.visitation_date)
 
 @router.message(EntryState.city)
 async def city_input(msg: Message, state: FSMContext):
@@ -76,7 +97,7 @@ async def city_input(msg: Message, state: FSMContext):
         await msg.answer("❌ Некорректное название города. Используйте только буквы, пробелы и дефисы.")
         return
 
-    await state.update_data(city=msg.text)
+    await state.update_data(city=msg.text, latitude=None, longitude=None)
     await msg.answer('📅 Когда вы посещаете этот город?')
     await state.set_state(EntryState.visitation_date)
 
@@ -91,7 +112,7 @@ async def visitation_date_input(msg: Message, state: FSMContext):
     data = await state.get_data()
     session = Session()
     try:
-        travel = session.query(Travel).filter_by(travel_id=data["travel_id"]).first()
+        travel = await session.scalar(select(Travel).filter_by(travel_id=data["travel_id"]))
         if not travel:
             await msg.answer("❌ Ошибка: путешествие не найдено")
             return
@@ -113,7 +134,7 @@ async def visitation_date_input(msg: Message, state: FSMContext):
         await msg.answer("❌ Ошибка при проверке даты")
         print(f"Ошибка проверки даты: {e}")
     finally:
-        session.close()
+        await session.close()
 
 @router.message(EntryState.place_title)
 async def place_title_input(msg: Message, state: FSMContext):
@@ -133,16 +154,35 @@ async def place_comment_input(msg: Message, state: FSMContext):
 
     session = Session()
     try:
-        travel = session.query(Travel).filter_by(travel_id=data["travel_id"]).first()
+        travel = await session.scalar(select(Travel).filter_by(travel_id=data["travel_id"]))
         country = travel.country if travel else None
     except:
         country = None
     finally:
-        session.close()
+        await session.close()
 
     city = data['city']
     place_title = data['place_title']
 
+    if data.get('latitude') is not None:
+        # Город выбран геолокацией - сохраняем место с ее координатами
+        if await save_place_with_coordinates_local(msg, state, data['latitude'], data['longitude']):
+            await msg.answer(f"✅ Место <b>{place_title}</b> сохранено с координатами геолокации", parse_mode="HTML")
+            await msg.answer("📸 Хотите добавить фото или видео?", reply_markup=kb.type_media_keyboard)
+            await state.set_state(EntryState.place_media)
+        return
+
+    # При разомкнутом предохранителе Nominatim фон не поможет: сразу кэш/газеттир, иначе ручной ввод
+    if geocode_in_background and geocoder_available():
+        # Место сохраняется сразу, координаты найдет фоновый воркер
+        if await save_place_with_coordinates_local(msg, state, None, None, geocode_status=GEOCODE_PENDING):
+            data = await state.get_data()
+            await msg.answer(f"✅ Место <b>{place_title}</b> сохранено!", parse_mode="HTML")
+            await geocode_later(msg, data['place_id'], country, city, place_title)
+            await msg.answer("📸 Хотите добавить фото или видео?", reply_markup=kb.type_media_keyboard)
+            await state.set_state(EntryState.place_media)
+        return
+
     # СОЗДАЕМ ПРОГРЕСС-БАР ВРУЧНУЮ
     progress_msg = await msg.answer("⏳ <b>Определение координат</b>\n\n░░░░░░░░░░ 0%\n\n<i>Подготовка запроса...</i>",
                                     parse_mode="HTML")
@@ -166,7 +206,7 @@ async def place_comment_input(msg: Message, state: FSMContext):
             parse_mode="HTML"
         )
 
-        lat, lon = geocoding(country, city, place_title)
+        lat, lon = await geocoding(country, city, place_title)
 
         if not lat or not lon:
             # ПРОГРЕСС ПРИ ОШИБКЕ
@@ -248,12 +288,12 @@ async def place_comment_input(msg: Message, state: FSMContext):
 
 
 @router.message(EntryState.location_manual, F.content_type == "location")
-async def place_location_manual(msg: Message, state: FSMContext):
+async def place_location_manual(msg: Message, state: FSMContext, user: User | None):
     data = await state.get_data()
     session = Session()
     try:
         visit_date = datetime.strptime(data["visitation_date"], "%d.%m.%Y")
-        travel = session.query(Travel).filter_by(travel_id=data["travel_id"]).first()
+        travel = await session.scalar(select(Travel).filter_by(travel_id=data["travel_id"]))
 
         if travel and not validate_date_within_travel(visit_date, travel.start_date, travel.end_date):
             await msg.answer(
@@ -272,13 +312,12 @@ async def place_location_manual(msg: Message, state: FSMContext):
             latitude=msg.location.latitude,
             longitude=msg.location.longitude
         )
-        user = session.query(User).filter_by(tg_id=msg.from_user.id).first()
         session.add(entry)
-        session.commit()
+        await session.commit()
         await state.update_data(place_id=entry.place_id)
 
-        new_achievements = check_achievements(user, session)
-        session.commit()
+        new_achievements = await check_achievements(user, session)
+        await session.commit()
 
         for ach in new_achievements:
             await msg.answer(
@@ -290,7 +329,7 @@ async def place_location_manual(msg: Message, state: FSMContext):
         await msg.answer("❌ Ошибка при сохранении геолокации")
         return
     finally:
-        session.close()
+        await session.close()
 
     await msg.answer(
         f"✅ Геолокация сохранена!\n"
@@ -438,13 +477,13 @@ async def handle_location_text_input(msg: Message, state: FSMContext):
         await msg.answer("❌ Ошибка при обработке координат. Попробуйте еще раз.")
 
 @router.callback_query(F.data == "skip_coordinates")
-async def skip_coordinates(callback: CallbackQuery, state: FSMContext):
+async def skip_coordinates(callback: CallbackQuery, state: FSMContext, user: User | None):
     await callback.answer()
     data = await state.get_data()
     session = Session()
     try:
         visit_date = datetime.strptime(data["visitation_date"], "%d.%m.%Y")
-        travel = session.query(Travel).filter_by(travel_id=data["travel_id"]).first()
+        travel = await session.scalar(select(Travel).filter_by(travel_id=data["travel_id"]))
 
         if travel and not validate_date_within_travel(visit_date, travel.start_date, travel.end_date):
             await callback.message.answer(
@@ -465,12 +504,11 @@ async def skip_coordinates(callback: CallbackQuery, state: FSMContext):
             longitude=None
         )
         session.add(entry)
-        session.commit()
+        await session.commit()
         await state.update_data(place_id=entry.place_id)
 
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
-        new_achievements = check_achievements(user, session)
-        session.commit()
+        new_achievements = await check_achievements(user, session)
+        await session.commit()
 
         for ach in new_achievements:
             await callback.message.answer(
@@ -483,7 +521,7 @@ async def skip_coordinates(callback: CallbackQuery, state: FSMContext):
         await callback.message.answer("❌ Ошибка при сохранении")
         return
     finally:
-        session.close()
+        await session.close()
 
     await callback.message.answer("✅ Место сохранено без координат.")
     await callback.message.answer("📸 Хотите добавить фото или видео?", reply_markup=kb.type_media_keyboard)
@@ -498,11 +536,11 @@ async def place_rating_input(msg: Message, state: FSMContext):
     data = await state.get_data()
     session = Session()
     try:
-        entry = session.query(Entry).filter_by(place_id=data['place_id']).first()
+        entry = await session.scalar(select(Entry).filter_by(place_id=data['place_id']))
         entry.place_rating = int(msg.text)
-        session.commit()
+        await session.commit()
     finally:
-        session.close()
+        await session.close()
     await msg.answer('📍 Хотите добавить еще одно место?', reply_markup=kb.finish_place_keyboard)
     await state.set_state(EntryState.another_place)
 
@@ -514,4 +552,57 @@ async def another_place_input(msg: Message, state: FSMContext):
 async def another_place(callback, state: FSMContext):
     await callback.answer()
     await callback.message.answer('📍 Отлично! Добавим еще одно место.\n🏙️ В каком городе?')
-    await state.set_state(EntryState.city)
\ No newline at end of file
+    await state.set_state(EntryState.city)
+
+
+@router.callback_query(F.data.startswith("fix_coords:"))
+async def fix_coordinates_start(callback: CallbackQuery, state: FSMContext):
+    await callback.answer()
+    place_id = int(callback.data.split(":")[1])
+    # После ввода координат вернемся туда, где пользователь был
+    await state.update_data(fix_place_id=place_id, fix_resume_state=await state.get_state())
+    await callback.message.answer(
+        "📍 Отправьте геолокацию через кнопку \"📎\" (в Attach) или введите координаты в формате:\n"
+        "<code>12.34567, 89.01234</code>",
+        parse_mode="HTML"
+    )
+    await state.set_state(EntryState.fixing_location)
+
+
+@router.message(EntryState.fixing_location)
+async def fix_coordinates_input(msg: Message, state: FSMContext, user: User | None):
+    if not user:
+        await msg.answer("❌ Пользователь не найден")
+        return
+
+    if msg.location:
+        coordinates = (msg.location.latitude, msg.location.longitude)
+    else:
+        coordinates = parse_coordinates(msg.text)
+    if coordinates is None:
+        await msg.answer("❌ Неверные координаты. Пример: <code>59.93428, 30.33510</code>", parse_mode="HTML")
+        return
+
+    data = await state.get_data()
+    lat, lon = coordinates
+    session = Session()
+    try:
+        result = await session.execute(
+            update(Entry)
+            .where(
+                Entry.place_id == data.get("fix_place_id"),
+                Entry.travel_id.in_(select(Travel.travel_id).where(Travel.user_id == user.user_id))
+            )
+            .values(latitude=lat, longitude=lon, geocode_status=None, country_code=gazetteer.country_code_at(lat, lon))
+        )
+        if result.rowcount:
+            await bump_data_version(session, [data.get("fix_place_id")])
+        await session.commit()
+    finally:
+        await session.close()
+
+    if result.rowcount:
+        await msg.answer(f"✅ Координаты сохранены: {lat:.5f}, {lon:.5f}")
+    else:
+        await msg.answer("❌ Место не найдено")
+    await state.set_state(data.get("fix_resume_state"))
@@ -1,17 +1,27 @@
+import asyncio
+import os
 from datetime import datetime
 
 from aiogram import F, Router
-from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, BufferedInputFile, InputMediaPhoto
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile, InputMediaPhoto
 from aiogram import Bot
 
 from app.travel_session import Session
-from app.travel_database import User, Media, Entry, Travel
-from app.travel_export_utils import create_zip_with_photos
+from app.travel_database import User
+from app.travel_executor import JobCancelled
+from app.travel_export_utils import create_zip_with_photos, load_export_tree
 from app.travel_utils import export_limiter, progress_manager, rate_limiter
 import app.traveler_keyboard as kb
 
 router = Router()
 
+# Идущие выгрузки архива по tg_id - их прерывает кнопка отмены
+export_tasks = {}
+
+cancel_export_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="❌ Отменить экспорт", callback_data="export_cancel")]
+])
+
 @router.callback_query(F.data == "export_menu")
 async def export_menu(callback: CallbackQuery):
     export_keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -31,27 +41,29 @@ async def export_menu(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "export_full_zip")
-async def export_full_zip(callback: CallbackQuery, bot: Bot):
+async def export_full_zip(callback: CallbackQuery, bot: Bot, user: User | None):
     if not rate_limiter.is_allowed(callback.from_user.id, "export"):
         await callback.answer("❌ Слишком частые запросы экспорта. Подождите 5 минут.", show_alert=True)
         return
 
     await callback.answer("🔄 Создаем полный архив с фотографиями...")
 
-    session = Session()
-    try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
-        if not user:
-            await callback.message.answer("❌ Пользователь не найден")
-            return
+    if not user:
+        await callback.message.answer("❌ Пользователь не найден")
+        return
 
+    export_tasks[callback.from_user.id] = asyncio.current_task()
+    archive_path = None
+    try:
         progress_msg = await callback.message.answer("⏳ Подготавливаем экспорт...")
 
-        total_photos = session.query(Media).join(Entry).join(
-            Travel).filter(
-            Travel.user_id == user.user_id,
-            Media.media_type == 'photo'
-        ).count()
+        # Сессия нужна только на загрузку дерева, скачивание фото идет без нее
+        session = Session()
+        try:
+            tree = await load_export_tree(session, user)
+        finally:
+            await session.close()
+        total_photos = tree.photo_count
 
         await progress_manager.start_progress(
             bot,
@@ -65,19 +77,19 @@ async def export_full_zip(callback: CallbackQuery, bot: Bot):
             callback.from_user.id,
             "Создание архива с фото",
             10,
-            "Сбор информации о путешествиях"
+            "Сбор информации о путешествиях",
+            reply_markup=cancel_export_keyboard
         )
 
-        zip_buffer, actual_photo_count = await create_zip_with_photos(
+        archive_path, actual_photo_count = await create_zip_with_photos(
             bot=bot,
-            user_tg_id=callback.from_user.id,
-            session=session,
+            tree=tree,
             progress_callback=lambda p, s: update_export_progress(
                 bot, callback.from_user.id, p, s, total_photos
             )
         )
 
-        if not zip_buffer:
+        if not archive_path:
             await progress_manager.complete_progress(
                 bot,
                 callback.from_user.id,
@@ -97,7 +109,7 @@ async def export_full_zip(callback: CallbackQuery, bot: Bot):
         caption = (
             f"📦 <b>Полный архив ваших путешествий</b>\n\n"
             f"🖼️ <b>Фотографий в архиве:</b> {actual_photo_count}\n"
-            f"📁 <b>Размер:</b> {len(zip_buffer.getvalue()) // 1024} КБ\n"
+            f"📁 <b>Размер:</b> {os.path.getsize(archive_path) // 1024} КБ\n"
             f"💾 <b>Как открыть:</b>\n"
             f"1. Скачайте архив\n"
             f"2. Распакуйте в папку\n"
@@ -105,8 +117,8 @@ async def export_full_zip(callback: CallbackQuery, bot: Bot):
             f"<i>Все фотографии включены в архив</i> 📸"
         )
 
-        zip_file = BufferedInputFile(
-            zip_buffer.getvalue(),
+        zip_file = FSInputFile(
+            archive_path,
             filename=f"travels_{user.name}_{datetime.now().strftime('%Y%m%d_%H%M')}.zip"
         )
 
@@ -124,6 +136,23 @@ async def export_full_zip(callback: CallbackQuery, bot: Bot):
             parse_mode="HTML"
         )
 
+    except asyncio.CancelledError:
+        if export_tasks.get(callback.from_user.id) is asyncio.current_task():
+            # Отменил не пользователь, а остановка бота
+            raise
+        asyncio.current_task().uncancel()
+        await progress_manager.complete_progress(
+            bot,
+            callback.from_user.id,
+            "Создание архива с фото",
+            False
+        )
+        await callback.message.answer("🚫 Экспорт отменен", reply_markup=kb.back_to_menu_keyboard)
+
+    except JobCancelled:
+        # Пользователь уже запустил новый экспорт - прогресс принадлежит ему
+        return
+
     except Exception as e:
         await progress_manager.complete_progress(
             bot,
@@ -133,8 +162,22 @@ async def export_full_zip(callback: CallbackQuery, bot: Bot):
         )
         await callback.message.answer(f"❌ Ошибка создания архива: {str(e)}")
         print(f"Ошибка экспорта: {e}")
+
     finally:
-        session.close()
+        if archive_path:
+            os.remove(archive_path)
+        if export_tasks.get(callback.from_user.id) is asyncio.current_task():
+            del export_tasks[callback.from_user.id]
+
+
+@router.callback_query(F.data == "export_cancel")
+async def export_cancel(callback: CallbackQuery):
+    task = export_tasks.pop(callback.from_user.id, None)
+    if task is None or task.done():
+        await callback.answer("Экспорт уже завершен")
+        return
+    task.cancel()
+    await callback.answer("🚫 Отменяем экспорт...")
 
 
 async def update_export_progress(bot: Bot, user_id: int, current: int, step: str, total_photos: int):
@@ -145,7 +188,8 @@ async def update_export_progress(bot: Bot, user_id: int, current: int, step: str
             user_id,
             "Создание архива с фото",
             percentage,
-            f"{step} ({current}/{total_photos})"
+            f"{step} ({current}/{total_photos})",
+            reply_markup=cancel_export_keyboard
         )
     else:
         await progress_manager.update_progress(
@@ -153,47 +197,41 @@ async def update_export_progress(bot: Bot, user_id: int, current: int, step: str
             user_id,
             "Создание архива с фото",
             50,
-            step
+            step,
+            reply_markup=cancel_export_keyboard
         )
 
 @router.callback_query(F.data == "export_text_only")
-async def export_text_only(callback: CallbackQuery):
+async def export_text_only(callback: CallbackQuery, user: User | None):
     if not rate_limiter.is_allowed(callback.from_user.id, "export"):
         await callback.answer("❌ Слишком частые запросы экспорта. Подождите 5 минут.", show_alert=True)
         return
 
     await callback.answer("🔄 Формируем текстовый отчет...")
 
-    session = Session()
-    try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
-        if not user:
-            await callback.message.answer("❌ Пользователь не найден")
-            return
+    if not user:
+        await callback.message.answer("❌ Пользователь не найден")
+        return
 
+    try:
         # Получаем все путешествия пользователя
-        travels = session.query(Travel).filter_by(user_id=user.user_id).order_by(Travel.start_date).all()
+        session = Session()
+        try:
+            tree = await load_export_tree(session, user)
+        finally:
+            await session.close()
 
-        if not travels:
+        if not tree.travels:
             await callback.message.answer("📭 У вас нет путешествий для экспорта")
             return
 
         text_report = f"📊 ОТЧЕТ О ПУТЕШЕСТВИЯХ\nПользователь: {user.name}\nДата формирования: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\n"
         text_report += "=" * 50 + "\n\n"
 
-        total_places = 0
-        total_photos = 0
-
-        for travel in travels:
-            # Считаем места и фото для этого путешествия
-            places_count = session.query(Entry).filter_by(travel_id=travel.travel_id).count()
-            photos_count = session.query(Media).join(Entry).filter(
-                Entry.travel_id == travel.travel_id,
-                Media.media_type == 'photo'
-            ).count()
-
-            total_places += places_count
-            total_photos += photos_count
+        for travel_node in tree.travels:
+            travel = travel_node.travel
+            places_count = len(travel_node.entries)
+            photos_count = travel_node.photo_count
 
             # Информация о путешествии
             duration = (travel.end_date - travel.start_date).days if travel.end_date and travel.start_date else 0
@@ -207,11 +245,9 @@ async def export_text_only(callback: CallbackQuery):
             if travel.travel_comment and travel.travel_comment != "-":
                 text_report += f"💬 Комментарий: {travel.travel_comment}\n"
 
-            # Получаем места для этого путешествия
-            entries = session.query(Entry).filter_by(travel_id=travel.travel_id).order_by(Entry.date).all()
-            if entries:
+            if travel_node.entries:
                 text_report += "\n📍 Посещенные места:\n"
-                for entry in entries:
+                for entry, _ in travel_node.entries:
                     text_report += f"  • {entry.city}: {entry.place_title}\n"
                     if entry.place_comment and entry.place_comment != "-":
                         text_report += f"    💬 {entry.place_comment}\n"
@@ -223,10 +259,10 @@ async def export_text_only(callback: CallbackQuery):
 
         # Общая статистика
         text_report += f"📈 ОБЩАЯ СТАТИСТИКА:\n"
-        text_report += f"✈️ Путешествий: {len(travels)}\n"
-        text_report += f"🏛️ Всего мест: {total_places}\n"
-        text_report += f"🖼️ Всего фото: {total_photos}\n"
-        text_report += f"🌏 Стран: {len(set(t.country for t in travels))}\n"
+        text_report += f"✈️ Путешествий: {len(tree.travels)}\n"
+        text_report += f"🏛️ Всего мест: {tree.place_count}\n"
+        text_report += f"🖼️ Всего фото: {tree.photo_count}\n"
+        text_report += f"🌏 Стран: {len(set(node.travel.country for node in tree.travels))}\n"
 
         # Если отчет слишком длинный, разбиваем на части
         if len(text_report) > 4000:
@@ -243,6 +279,4 @@ async def export_text_only(callback: CallbackQuery):
 
     except Exception as e:
         await callback.message.answer(f"❌ Ошибка создания текстового отчета: {str(e)}")
-        print(f"Ошибка текстового экспорта: {e}")
-    finally:
-        session.close()
\ No newline at end of file
+        print(f"Ошибка текстового экспорта: {e}")
\ No newline at end of file
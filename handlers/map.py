@@ -1,37 +1,79 @@
 import asyncio
-import os
-import tempfile
 from datetime import datetime, timedelta
 
-import folium
 from aiogram import F, Router
-from aiogram.types import CallbackQuery, BufferedInputFile, FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
-from folium.plugins import HeatMap
-from sqlalchemy import func
+from aiogram.types import CallbackQuery, BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton
+from sqlalchemy import func, select
 
-from app.travel_session import Session
+from app.travel_session import Session, ReadSession
 from app.travel_database import User, Travel, Entry
+from app.travel_cache import heatmap_cache
+from app.travel_executor import JobCancelled
+from app.travel_heatmap import render_heatmap
 from app.travel_utils import rate_limiter, progress_manager, get_user_continents, CONTINENTS, normalize_country_name
 import app.traveler_keyboard as kb
-import selenium
 
 router = Router()
 
+premium_heatmap_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🔄 Другой фильтр", callback_data="premium_heatmap")],
+    [InlineKeyboardButton(text="🔙 В премиум меню", callback_data="premium_functions")],
+    [InlineKeyboardButton(text="🏠 Главное меню", callback_data="back_to_menu")]
+])
+
+
+def heatmap_key(filter_type: str) -> str:
+    """Ключ кэша карты; выборка «за последний год» зависит еще и от сегодняшней даты"""
+    if filter_type == "recent":
+        return f"recent:{datetime.now():%Y-%m-%d}"
+    return filter_type
+
+
+async def send_cached_heatmap(callback: CallbackQuery, user: User, filter_key: str, **kwargs) -> bool:
+    """Отправляет карту из кэша, если данные пользователя не менялись; False - нужно рендерить"""
+    data_version = user.data_version or 0
+    cached = await heatmap_cache.get(user.user_id, filter_key, data_version)
+    if cached is None:
+        return False
+
+    try:
+        photo = cached.file_id or BufferedInputFile(cached.png, filename="travel_heatmap.png")
+        message = await callback.message.answer_photo(photo, caption=cached.caption, **kwargs)
+    except Exception as e:
+        # file_id мог стать недействительным - просто рендерим заново
+        print(f"❌ Не удалось отправить карту из кэша: {e}")
+        return False
+
+    await callback.answer()
+    if not cached.file_id and message.photo:
+        await heatmap_cache.put(user.user_id, filter_key, data_version, cached.png, message.photo[-1].file_id,
+                                cached.caption)
+    return True
+
+
+async def remember_heatmap(user: User, filter_key: str, data_version: int, png: bytes, message, caption: str):
+    file_id = message.photo[-1].file_id if message.photo else None
+    await heatmap_cache.put(user.user_id, filter_key, data_version, png, file_id, caption)
+
+
 @router.callback_query(F.data == "heatmap")
-async def build_heatmap(callback: CallbackQuery):
+async def build_heatmap(callback: CallbackQuery, user: User | None):
+    if user and await send_cached_heatmap(callback, user, "map", reply_markup=kb.back_to_menu_keyboard):
+        return
     if not rate_limiter.is_allowed(callback.from_user.id, "heatmap"):
-        await callback.answer("❌ Слишком частые запросы генерации карт. Подождите 5 минут.", show_alert=True)
+        await callback.answer("❌ Слишком частые запросы генерации карт. Подождите минуту.", show_alert=True)
         return
     await callback.answer("🔄 Начинаем генерацию карты...")
     original_message = callback.message
 
-    session = Session()
+    session = ReadSession()
 
     try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
         if not user:
             await callback.message.answer('⛔ Нет такого пользователя. Сначала создайте запись путешествия')
             return
+        # Версию берем до выборки: правка во время рендера не попадет в кэш под новой версией
+        data_version = user.data_version or 0
 
         # Шаг 1: Начальный прогресс (редактируем исходное сообщение)
         await progress_manager.start_progress(
@@ -52,16 +94,16 @@ async def build_heatmap(callback: CallbackQuery):
             "Получение данных о местах"
         )
 
-        entries = session.query(Entry).join(Travel, Entry.travel_id == Travel.travel_id) \
-            .filter(Travel.user_id == user.user_id).all()
-
-        points = []
-        popups = []
+        entries = (await session.scalars(
+            select(Entry).join(Travel, Entry.travel_id == Travel.travel_id)
+            .filter(
+                Travel.user_id == user.user_id,
+                Entry.latitude.isnot(None),
+                Entry.longitude.isnot(None)
+            )
+        )).all()
 
-        for e in entries:
-            if e.latitude is not None and e.longitude is not None:
-                points.append([float(e.latitude), float(e.longitude)])
-                popups.append((float(e.latitude), float(e.longitude), f"{e.place_title} — {e.city}"))
+        points = [[e.latitude, e.longitude] for e in entries]
 
         # Шаг 3: Проверка данных
         await progress_manager.update_progress(
@@ -81,76 +123,7 @@ async def build_heatmap(callback: CallbackQuery):
             )
             return
 
-        # Шаг 4: Создание карты
-        await progress_manager.update_progress(
-            callback.bot,
-            callback.from_user.id,
-            "Генерация карты путешествий",
-            70,
-            "Создание карты"
-        )
-
-        lats = [p[0] for p in points]
-        lons = [p[1] for p in points]
-
-        min_lat, max_lat = min(lats), max(lats)
-        min_lon, max_lon = min(lons), max(lons)
-
-        avg_lat = sum(lats) / len(lats)
-        avg_lon = sum(lons) / len(lons)
-
-        lat_span = max_lat - min_lat
-        lon_span = max_lon - min_lon
-
-        # Определяем zoom level
-        if lat_span == 0 and lon_span == 0:
-            zoom_level = 12
-        elif lat_span < 0.1 and lon_span < 0.1:
-            zoom_level = 10
-        elif lat_span < 0.5 and lon_span < 0.5:
-            zoom_level = 8
-        elif lat_span < 2 and lon_span < 2:
-            zoom_level = 7
-        elif lat_span < 10 and lon_span < 10:
-            zoom_level = 6
-        elif lat_span < 30 and lon_span < 30:
-            zoom_level = 5
-        else:
-            zoom_level = 3
-
-        if len(points) <= 3:
-            zoom_level = min(zoom_level + 2, 15)
-        elif len(points) <= 10:
-            zoom_level = min(zoom_level + 1, 12)
-
-        # Создаем карту
-        m = folium.Map(
-            location=[avg_lat, avg_lon],
-            zoom_start=zoom_level,
-            control_scale=True,
-            tiles='CartoDB positron'
-        )
-
-        HeatMap(
-            points,
-            min_opacity=0.3,
-            max_zoom=18,
-            radius=15,
-            blur=10,
-            gradient={'0.4': 'blue', '0.6': 'lime', '0.8': 'orange', '1.0': 'red'}
-        ).add_to(m)
-
-        for lat, lon, text in popups:
-            folium.CircleMarker(
-                location=[lat, lon],
-                radius=3,
-                color='green',
-                fill=True,
-                fill_color='green',
-                fill_opacity=0.6
-            ).add_to(m)
-
-        # Шаг 5: Генерация изображения
+        # Шаг 4: Генерация изображения
         await progress_manager.update_progress(
             callback.bot,
             callback.from_user.id,
@@ -159,7 +132,7 @@ async def build_heatmap(callback: CallbackQuery):
             "Формирование изображения"
         )
 
-        img_data = m._to_png(5)
+        img_data = await render_heatmap(points, key=(user.user_id, "heatmap"))
         heatmap_file = BufferedInputFile(img_data, filename="travel_heatmap.png")
 
         # Завершаем прогресс
@@ -172,11 +145,17 @@ async def build_heatmap(callback: CallbackQuery):
         )
 
         # Отправляем результат как новое сообщение
-        await callback.message.answer_photo(
+        caption = f"🌍 Ваша карта путешествий\n📍 {len(points)} локаций"
+        message = await callback.message.answer_photo(
             heatmap_file,
-            caption=f"🌍 Ваша карта путешествий\n📍 {len(points)} локаций",
+            caption=caption,
             reply_markup=kb.back_to_menu_keyboard
         )
+        await remember_heatmap(user, "map", data_version, img_data, message, caption)
+
+    except JobCancelled:
+        # Пользователь уже запросил новую карту - прогресс принадлежит ей
+        return
 
     except Exception as e:
         print(f"❌ Ошибка в build_heatmap: {e}")
@@ -186,31 +165,15 @@ async def build_heatmap(callback: CallbackQuery):
             "Генерация карты путешествий",
             False
         )
-
-        # Пробуем отправить HTML версию как запасной вариант
-        try:
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False) as f:
-                if 'm' in locals():
-                    m.save(f.name)
-                temp_file = f.name
-
-            await callback.message.answer_document(
-                FSInputFile(temp_file, filename="travel_heatmap.html"),
-                caption=f"🌍 Ваша карта путешествий (HTML версия)\n📍 {len(points)} локаций"
-            )
-            os.unlink(temp_file)
-        except Exception as html_error:
-            await callback.message.answer(f"⛔ Ошибка создания карты: {str(e)}")
+        await callback.message.answer(f"⛔ Ошибка создания карты: {str(e)}")
 
     finally:
-        session.close()
+        await session.close()
 
 @router.callback_query(F.data == "premium_heatmap_menu")
-async def premium_heatmap_menu(callback: CallbackQuery):
-    session = Session()
+async def premium_heatmap_menu(callback: CallbackQuery, user: User | None):
     try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
-        if not user.premium:
+        if not user or not user.premium:
             await callback.answer("❌ Только для премиум пользователей")
             return
 
@@ -233,21 +196,18 @@ async def premium_heatmap_menu(callback: CallbackQuery):
     except Exception as e:
         await callback.answer(f"❌ Ошибка: {str(e)}")
         print(f"Ошибка в premium_heatmap_menu: {e}")
-    finally:
-        session.close()
 
 
 @router.callback_query(F.data == "heatmap_continents")
-async def choose_continent(callback: CallbackQuery):
+async def choose_continent(callback: CallbackQuery, user: User | None):
     session = Session()
     try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
-        if not user.premium:
+        if not user or not user.premium:
             await callback.answer("❌ Только для премиум пользователей")
             return
 
         # Получаем доступные континенты для пользователя
-        available_continents = get_user_continents(user.user_id, session)
+        available_continents = await get_user_continents(user.user_id, session)
 
         if not available_continents:
             await callback.answer("❌ У вас нет данных по континентам")
@@ -291,26 +251,28 @@ async def choose_continent(callback: CallbackQuery):
         await callback.answer(f"❌ Ошибка: {str(e)}")
         print(f"Ошибка в choose_continent: {e}")
     finally:
-        session.close()
+        await session.close()
 
 
 @router.callback_query(F.data.startswith("heatmap_"))
-async def generate_filtered_heatmap(callback: CallbackQuery):
+async def generate_filtered_heatmap(callback: CallbackQuery, user: User | None):
+    filter_type = callback.data.replace("heatmap_", "")
+    if user and user.premium and await send_cached_heatmap(
+            callback, user, heatmap_key(filter_type), parse_mode="HTML", reply_markup=premium_heatmap_keyboard):
+        return
     if not rate_limiter.is_allowed(callback.from_user.id, "heatmap"):
-        await callback.answer("❌ Слишком частые запросы генерации карт. Подождите 5 минут.", show_alert=True)
+        await callback.answer("❌ Слишком частые запросы генерации карт. Подождите минуту.", show_alert=True)
         return
     await callback.answer("🔄 Начинаем генерацию карты...")
 
     original_message = callback.message
-    session = Session()
+    session = ReadSession()
 
     try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
         if not user or not user.premium:
             await callback.message.answer("❌ Только для премиум пользователей")
             return
-
-        filter_type = callback.data.replace("heatmap_", "")
+        data_version = user.data_version or 0
 
         # Начинаем прогресс
         await progress_manager.start_progress(
@@ -332,7 +294,7 @@ async def generate_filtered_heatmap(callback: CallbackQuery):
         )
 
         # Базовый запрос с JOIN вместо joinedload
-        query = session.query(Entry, Travel).join(Travel, Entry.travel_id == Travel.travel_id)
+        query = select(Entry, Travel).join(Travel, Entry.travel_id == Travel.travel_id)
         query = query.filter(Travel.user_id == user.user_id)
 
         filter_description = "Все места"
@@ -340,23 +302,23 @@ async def generate_filtered_heatmap(callback: CallbackQuery):
 
         if filter_type == "all":
             filter_description = "Все места"
-            entries_data = query.all()
+            entries_data = (await session.execute(query)).all()
 
         elif filter_type == "best":
             query = query.filter(Entry.place_rating >= 8)
             filter_description = "Лучшие места (8-10⭐)"
-            entries_data = query.all()
+            entries_data = (await session.execute(query)).all()
 
         elif filter_type == "recent":
             one_year_ago = datetime.now() - timedelta(days=365)
             query = query.filter(Travel.start_date >= one_year_ago)
             filter_description = "За последний год"
-            entries_data = query.all()
+            entries_data = (await session.execute(query)).all()
 
         elif filter_type == "top10":
             query = query.filter(Entry.place_rating.isnot(None)).order_by(Entry.place_rating.desc())
             filter_description = "Топ-10 по рейтингу"
-            all_entries = query.all()
+            all_entries = (await session.execute(query)).all()
             entries_data = all_entries[:10]
 
         elif filter_type.startswith("continent:"):
@@ -365,11 +327,11 @@ async def generate_filtered_heatmap(callback: CallbackQuery):
 
             if continent:
                 # Получаем все страны пользователя
-                user_countries = session.query(
-                    func.distinct(Travel.country)
-                ).filter(Travel.user_id == user.user_id).all()
+                user_countries = (await session.scalars(
+                    select(func.distinct(Travel.country)).filter(Travel.user_id == user.user_id)
+                )).all()
 
-                user_countries = [country[0] for country in user_countries if country[0]]
+                user_countries = [country for country in user_countries if country]
 
                 # Находим страны пользователя, которые принадлежат к выбранному континенту
                 matching_countries = []
@@ -385,10 +347,10 @@ async def generate_filtered_heatmap(callback: CallbackQuery):
                 if matching_countries:
                     query = query.filter(Travel.country.in_(matching_countries))
                     filter_description = f"Континент: {continent['name']}"
-                    entries_data = query.all()
+                    entries_data = (await session.execute(query)).all()
                 else:
                     # Если не нашли точных совпадений, пробуем частичное совпадение
-                    all_entries_data = query.all()
+                    all_entries_data = (await session.execute(query)).all()
                     filtered_entries = []
                     for entry, travel in all_entries_data:
                         if travel and travel.country:
@@ -439,18 +401,8 @@ async def generate_filtered_heatmap(callback: CallbackQuery):
             )
             return
 
-        points = []
-        popups = []
-
-        for entry, travel in entries_data:
-            if entry.latitude is not None and entry.longitude is not None:
-                points.append([float(entry.latitude), float(entry.longitude)])
-                rating_text = f" ({entry.place_rating}⭐)" if entry.place_rating else ""
-
-                # Теперь travel доступен напрямую
-                country_text = f", {travel.country}" if travel and travel.country else ""
-                popup_text = f"{entry.place_title} — {entry.city}{country_text}{rating_text}"
-                popups.append((float(entry.latitude), float(entry.longitude), popup_text))
+        points = [[entry.latitude, entry.longitude] for entry, travel in entries_data
+                  if entry.latitude is not None and entry.longitude is not None]
 
         if not points:
             await progress_manager.complete_progress(
@@ -466,77 +418,7 @@ async def generate_filtered_heatmap(callback: CallbackQuery):
             )
             return
 
-        # Шаг 4: Создание карты
-        await progress_manager.update_progress(
-            callback.bot,
-            callback.from_user.id,
-            "Генерация премиум карты",
-            70,
-            "Создание карты"
-        )
-
-        lats = [p[0] for p in points]
-        lons = [p[1] for p in points]
-
-        min_lat, max_lat = min(lats), max(lats)
-        min_lon, max_lon = min(lons), max(lons)
-
-        avg_lat = sum(lats) / len(lats)
-        avg_lon = sum(lons) / len(lons)
-
-        lat_span = max_lat - min_lat
-        lon_span = max_lon - min_lon
-
-        # Определяем zoom level
-        if lat_span == 0 and lon_span == 0:
-            zoom_level = 12
-        elif lat_span < 0.1 and lon_span < 0.1:
-            zoom_level = 10
-        elif lat_span < 0.5 and lon_span < 0.5:
-            zoom_level = 8
-        elif lat_span < 2 and lon_span < 2:
-            zoom_level = 7
-        elif lat_span < 10 and lon_span < 10:
-            zoom_level = 6
-        elif lat_span < 30 and lon_span < 30:
-            zoom_level = 5
-        else:
-            zoom_level = 3
-
-        if len(points) <= 3:
-            zoom_level = min(zoom_level + 2, 15)
-        elif len(points) <= 10:
-            zoom_level = min(zoom_level + 1, 12)
-
-        # Создаем карту
-        m = folium.Map(
-            location=[avg_lat, avg_lon],
-            zoom_start=zoom_level,
-            control_scale=True,
-            tiles='CartoDB positron'
-        )
-
-        HeatMap(
-            points,
-            min_opacity=0.3,
-            max_zoom=18,
-            radius=15,
-            blur=10,
-            gradient={'0.4': 'blue', '0.6': 'lime', '0.8': 'orange', '1.0': 'red'}
-        ).add_to(m)
-
-        for lat, lon, text in popups:
-            folium.CircleMarker(
-                location=[lat, lon],
-                radius=3,
-                color='green',
-                fill=True,
-                fill_color='green',
-                fill_opacity=0.6,
-                popup=folium.Popup(text, max_width=250)
-            ).add_to(m)
-
-        # Шаг 5: Генерация изображения
+        # Шаг 4: Генерация изображения
         await progress_manager.update_progress(
             callback.bot,
             callback.from_user.id,
@@ -545,7 +427,7 @@ async def generate_filtered_heatmap(callback: CallbackQuery):
             "Формирование изображения"
         )
 
-        img_data = m._to_png(5)
+        img_data = await render_heatmap(points, key=(user.user_id, "heatmap"))
         heatmap_file = BufferedInputFile(img_data, filename=f"heatmap_{filter_type}.png")
 
         # Завершаем прогресс
@@ -560,18 +442,16 @@ async def generate_filtered_heatmap(callback: CallbackQuery):
         # Отправляем результат как новое сообщение
         caption = f"🗺️ <b>Премиум Heatmap</b>\n📍 {filter_description}\n🔢 {len(points)} мест"
 
-        nav_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔄 Другой фильтр", callback_data="premium_heatmap")],
-            [InlineKeyboardButton(text="🔙 В премиум меню", callback_data="premium_functions")],
-            [InlineKeyboardButton(text="🏠 Главное меню", callback_data="back_to_menu")]
-        ])
-
-        await callback.message.answer_photo(
+        message = await callback.message.answer_photo(
             heatmap_file,
             caption=caption,
             parse_mode="HTML",
-            reply_markup=nav_keyboard
+            reply_markup=premium_heatmap_keyboard
         )
+        await remember_heatmap(user, heatmap_key(filter_type), data_version, img_data, message, caption)
+
+    except JobCancelled:
+        return
 
     except Exception as e:
         await progress_manager.complete_progress(
@@ -586,9 +466,9 @@ async def generate_filtered_heatmap(callback: CallbackQuery):
         traceback.print_exc()
 
     finally:
-        session.close()
+        await session.close()
 
 @router.callback_query(F.data == "premium_heatmap")
-async def premium_heatmap_handler(callback: CallbackQuery):
+async def premium_heatmap_handler(callback: CallbackQuery, user: User | None):
     await callback.answer()
-    await premium_heatmap_menu(callback)
\ No newline at end of file
+    await premium_heatmap_menu(callback, user)
\ No newline at end of file
@@ -2,14 +2,35 @@ from aiogram import F, Router
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
-from app.travel_session import Session
 from app.travel_states import EntryState
-from app.travel_database import Media, MediaTypeEnum
-from app.travel_utils import can_add_media, rate_limiter
+from app.travel_database import MediaTypeEnum
+from app.travel_utils import save_media_batch, rate_limiter
+from app.travel_album import album_media
 import app.traveler_keyboard as kb
 
 router = Router()
 
+
+def media_added_text(added: int, media: list) -> str:
+    received = len(media)
+    if added == 0:
+        return '⚠️ Медиа не добавлено'
+    if received == 1:
+        text = '✅ Фото добавлено.' if media[0][0] == MediaTypeEnum.photo else '✅ Видео добавлено.'
+    else:
+        text = f'✅ Добавлено файлов: {added}'
+    if added < received:
+        text += f'\n⚠️ Не сохранено {received - added}: превышен лимит медиа'
+    return text
+
+
+async def answer_media_saved(msg: Message, state: FSMContext, text: str, total: int, limit: int):
+    if total >= limit:
+        await msg.answer(f'{text}\n\n⚠️ Вы достигли лимита добавления медиа\n⭐ Как вы оцениваете это место? (от 1 до 10)')
+        await state.set_state(EntryState.place_rating)
+    else:
+        await msg.answer(f'{text}\n\n➕ Добавить еще медиа?', reply_markup=kb.media_more_keyboard)
+
 @router.message(EntryState.place_media)
 async def place_media_input(msg: Message):
     await msg.answer('📸 Хотите добавить фото или видео этого места?', reply_markup=kb.type_media_keyboard)
@@ -26,53 +47,28 @@ async def add_video(callback: CallbackQuery, state: FSMContext):
     await callback.message.answer('🎥 Отправьте видео:')
     await state.set_state(EntryState.adding_more_video)
 
-@router.message(EntryState.adding_more_photo)
-async def adding_more_photo_input(msg: Message, state: FSMContext):
+async def save_album(msg: Message, state: FSMContext, album: list[Message], prompt: str):
+    """Сохраняет все фото и видео альбома, в каком бы состоянии его ни прислали"""
     if not rate_limiter.is_allowed(msg.from_user.id, "media_upload"):
         await msg.answer("❌ Слишком много загрузок. Подождите 2 минуты.")
         return
 
-    data = await state.get_data()
-    place_id = data.get('place_id')
-    session = Session()
-    try:
-        file_id = msg.photo[-1].file_id
-        media = Media(place_id=place_id, media_type=MediaTypeEnum.photo, file_id=file_id)
-        session.add(media)
-        session.commit()
-        await msg.answer('✅ Фото добавлено.')
-    finally:
-        session.close()
-    if not can_add_media(tg_id=msg.from_user.id, place_id=place_id):
-        await msg.answer('⚠️ Вы достигли лимита добавления медиа')
-        await msg.answer('⭐ Как вы оцениваете это место? (от 1 до 10)')
-        await state.set_state(EntryState.place_rating)
-    else:
-        await msg.answer('➕ Добавить еще медиа?', reply_markup=kb.media_more_keyboard)
-
-@router.message(EntryState.adding_more_video)
-async def adding_more_video_input(msg: Message, state: FSMContext):
-    if not rate_limiter.is_allowed(msg.from_user.id, "media_upload"):
-        await msg.answer("❌ Слишком много загрузок. Подождите 2 минуты.")
+    media = album_media(album)
+    if not media:
+        await msg.answer(prompt)
         return
 
     data = await state.get_data()
-    place_id = data.get('place_id')
-    session = Session()
-    try:
-        file_id = msg.video.file_id
-        media = Media(place_id=place_id, media_type=MediaTypeEnum.video, file_id=file_id)
-        session.add(media)
-        session.commit()
-        await msg.answer('✅ Видео добавлено.')
-    finally:
-        session.close()
-    if not can_add_media(tg_id=msg.from_user.id, place_id=place_id):
-        await msg.answer('⚠️ Вы достигли лимита добавления медиа')
-        await msg.answer('⭐ Как вы оцениваете это место? (от 1 до 10)')
-        await state.set_state(EntryState.place_rating)
-    else:
-        await msg.answer('➕ Добавить еще медиа?', reply_markup=kb.media_more_keyboard)
+    added, total, limit = await save_media_batch(msg.from_user.id, data.get('place_id'), media)
+    await answer_media_saved(msg, state, media_added_text(added, media), total, limit)
+
+@router.message(EntryState.adding_more_photo)
+async def adding_more_photo_input(msg: Message, state: FSMContext, album: list[Message]):
+    await save_album(msg, state, album, '📸 Отправьте фото:')
+
+@router.message(EntryState.adding_more_video)
+async def adding_more_video_input(msg: Message, state: FSMContext, album: list[Message]):
+    await save_album(msg, state, album, '🎥 Отправьте видео:')
 
 @router.callback_query(F.data == 'add_photo_again')
 async def add_photo_again(callback: CallbackQuery, state: FSMContext):
@@ -3,6 +3,7 @@ from venv import logger
 from aiogram import F, Router
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
+from sqlalchemy import select
 
 from app.travel_session import Session
 from app.travel_states import Menu, TravelState, EntryState
@@ -31,12 +32,11 @@ async def back_to_menu(callback: CallbackQuery, state: FSMContext):
     )
 
 @router.callback_query(F.data == "profile_check")
-async def profile_check(callback: CallbackQuery):
-    session = Session()
-    try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
-    finally:
-        session.close()
+async def profile_check(callback: CallbackQuery, user: User | None):
+    if not user:
+        await callback.message.answer("⛔ Нет такого пользователя", reply_markup=kb.menu_keyboard)
+        return
+
     text = (
         "🗺️ *ПРОФИЛЬ ПУТЕШЕСТВЕННИКА*\n\n"
         f"👤 *Имя:* {user.name}\n"
@@ -48,17 +48,15 @@ async def profile_check(callback: CallbackQuery):
     await callback.message.answer(text, parse_mode="Markdown", reply_markup=kb.back_to_menu_keyboard)
 
 @router.callback_query(F.data == 'continue_travel')
-async def choose_existing_travel(callback: CallbackQuery, state: FSMContext):
+async def choose_existing_travel(callback: CallbackQuery, state: FSMContext, user: User | None):
     await callback.answer()
-    session = Session()
-    user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
     if not user:
         await callback.message.edit_text("⛔ Нет такого пользователя", reply_markup=kb.menu_keyboard)
-        session.close()
         return
 
-    travels = session.query(Travel).filter_by(user_id=user.user_id).all()
-    session.close()
+    session = Session()
+    travels = (await session.scalars(select(Travel).filter_by(user_id=user.user_id))).all()
+    await session.close()
 
     if not travels:
         return await callback.message.edit_text(
@@ -76,26 +74,25 @@ async def choose_existing_travel(callback: CallbackQuery, state: FSMContext):
 
     await callback.message.edit_text('🎒 Выбрать путешествие', reply_markup=travel_kb)
 
-def get_travel(travel_id: int, user_tg_id: int):
+async def get_travel(travel_id: int, user: User | None):
+    if not user:
+        return None
+
     session = Session()
     try:
-        user = session.query(User).filter_by(tg_id=user_tg_id).first()
-        if not user:
-            return None
-
-        travel = session.query(Travel).filter_by(
+        travel = await session.scalar(select(Travel).filter_by(
             travel_id=travel_id,
             user_id=user.user_id
-        ).first()
+        ))
         return travel
     except Exception as e:
         logger.error(f"Security error in get_travel: {e}")
         return None
     finally:
-        session.close()
+        await session.close()
 
 @router.callback_query(F.data.startswith("select_travel:"))
-async def process_selected_travel(callback: CallbackQuery, state: FSMContext):
+async def process_selected_travel(callback: CallbackQuery, state: FSMContext, user: User | None):
     try:
         travel_id = int(callback.data.split(":")[1])
     except (ValueError, IndexError):
@@ -106,22 +103,16 @@ async def process_selected_travel(callback: CallbackQuery, state: FSMContext):
         await callback.answer("❌ Неверный идентификатор")
         return
 
-    travel = get_travel(travel_id, callback.from_user.id)
+    travel = await get_travel(travel_id, user)
     if not travel:
         await callback.answer("❌ Доступ запрещен", show_alert=True)
         return
 
-    session = Session()
-    travel = session.query(Travel).filter_by(travel_id=travel_id).first()
-    session.close()
-
-    if not travel:
-        return await callback.answer('❌ Путешествие не найдено', show_alert=True)
-
     await state.update_data(travel_id=travel_id)
 
     await callback.message.edit_text(
-        f'📍 Добавляем место в путешествие:\n<b>🌍 {travel.country}</b>\n\n🏙️ В каком городе вы находитесь?',
+        f'📍 Добавляем место в путешествие:\n<b>🌍 {travel.country}</b>\n\n🏙️ В каком городе вы находитесь?\n'
+        f'<i>📎 Или отправьте геолокацию - город определится сам</i>',
         parse_mode="HTML"
     )
 
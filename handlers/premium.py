@@ -5,10 +5,11 @@ from aiogram.filters import StateFilter, Command
 from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.enums import ContentType
-from sqlalchemy import func
+from sqlalchemy import func, select
 from bot.config import admin_id, card
 
-from app.travel_session import Session
+from app.travel_session import Session, ReadSession
+from app.travel_cache import user_cache
 from app.travel_states import PremiumPayment
 from app.travel_database import User, Travel, Entry, Media
 import app.traveler_keyboard as kb
@@ -39,47 +40,47 @@ async def send_premium_functions(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "premium_stats")
-async def premium_statistics(callback: CallbackQuery):
+async def premium_statistics(callback: CallbackQuery, user: User | None):
     if not rate_limiter.is_allowed(callback.from_user.id, "stats"):
         await callback.answer("❌ Слишком частые запросы статистики. Подождите 1 минуту.", show_alert=True)
         return
 
-    session = Session()
+    session = ReadSession()
     try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
-        if not user.premium:
+        if not user or not user.premium:
             await callback.answer("❌ Только для премиум пользователей")
             return
 
-        total_travels = session.query(
-            Travel).filter_by(user_id=user.user_id).count()
-        total_places = session.query(Entry).join(Travel).filter(Travel.user_id == user.user_id).count()
-        total_photos = session.query(Media).join(Entry).join(Travel).filter(
+        total_travels = await session.scalar(select(
+            func.count(Travel.travel_id)).filter_by(user_id=user.user_id))
+        total_places = await session.scalar(
+            select(func.count(Entry.place_id)).join(Travel).filter(Travel.user_id == user.user_id))
+        total_photos = await session.scalar(select(func.count(Media.media_id)).join(Entry).join(Travel).filter(
             Travel.user_id == user.user_id,
             Media.media_type == 'photo'
-        ).count()
+        ))
 
-        countries_stats = session.query(
+        countries_stats = (await session.execute(select(
             Travel.country,
             func.count(Travel.travel_id).label('visits')
         ).filter(Travel.user_id == user.user_id).group_by(Travel.country).order_by(
-            func.count(Travel.travel_id).desc()).all()
+            func.count(Travel.travel_id).desc()))).all()
 
-        cities_stats = session.query(
+        cities_stats = (await session.execute(select(
             Entry.city,
             func.count(Entry.place_id).label('visits')
         ).join(Travel).filter(Travel.user_id == user.user_id).group_by(Entry.city).order_by(
-            func.count(Entry.place_id).desc()).limit(10).all()
+            func.count(Entry.place_id).desc()).limit(10))).all()
 
-        avg_travel_rating = session.query(func.avg(Travel.travel_rating)).filter(
+        avg_travel_rating = await session.scalar(select(func.avg(Travel.travel_rating)).filter(
             Travel.user_id == user.user_id,
             Travel.travel_rating.isnot(None)
-        ).scalar() or 0
+        )) or 0
 
-        avg_place_rating = session.query(func.avg(Entry.place_rating)).join(Travel).filter(
+        avg_place_rating = await session.scalar(select(func.avg(Entry.place_rating)).join(Travel).filter(
             Travel.user_id == user.user_id,
             Entry.place_rating.isnot(None)
-        ).scalar() or 0
+        )) or 0
 
         stats_text = (
             "📊 <b>ПРЕМИУМ СТАТИСТИКА</b>\n\n"
@@ -104,27 +105,26 @@ async def premium_statistics(callback: CallbackQuery):
         await callback.message.answer(stats_text, parse_mode="HTML", reply_markup=kb.back_to_menu_keyboard)
 
     finally:
-        session.close()
+        await session.close()
 
 
 @router.callback_query(F.data == "premium_timeline")
-async def premium_timeline(callback: CallbackQuery):
-    session = Session()
+async def premium_timeline(callback: CallbackQuery, user: User | None):
+    session = ReadSession()
     try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
-        if not user.premium:
+        if not user or not user.premium:
             await callback.answer("❌ Только для премиум пользователей")
             return
 
-        travels_by_year = session.query(
+        travels_by_year = (await session.execute(select(
             func.extract('year', Travel.start_date).label('year'),
             func.count(Travel.travel_id).label('count')
-        ).filter(Travel.user_id == user.user_id).group_by('year').order_by('year').all()
+        ).filter(Travel.user_id == user.user_id).group_by('year').order_by('year'))).all()
 
-        travels_by_month = session.query(
+        travels_by_month = (await session.execute(select(
             func.extract('month', Travel.start_date).label('month'),
             func.count(Travel.travel_id).label('count')
-        ).filter(Travel.user_id == user.user_id).group_by('month').order_by('month').all()
+        ).filter(Travel.user_id == user.user_id).group_by('month').order_by('month'))).all()
 
         timeline_text = "📅 <b>ХРОНОЛОГИЯ ПУТЕШЕСТВИЙ</b>\n\n"
 
@@ -143,16 +143,10 @@ async def premium_timeline(callback: CallbackQuery):
         await callback.message.answer(timeline_text, parse_mode="HTML", reply_markup=kb.back_to_menu_keyboard)
 
     finally:
-        session.close()
+        await session.close()
 
 @router.callback_query(F.data == "premium_check")
-async def premium_check(callback: CallbackQuery):
-    session = Session()
-    try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
-    finally:
-        session.close()
-
+async def premium_check(callback: CallbackQuery, user: User | None):
     if user.premium:
         days_left = (user.end_premium - datetime.now()).days
         text = (
@@ -379,7 +373,7 @@ async def activate_premium_admin(message: Message):
         days = int(parts[2])
 
         session = Session()
-        user = session.query(User).filter_by(tg_id=user_id).first()
+        user = await session.scalar(select(User).filter_by(tg_id=user_id))
 
         if not user:
             await message.answer("❌ Пользователь не найден")
@@ -389,9 +383,10 @@ async def activate_premium_admin(message: Message):
         user.premium = True
         user.end_premium = datetime.now() + timedelta(days=days)
 
-        new_achievements = check_achievements(user, session)
+        new_achievements = await check_achievements(user, session)
 
-        session.commit()
+        await session.commit()
+        user_cache.invalidate(user_id)
 
         # Уведомление админа
         await message.answer(
@@ -422,7 +417,7 @@ async def activate_premium_admin(message: Message):
     except Exception as e:
         await message.answer(f"❌ Ошибка: {e}")
     finally:
-        session.close()
+        await session.close()
 
 
 @router.message(StateFilter(PremiumPayment.waiting_for_screenshot))
@@ -3,12 +3,19 @@ from datetime import datetime, timedelta
 from aiogram import F, Router
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
+from sqlalchemy import select
 
 from app.travel_session import Session
-from app.travel_database import User, Travel, Entry, Media
+from app.travel_cache import user_cache
+from app.travel_database import Travel, Entry, MediaTypeEnum, GEOCODE_PENDING
 from app.travel_states import QuickAddState
 from app.travel_utils import rate_limiter, validate_city, validate_place_title, validate_comment, validate_country, \
-    validate_rating, progress_manager, geocoding
+    validate_rating, progress_manager, save_media_batch
+from app.travel_geocode import geocoding, geocoder_available
+from app.travel_geocode_worker import geocode_later
+from app.travel_gazetteer import gazetteer
+from bot.config import geocode_in_background
+from app.travel_album import album_media
 import app.traveler_keyboard as kb
 
 router = Router()
@@ -19,14 +26,40 @@ async def quick_add_start(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text(
         "🚀 <b>Быстрое добавление места</b>\n\n"
         "Эта функция создаст однодневное путешествие и добавит в него место.\n\n"
-        "🌍 <b>В какой стране вы находитесь?</b>",
+        "🌍 <b>В какой стране вы находитесь?</b>\n"
+        "<i>📎 Или отправьте геолокацию - страна и город определятся сами</i>",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="🔙 Отмена", callback_data="back_to_menu")]
         ])
     )
+    await state.update_data(latitude=None, longitude=None)
     await state.set_state(QuickAddState.country)
 
+@router.message(QuickAddState.country, F.location)
+async def quick_add_country_location(message: Message, state: FSMContext):
+    lat, lon = message.location.latitude, message.location.longitude
+    await state.update_data(latitude=lat, longitude=lon)
+
+    place = gazetteer.reverse(lat, lon)
+    if place is None:
+        await message.answer(
+            "📍 Геолокация сохранена, но определить город не удалось.\n\n"
+            "🌍 <b>В какой стране вы находитесь?</b>",
+            parse_mode="HTML"
+        )
+        return
+
+    # Страна и город известны - пропускаем два шага
+    await state.update_data(country=place.country, city=place.city)
+    await message.answer(
+        f"📍 {place.city}, {place.country}\n\n"
+        "📍 <b>Какое место вы хотите добавить?</b>\n"
+        "(Например: Эйфелева башня, Центральный парк, Ресторан 'У озера')",
+        parse_mode="HTML"
+    )
+    await state.set_state(QuickAddState.place_title)
+
 @router.message(QuickAddState.country)
 async def quick_add_country(message: Message, state: FSMContext):
     if not validate_country(message.text):
@@ -79,6 +112,18 @@ async def quick_add_place_comment(message: Message, state: FSMContext):
 
     await state.update_data(place_comment=message.text)
 
+    if (await state.get_data()).get('latitude') is not None:
+        # Координаты пришли геолокацией в начале
+        await show_date_selection(message, state)
+        return
+
+    # При разомкнутом предохранителе Nominatim фон не поможет: сразу кэш/газеттир, иначе ручной ввод
+    if geocode_in_background and geocoder_available():
+        # Координаты найдет фоновый воркер после сохранения места
+        await state.update_data(latitude=None, longitude=None, geocode_pending=True)
+        await show_date_selection(message, state)
+        return
+
     # Начинаем процесс определения координат
     data = await state.get_data()
 
@@ -111,7 +156,7 @@ async def quick_add_place_comment(message: Message, state: FSMContext):
     city = data['city']
     place_title = data['place_title']
 
-    lat, lon = geocoding(country, city, place_title)
+    lat, lon = await geocoding(country, city, place_title)
 
     if lat and lon:
         await progress_manager.update_progress(
@@ -318,7 +363,7 @@ async def process_quick_add_final(callback: CallbackQuery, state: FSMContext, vi
     session = Session()
 
     try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
+        user = await user_cache.resolve(callback.from_user.id)
         if not user:
             await callback.message.answer("❌ Пользователь не найден")
             return
@@ -332,7 +377,7 @@ async def process_quick_add_final(callback: CallbackQuery, state: FSMContext, vi
             travel_comment="Создано через быстрое добавление"
         )
         session.add(travel)
-        session.flush()
+        await session.flush()
 
         # Создаем запись о месте с координатами
         entry = Entry(
@@ -342,20 +387,15 @@ async def process_quick_add_final(callback: CallbackQuery, state: FSMContext, vi
             place_comment=None if data.get("place_comment") == "-" else data.get("place_comment"),
             date=visit_date,
             latitude=data.get("latitude"),
-            longitude=data.get("longitude")
+            longitude=data.get("longitude"),
+            geocode_status=GEOCODE_PENDING if data.get("geocode_pending") else None
         )
         session.add(entry)
-        session.commit()
+        await session.commit()
 
         # Сохраняем place_id в состоянии для добавления медиа
-        await state.update_data(place_id=entry.place_id)
-
-        # Обновляем статистику пользователя
-        user.entries_count = session.query(Entry).join(Travel).filter(
-            Travel.user_id == user.user_id
-        ).count()
+        await state.update_data(place_id=entry.place_id, geocode_pending=False)
 
-        session.commit()
 
         # Формируем сообщение об успехе
         success_text = "✅ <b>Место успешно добавлено!</b>\n\n"
@@ -366,6 +406,8 @@ async def process_quick_add_final(callback: CallbackQuery, state: FSMContext, vi
         if data.get("latitude") and data.get("longitude"):
             success_text += f"📍 Координаты: {data['latitude']:.5f}, {data['longitude']:.5f}\n\n"
             success_text += "🗺️ <i>Место будет отображаться на карте</i>\n\n"
+        elif data.get("geocode_pending"):
+            success_text += "\n"
         else:
             success_text += "\n⚠️ <i>Координаты не добавлены - место не будет отображаться на карте</i>\n\n"
 
@@ -381,13 +423,15 @@ async def process_quick_add_final(callback: CallbackQuery, state: FSMContext, vi
                 [InlineKeyboardButton(text="🏠 Завершить", callback_data="back_to_menu")]
             ])
         )
+        if data.get("geocode_pending"):
+            await geocode_later(callback.message, entry.place_id, data["country"], data["city"], data["place_title"])
 
     except Exception as e:
         await callback.message.answer(f"❌ Ошибка при добавлении места: {str(e)}")
         print(f"Ошибка быстрого добавления: {e}")
-        session.rollback()
+        await session.rollback()
     finally:
-        session.close()
+        await session.close()
 
 
 async def process_quick_add_final_message(message: Message, state: FSMContext, visit_date: datetime):
@@ -395,7 +439,7 @@ async def process_quick_add_final_message(message: Message, state: FSMContext, v
     session = Session()
 
     try:
-        user = session.query(User).filter_by(tg_id=message.from_user.id).first()
+        user = await user_cache.resolve(message.from_user.id)
         if not user:
             await message.answer("❌ Пользователь не найден")
             return
@@ -409,7 +453,7 @@ async def process_quick_add_final_message(message: Message, state: FSMContext, v
             travel_comment="Создано через быстрое добавление"
         )
         session.add(travel)
-        session.flush()
+        await session.flush()
 
         # Создаем запись о месте с координатами
         entry = Entry(
@@ -419,20 +463,15 @@ async def process_quick_add_final_message(message: Message, state: FSMContext, v
             place_comment=None if data.get("place_comment") == "-" else data.get("place_comment"),
             date=visit_date,
             latitude=data.get("latitude"),
-            longitude=data.get("longitude")
+            longitude=data.get("longitude"),
+            geocode_status=GEOCODE_PENDING if data.get("geocode_pending") else None
         )
         session.add(entry)
-        session.commit()
+        await session.commit()
 
         # Сохраняем place_id в состоянии для добавления медиа
-        await state.update_data(place_id=entry.place_id)
+        await state.update_data(place_id=entry.place_id, geocode_pending=False)
 
-        # Обновляем статистику пользователя
-        user.entries_count = session.query(Entry).join(Travel).filter(
-            Travel.user_id == user.user_id
-        ).count()
-
-        session.commit()
 
         # Формируем сообщение об успехе
         success_text = "✅ <b>Место успешно добавлено!</b>\n\n"
@@ -443,6 +482,8 @@ async def process_quick_add_final_message(message: Message, state: FSMContext, v
         if data.get("latitude") and data.get("longitude"):
             success_text += f"📍 Координаты: {data['latitude']:.5f}, {data['longitude']:.5f}\n\n"
             success_text += "🗺️ <i>Место будет отображаться на карте</i>\n\n"
+        elif data.get("geocode_pending"):
+            success_text += "\n"
         else:
             success_text += "\n⚠️ <i>Координаты не добавлены - место не будет отображаться на карте</i>\n\n"
 
@@ -458,13 +499,15 @@ async def process_quick_add_final_message(message: Message, state: FSMContext, v
                 [InlineKeyboardButton(text="🏠 Завершить", callback_data="back_to_menu")]
             ])
         )
+        if data.get("geocode_pending"):
+            await geocode_later(message, entry.place_id, data["country"], data["city"], data["place_title"])
 
     except Exception as e:
         await message.answer(f"❌ Ошибка при добавлении места: {str(e)}")
         print(f"Ошибка быстрого добавления: {e}")
-        session.rollback()
+        await session.rollback()
     finally:
-        session.close()
+        await session.close()
         await state.clear()
 
 
@@ -494,8 +537,23 @@ async def add_video_quick(callback: CallbackQuery, state: FSMContext):
     await state.set_state(QuickAddState.adding_video)
 
 
-@router.message(QuickAddState.adding_photo, F.photo)
-async def handle_quick_photo(message: Message, state: FSMContext):
+def quick_media_text(added: int, media: list) -> str:
+    if added == 0:
+        return "⚠️ Вы достигли лимита добавления медиа"
+    if len(media) == 1:
+        text = "✅ Фото добавлено!" if media[0][0] == MediaTypeEnum.photo else "✅ Видео добавлено!"
+    elif all(media_type == MediaTypeEnum.photo for media_type, _ in media):
+        text = f"✅ Добавлено фото: {added}"
+    else:
+        text = f"✅ Добавлено файлов: {added}"
+    if added < len(media):
+        text += f"\n⚠️ Не сохранено {len(media) - added}: превышен лимит медиа"
+    return text
+
+
+# Альбом может смешивать фото и видео: его первое сообщение любого из типов
+@router.message(QuickAddState.adding_photo, F.photo | F.video)
+async def handle_quick_photo(message: Message, state: FSMContext, album: list[Message]):
     data = await state.get_data()
     place_id = data.get('place_id')
 
@@ -503,15 +561,13 @@ async def handle_quick_photo(message: Message, state: FSMContext):
         await message.answer("❌ Ошибка: не найден идентификатор места")
         return
 
-    session = Session()
     try:
-        file_id = message.photo[-1].file_id
-        media = Media(place_id=place_id, media_type='photo', file_id=file_id)
-        session.add(media)
-        session.commit()
+        media = album_media(album)
+        added, _, _ = await save_media_batch(message.from_user.id, place_id, media)
+        text = quick_media_text(added, media)
 
         await message.answer(
-            "✅ Фото добавлено!\n\n"
+            f"{text}\n\n"
             "Что дальше?",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="📸 Добавить еще фото", callback_data="add_photo_quick")],
@@ -524,12 +580,10 @@ async def handle_quick_photo(message: Message, state: FSMContext):
     except Exception as e:
         await message.answer("❌ Ошибка при добавлении фото")
         print(f"Ошибка добавления фото: {e}")
-    finally:
-        session.close()
 
 
-@router.message(QuickAddState.adding_video, F.video)
-async def handle_quick_video(message: Message, state: FSMContext):
+@router.message(QuickAddState.adding_video, F.video | F.photo)
+async def handle_quick_video(message: Message, state: FSMContext, album: list[Message]):
     data = await state.get_data()
     place_id = data.get('place_id')
 
@@ -537,15 +591,13 @@ async def handle_quick_video(message: Message, state: FSMContext):
         await message.answer("❌ Ошибка: не найден идентификатор места")
         return
 
-    session = Session()
     try:
-        file_id = message.video.file_id
-        media = Media(place_id=place_id, media_type='video', file_id=file_id)
-        session.add(media)
-        session.commit()
+        media = album_media(album)
+        added, _, _ = await save_media_batch(message.from_user.id, place_id, media)
+        text = quick_media_text(added, media)
 
         await message.answer(
-            "✅ Видео добавлено!\n\n"
+            f"{text}\n\n"
             "Что дальше?",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="📸 Добавить фото", callback_data="add_photo_quick")],
@@ -558,8 +610,6 @@ async def handle_quick_video(message: Message, state: FSMContext):
     except Exception as e:
         await message.answer("❌ Ошибка при добавлении видео")
         print(f"Ошибка добавления видео: {e}")
-    finally:
-        session.close()
 
 
 @router.callback_query(F.data == "quick_add_back")
@@ -604,7 +654,7 @@ async def process_quick_add_final_message(message: Message, state: FSMContext, v
     session = Session()
 
     try:
-        user = session.query(User).filter_by(tg_id=message.from_user.id).first()
+        user = await user_cache.resolve(message.from_user.id)
         if not user:
             await message.answer("❌ Пользователь не найден")
             return
@@ -618,7 +668,7 @@ async def process_quick_add_final_message(message: Message, state: FSMContext, v
             travel_comment="Создано через быстрое добавление"
         )
         session.add(travel)
-        session.flush()
+        await session.flush()
 
         # Создаем запись о месте
         entry = Entry(
@@ -629,14 +679,8 @@ async def process_quick_add_final_message(message: Message, state: FSMContext, v
             date=visit_date
         )
         session.add(entry)
-        session.commit()
-
-        # Обновляем статистику пользователя
-        user.entries_count = session.query(Entry).join(Travel).filter(
-            Travel.user_id == user.user_id
-        ).count()
+        await session.commit()
 
-        session.commit()
 
         await message.answer(
             "✅ <b>Место успешно добавлено!</b>\n\n"
@@ -655,9 +699,9 @@ async def process_quick_add_final_message(message: Message, state: FSMContext, v
     except Exception as e:
         await message.answer(f"❌ Ошибка при добавлении места: {str(e)}")
         print(f"Ошибка быстрого добавления: {e}")
-        session.rollback()
+        await session.rollback()
     finally:
-        session.close()
+        await session.close()
         await state.clear()
 
 
@@ -696,10 +740,10 @@ async def handle_quick_rating(message: Message, state: FSMContext):
 
     session = Session()
     try:
-        entry = session.query(Entry).filter_by(place_id=place_id).first()
+        entry = await session.scalar(select(Entry).filter_by(place_id=place_id))
         if entry:
             entry.place_rating = int(message.text)
-            session.commit()
+            await session.commit()
 
             await message.answer(
                 f"✅ Место оценено на {message.text}⭐!\n\n"
@@ -717,5 +761,5 @@ async def handle_quick_rating(message: Message, state: FSMContext):
         await message.answer("❌ Ошибка при оценке места")
         print(f"Ошибка оценки: {e}")
     finally:
-        session.close()
+        await session.close()
     await state.clear()
\ No newline at end of file
@@ -2,6 +2,7 @@ from datetime import datetime, timedelta
 from aiogram import F, Router
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
+from sqlalchemy import select
 
 from app.travel_session import Session
 from app.travel_database import User, UserSettings, Travel, Entry
@@ -11,19 +12,18 @@ import app.traveler_keyboard as kb
 router = Router()
 
 @router.callback_query(F.data == "reminders_settings")
-async def reminders_settings(callback: CallbackQuery):
+async def reminders_settings(callback: CallbackQuery, user: User | None):
     session = Session()
     try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
         if not user:
             await callback.answer("❌ Пользователь не найден")
             return
 
-        settings = session.query(UserSettings).filter_by(user_id=user.user_id).first()
+        settings = await session.scalar(select(UserSettings).filter_by(user_id=user.user_id))
         if not settings:
             settings = UserSettings(user_id=user.user_id)
             session.add(settings)
-            session.commit()
+            await session.commit()
 
         status = "✅ Включены" if settings.reminders_enabled else "❌ Выключены"
         frequency = settings.reminder_frequency
@@ -49,34 +49,33 @@ async def reminders_settings(callback: CallbackQuery):
         await callback.answer("❌ Ошибка загрузки настроек")
         print(f"Ошибка в reminders_settings: {e}")
     finally:
-        session.close()
+        await session.close()
 
 @router.callback_query(F.data == "toggle_reminders")
-async def toggle_reminders(callback: CallbackQuery):
+async def toggle_reminders(callback: CallbackQuery, user: User | None):
     session = Session()
     try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
         if not user:
             await callback.answer("❌ Пользователь не найден")
             return
 
-        settings = session.query(UserSettings).filter_by(user_id=user.user_id).first()
+        settings = await session.scalar(select(UserSettings).filter_by(user_id=user.user_id))
         if not settings:
             settings = UserSettings(user_id=user.user_id)
             session.add(settings)
 
         settings.reminders_enabled = not settings.reminders_enabled
-        session.commit()
+        await session.commit()
 
         status = "включены" if settings.reminders_enabled else "выключены"
         await callback.answer(f"🔔 Напоминания {status}")
-        await reminders_settings(callback)
+        await reminders_settings(callback, user)
 
     except Exception as e:
         await callback.answer("❌ Ошибка изменения настроек")
         print(f"Ошибка в toggle_reminders: {e}")
     finally:
-        session.close()
+        await session.close()
 
 @router.callback_query(F.data == "change_frequency")
 async def change_frequency_menu(callback: CallbackQuery):
@@ -96,7 +95,7 @@ async def change_frequency_menu(callback: CallbackQuery):
     )
 
 @router.callback_query(F.data.startswith("set_frequency:"))
-async def set_frequency(callback: CallbackQuery):
+async def set_frequency(callback: CallbackQuery, user: User | None):
     try:
         frequency = int(callback.data.split(":")[1])
     except ValueError:
@@ -105,36 +104,35 @@ async def set_frequency(callback: CallbackQuery):
 
     session = Session()
     try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
         if not user:
             await callback.answer("❌ Пользователь не найден")
             return
 
-        settings = session.query(UserSettings).filter_by(user_id=user.user_id).first()
+        settings = await session.scalar(select(UserSettings).filter_by(user_id=user.user_id))
         if not settings:
             settings = UserSettings(user_id=user.user_id)
             session.add(settings)
 
         settings.reminder_frequency = frequency
-        session.commit()
+        await session.commit()
 
         await callback.answer(f"✅ Частота установлена: {frequency} дней")
-        await reminders_settings(callback)
+        await reminders_settings(callback, user)
 
     except Exception as e:
         await callback.answer("❌ Ошибка изменения частоты")
         print(f"Ошибка в set_frequency: {e}")
     finally:
-        session.close()
+        await session.close()
 
 async def send_reminders(bot):
     session = Session()
     try:
-        users_with_reminders = session.query(User, UserSettings).join(
+        users_with_reminders = (await session.execute(select(User, UserSettings).join(
             UserSettings, User.user_id == UserSettings.user_id
         ).filter(
             UserSettings.reminders_enabled == True
-        ).all()
+        ))).all()
 
         for user, settings in users_with_reminders:
             if settings.last_reminder_date:
@@ -142,9 +140,9 @@ async def send_reminders(bot):
                 if days_since_last < settings.reminder_frequency:
                     continue
 
-            last_travel = session.query(Travel).filter_by(
+            last_travel = await session.scalar(select(Travel).filter_by(
                 user_id=user.user_id
-            ).order_by(Travel.created_at.desc()).first()
+            ).order_by(Travel.created_at.desc()).limit(1))
 
             if last_travel:
                 days_since_last_travel = (datetime.now() - last_travel.created_at).days
@@ -161,11 +159,11 @@ async def send_reminders(bot):
                             ])
                         )
                         settings.last_reminder_date = datetime.now()
-                        session.commit()
+                        await session.commit()
                     except Exception as e:
                         print(f"Не удалось отправить напоминание пользователю {user.tg_id}: {e}")
 
     except Exception as e:
         print(f"Ошибка в send_reminders: {e}")
     finally:
-        session.close()
\ No newline at end of file
+        await session.close()
\ No newline at end of file
@@ -1,5 +1,6 @@
 from aiogram import F, Router
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from sqlalchemy import select
 
 from app.travel_session import Session
 from app.travel_database import User, Travel, Entry, Media
@@ -8,15 +9,16 @@ import app.traveler_keyboard as kb
 router = Router()
 
 @router.callback_query(F.data == "report")
-async def choose_travel_for_report(callback: CallbackQuery):
+async def choose_travel_for_report(callback: CallbackQuery, user: User | None):
     session = Session()
     try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
         if not user:
             await callback.answer("❌ Пользователь не найден")
             return
 
-        travels = session.query(Travel).filter_by(user_id=user.user_id).order_by(Travel.start_date.desc()).all()
+        travels = (await session.scalars(
+            select(Travel).filter_by(user_id=user.user_id).order_by(Travel.start_date.desc())
+        )).all()
 
         if not travels:
             await callback.message.answer("🚫 У вас нет путешествий для отчета")
@@ -40,7 +42,7 @@ async def choose_travel_for_report(callback: CallbackQuery):
         await callback.answer("❌ Ошибка")
         print(f"Ошибка выбора путешествия: {e}")
     finally:
-        session.close()
+        await session.close()
 
 
 @router.callback_query(F.data.startswith("report_travel:"))
@@ -48,13 +50,13 @@ async def send_travel_report(callback: CallbackQuery):
     session = Session()
     try:
         travel_id = int(callback.data.split(":")[1])
-        travel = session.query(Travel).filter_by(travel_id=travel_id).first()
+        travel = await session.scalar(select(Travel).filter_by(travel_id=travel_id))
 
         if not travel:
             await callback.answer("❌ Путешествие не найдено")
             return
 
-        user = session.query(User).filter_by(user_id=travel.user_id).first()
+        user = await session.scalar(select(User).filter_by(user_id=travel.user_id))
         days = (travel.end_date - travel.start_date).days if travel.start_date and travel.end_date else 0
 
         travel_text = (
@@ -67,7 +69,7 @@ async def send_travel_report(callback: CallbackQuery):
 
         await callback.message.answer(travel_text)
 
-        entries = session.query(Entry).filter_by(travel_id=travel.travel_id).all()
+        entries = (await session.scalars(select(Entry).filter_by(travel_id=travel.travel_id))).all()
 
         if not entries:
             await callback.message.answer("📍 В этом путешествии нет посещенных мест")
@@ -79,10 +81,10 @@ async def send_travel_report(callback: CallbackQuery):
                     f"⭐ Оценка: {entry.place_rating or 'Не оценено'}"
                 )
 
-                photos = session.query(Media).filter_by(
+                photos = (await session.scalars(select(Media).filter_by(
                     place_id=entry.place_id,
                     media_type='photo'
-                ).all()
+                ))).all()
 
                 if photos:
                     media_group = []
@@ -125,4 +127,4 @@ async def send_travel_report(callback: CallbackQuery):
         await callback.answer("❌ Ошибка формирования отчета")
         print(f"Ошибка в отчете: {e}")
     finally:
-        session.close()
\ No newline at end of file
+        await session.close()
\ No newline at end of file
@@ -3,9 +3,9 @@ from datetime import datetime, timedelta
 from aiogram import F, Router
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
-from sqlalchemy import func
+from sqlalchemy import func, select
 
-from app.travel_session import Session
+from app.travel_session import ReadSession
 from app.travel_database import User, Travel, Entry
 from app.travel_utils import rate_limiter
 import app.traveler_keyboard as kb
@@ -32,22 +32,21 @@ async def smart_search_menu(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "search_countries")
-async def search_countries(callback: CallbackQuery):
-    session = Session()
+async def search_countries(callback: CallbackQuery, user: User | None):
+    session = ReadSession()
     try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
         if not user:
             await callback.answer("❌ Пользователь не найден")
             return
 
         # Получаем список стран пользователя
-        countries = session.query(
+        countries = (await session.execute(select(
             Travel.country,
             func.count(Travel.travel_id).label('travel_count'),
             func.count(Entry.place_id).label('places_count')
         ).join(Entry, Travel.travel_id == Entry.travel_id, isouter=True).filter(
             Travel.user_id == user.user_id
-        ).group_by(Travel.country).order_by(Travel.country).all()
+        ).group_by(Travel.country).order_by(Travel.country))).all()
 
         if not countries:
             await callback.message.edit_text(
@@ -81,29 +80,28 @@ async def search_countries(callback: CallbackQuery):
         await callback.answer("❌ Ошибка загрузки стран")
         print(f"Ошибка поиска по странам: {e}")
     finally:
-        session.close()
+        await session.close()
 
 
 @router.callback_query(F.data.startswith("search_country:"))
-async def search_country_places(callback: CallbackQuery):
+async def search_country_places(callback: CallbackQuery, user: User | None):
     try:
         country = callback.data.split(":")[1].replace('_', ' ')
     except ValueError:
         await callback.answer("❌ Ошибка данных")
         return
 
-    session = Session()
+    session = ReadSession()
     try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
         if not user:
             await callback.answer("❌ Пользователь не найден")
             return
 
         # Получаем места в выбранной стране
-        places = session.query(Entry).join(Travel).filter(
+        places = (await session.scalars(select(Entry).join(Travel).filter(
             Travel.user_id == user.user_id,
             Travel.country == country
-        ).order_by(Entry.date.desc()).all()
+        ).order_by(Entry.date.desc()))).all()
 
         text = f"🌍 <b>Места в {country}</b>\n\n"
 
@@ -127,7 +125,7 @@ async def search_country_places(callback: CallbackQuery):
         await callback.answer("❌ Ошибка загрузки мест")
         print(f"Ошибка поиска по стране: {e}")
     finally:
-        session.close()
+        await session.close()
 
 
 @router.callback_query(F.data == "search_by_date")
@@ -149,12 +147,11 @@ async def search_by_date_menu(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("search_date:"))
-async def search_by_date_execute(callback: CallbackQuery):
+async def search_by_date_execute(callback: CallbackQuery, user: User | None):
     period = callback.data.split(":")[1]
 
-    session = Session()
+    session = ReadSession()
     try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
         if not user:
             await callback.answer("❌ Пользователь не найден")
             return
@@ -176,19 +173,19 @@ async def search_by_date_execute(callback: CallbackQuery):
 
         # Ищем места за период
         if period == "all":
-            places = session.query(Entry).join(Travel).filter(
+            places = (await session.scalars(select(Entry).join(Travel).filter(
                 Travel.user_id == user.user_id
-            ).order_by(Entry.date.desc()).all()
+            ).order_by(Entry.date.desc()))).all()
         else:
-            places = session.query(Entry).join(Travel).filter(
+            places = (await session.scalars(select(Entry).join(Travel).filter(
                 Travel.user_id == user.user_id,
                 Entry.date >= start_date
-            ).order_by(Entry.date.desc()).all()
+            ).order_by(Entry.date.desc()))).all()
 
         text = f"📅 <b>Места за {period_text}</b>\n\n"
 
         for i, place in enumerate(places[:20], 1):  # Ограничиваем 20 местами
-            travel = session.query(Travel).filter_by(travel_id=place.travel_id).first()
+            travel = await session.scalar(select(Travel).filter_by(travel_id=place.travel_id))
             rating_text = f" ⭐ {place.place_rating}" if place.place_rating else ""
             text += f"{i}. <b>{place.place_title}</b>\n"
             text += f"   🏙️ {place.city}, 🌍 {travel.country if travel else 'N/A'}{rating_text}\n"
@@ -211,7 +208,7 @@ async def search_by_date_execute(callback: CallbackQuery):
         await callback.answer("❌ Ошибка поиска")
         print(f"Ошибка поиска по дате: {e}")
     finally:
-        session.close()
+        await session.close()
 
 @router.callback_query(F.data == "search_places")
 async def search_places_start(callback: CallbackQuery, state: FSMContext):
@@ -227,7 +224,7 @@ async def search_places_start(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(F.text, F.state == "waiting_place_search")
-async def search_places_execute(message: Message, state: FSMContext):
+async def search_places_execute(message: Message, state: FSMContext, user: User | None):
     if not rate_limiter.is_allowed(message.from_user.id, "search"):
         await message.answer("❌ Слишком много запросов. Подождите немного.")
         return
@@ -237,21 +234,20 @@ async def search_places_execute(message: Message, state: FSMContext):
         await message.answer("❌ Слишком короткий запрос. Введите минимум 2 символа.")
         return
 
-    session = Session()
+    session = ReadSession()
     try:
-        user = session.query(User).filter_by(tg_id=message.from_user.id).first()
         if not user:
             await message.answer("❌ Пользователь не найден")
             return
 
         # Ищем по названию места, городу и комментарию
-        results = session.query(Entry).join(Travel).filter(
+        results = (await session.scalars(select(Entry).join(Travel).filter(
             Travel.user_id == user.user_id
         ).filter(
             (Entry.place_title.ilike(f"%{search_query}%")) |
             (Entry.city.ilike(f"%{search_query}%")) |
             (Entry.place_comment.ilike(f"%{search_query}%"))
-        ).order_by(Entry.date.desc()).limit(20).all()
+        ).order_by(Entry.date.desc()).limit(20))).all()
 
         if not results:
             await message.answer(
@@ -267,7 +263,7 @@ async def search_places_execute(message: Message, state: FSMContext):
         text = f"🔍 <b>Результаты поиска: \"{search_query}\"</b>\n\n"
 
         for i, entry in enumerate(results, 1):
-            travel = session.query(Travel).filter_by(travel_id=entry.travel_id).first()
+            travel = await session.scalar(select(Travel).filter_by(travel_id=entry.travel_id))
             rating_text = f" ⭐ {entry.place_rating}" if entry.place_rating else ""
             text += f"{i}. <b>{entry.place_title}</b>\n"
             text += f"   🏙️ {entry.city}, 🌍 {travel.country if travel else 'N/A'}{rating_text}\n"
@@ -281,24 +277,23 @@ async def search_places_execute(message: Message, state: FSMContext):
         await message.answer(f"❌ Ошибка поиска: {str(e)}")
         print(f"Ошибка поиска: {e}")
     finally:
-        session.close()
+        await session.close()
     await state.clear()
 
 
 @router.callback_query(F.data == "search_top_rated")
-async def search_top_rated(callback: CallbackQuery):
-    session = Session()
+async def search_top_rated(callback: CallbackQuery, user: User | None):
+    session = ReadSession()
     try:
-        user = session.query(User).filter_by(tg_id=callback.from_user.id).first()
         if not user:
             await callback.answer("❌ Пользователь не найден")
             return
 
         # Топ-10 мест по рейтингу
-        top_places = session.query(Entry).join(Travel).filter(
+        top_places = (await session.scalars(select(Entry).join(Travel).filter(
             Travel.user_id == user.user_id,
             Entry.place_rating.isnot(None)
-        ).order_by(Entry.place_rating.desc()).limit(10).all()
+        ).order_by(Entry.place_rating.desc()).limit(10))).all()
 
         if not top_places:
             await callback.message.answer(
@@ -313,7 +308,7 @@ async def search_top_rated(callback: CallbackQuery):
         text = "⭐ <b>Ваши лучшие места</b>\n\n"
 
         for i, place in enumerate(top_places, 1):
-            travel = session.query(Travel).filter_by(travel_id=place.travel_id).first()
+            travel = await session.scalar(select(Travel).filter_by(travel_id=place.travel_id))
             text += f"{i}. <b>{place.place_title}</b> ⭐ {place.place_rating}\n"
             text += f"   🏙️ {place.city}, 🌍 {travel.country if travel else 'N/A'}\n"
             text += f"   📅 {place.date.strftime('%d.%m.%Y')}\n\n"
@@ -324,4 +319,4 @@ async def search_top_rated(callback: CallbackQuery):
         await callback.answer("❌ Ошибка загрузки")
         print(f"Ошибка поиска топовых мест: {e}")
     finally:
-        session.close()
\ No newline at end of file
+        await session.close()
\ No newline at end of file
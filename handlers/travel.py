@@ -3,12 +3,13 @@ from datetime import datetime
 from aiogram import F, Router
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
+from sqlalchemy import select
 
 from app.travel_session import Session
 from app.travel_states import TravelState, TravelFinish, EntryState, Menu
-from app.travel_database import Travel, User, MediaTypeEnum, Entry, Media
+from app.travel_database import Travel, User
 import app.traveler_keyboard as kb
-from app.travel_utils import validate_country, validate_date, check_achievements, validate_rating, date_difference
+from app.travel_utils import validate_country, validate_date, check_achievements, validate_rating
 
 router = Router()
 
@@ -56,15 +57,15 @@ async def end_date_input(msg: Message, state: FSMContext):
         return
 
     try:
-        user = session.query(User).filter_by(tg_id=msg.from_user.id).first()
+        user = await session.scalar(select(User).filter_by(tg_id=msg.from_user.id))
         if not user:
             user = User(
                 tg_id=msg.from_user.id,
                 name=msg.from_user.first_name
             )
             session.add(user)
-            session.commit()
-            session.refresh(user)
+            await session.commit()
+            await session.refresh(user)
         travel = Travel(
             user_id=user.user_id,
             country=data["country"],
@@ -72,10 +73,10 @@ async def end_date_input(msg: Message, state: FSMContext):
             end_date=datetime.strptime(msg.text, "%d.%m.%Y")
         )
         session.add(travel)
-        session.commit()
+        await session.commit()
         await state.update_data(travel_id=travel.travel_id)
     finally:
-        session.close()
+        await session.close()
     await msg.answer('✅ Путешествие создано!\n\nТеперь добавьте первое место!\n🏙️ Какой город вы посещаете?')
     await state.set_state(EntryState.city)
 
@@ -97,42 +98,20 @@ async def travel_rating_input(msg: Message, state: FSMContext):
 
 
 @router.message(TravelFinish.travel_comment)
-async def travel_comment_input(msg: Message, state: FSMContext):
+async def travel_comment_input(msg: Message, state: FSMContext, user: User | None):
     try:
         data = await state.get_data()
         session = Session()
         try:
-            travel = session.query(Travel).filter_by(travel_id=data['travel_id']).first()
+            travel = await session.scalar(select(Travel).filter_by(travel_id=data['travel_id']))
             if travel:
                 travel.travel_rating = data['travel_rating']
                 travel.travel_comment = None if msg.text == '-' else msg.text
 
-            user = session.query(User).filter_by(tg_id=msg.from_user.id).first()
+            await session.commit()
             if user:
-                user.trip_count = session.query(Travel).filter_by(user_id=user.user_id).count()
-
-                user.entries_count = session.query(Entry).join(Travel).filter(
-                    Travel.user_id == user.user_id
-                ).count()
-
-                user.photos_count = session.query(Media).join(Entry).join(Travel).filter(
-                    Travel.user_id == user.user_id,
-                    Media.media_type == MediaTypeEnum.photo
-                ).count()
-                travels = session.query(Travel).filter_by(user_id=user.user_id).all()
-                max_duration = 0
-                for t in travels:
-                    if t.start_date and t.end_date:
-                        duration = date_difference(t.start_date, t.end_date)
-                        if duration > max_duration:
-                            max_duration = duration
-
-                user.longest_trip = max_duration
-
-            session.commit()
-            if user:
-                new_achievements = check_achievements(user, session)
-                session.commit()
+                new_achievements = await check_achievements(user, session)
+                await session.commit()
                 if new_achievements:
                     for ach in new_achievements:
                         await msg.answer(
@@ -141,11 +120,11 @@ async def travel_comment_input(msg: Message, state: FSMContext):
                         )
         except Exception as e:
             print(f"❌ Ошибка в travel_comment_input: {e}")
-            session.rollback()
+            await session.rollback()
             await msg.answer("❌ Ошибка при сохранении путешествия")
             return
         finally:
-            session.close()
+            await session.close()
 
         await msg.answer('Ваше путешествие сохранено!\nСпасибо за использование Travel Bot! 🎉')
         await msg.answer('❓ Что вы хотите сделать дальше?', reply_markup=kb.menu_keyboard)
@@ -0,0 +1,112 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-11-20 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Базы, созданные через create_all, уже содержат таблицы - их пропускаем
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'users' not in existing:
+        op.create_table(
+            'users',
+            sa.Column('user_id', sa.Integer(), primary_key=True),
+            sa.Column('tg_id', sa.BigInteger()),
+            sa.Column('name', sa.String()),
+            sa.Column('created_at', sa.DateTime()),
+            sa.Column('premium', sa.Boolean()),
+            sa.Column('start_premium', sa.DateTime(), nullable=True),
+            sa.Column('end_premium', sa.DateTime(), nullable=True),
+            sa.Column('trip_count', sa.Integer()),
+            sa.Column('entries_count', sa.Integer()),
+            sa.Column('photos_count', sa.Integer()),
+            sa.Column('longest_trip', sa.Integer()),
+        )
+
+    if 'travels' not in existing:
+        op.create_table(
+            'travels',
+            sa.Column('travel_id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.user_id')),
+            sa.Column('status', sa.String(20)),
+            sa.Column('country', sa.String()),
+            sa.Column('start_date', sa.DateTime()),
+            sa.Column('end_date', sa.DateTime()),
+            sa.Column('created_at', sa.DateTime()),
+            sa.Column('travel_comment', sa.String()),
+            sa.Column('travel_rating', sa.Integer()),
+        )
+
+    if 'entries' not in existing:
+        op.create_table(
+            'entries',
+            sa.Column('place_id', sa.Integer(), primary_key=True),
+            sa.Column('travel_id', sa.Integer(), sa.ForeignKey('travels.travel_id')),
+            sa.Column('city', sa.String()),
+            sa.Column('place_title', sa.String()),
+            sa.Column('place_comment', sa.String()),
+            sa.Column('latitude', sa.String()),
+            sa.Column('longitude', sa.String()),
+            sa.Column('date', sa.DateTime()),
+            sa.Column('created_at', sa.DateTime()),
+            sa.Column('place_rating', sa.Integer()),
+        )
+
+    if 'media' not in existing:
+        op.create_table(
+            'media',
+            sa.Column('media_id', sa.Integer(), primary_key=True),
+            sa.Column('place_id', sa.Integer(), sa.ForeignKey('entries.place_id')),
+            sa.Column('media_type', sa.Enum('photo', 'video', 'audio', name='mediatypeenum'), nullable=False),
+            sa.Column('file_id', sa.String()),
+            sa.Column('duration', sa.Integer()),
+            sa.Column('created_at', sa.DateTime()),
+        )
+
+    if 'achievements' not in existing:
+        op.create_table(
+            'achievements',
+            sa.Column('achievement_id', sa.Integer(), primary_key=True),
+            sa.Column('code', sa.String(64), nullable=False),
+            sa.Column('description', sa.String(64), nullable=False),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.user_id')),
+            sa.Column('achievement_name', sa.String()),
+            sa.Column('unlocked_at', sa.DateTime()),
+        )
+
+    if 'achievement_list' not in existing:
+        op.create_table(
+            'achievement_list',
+            sa.Column('code', sa.String(64), primary_key=True),
+            sa.Column('achievement_name', sa.String(64), nullable=False),
+            sa.Column('description', sa.String(128), nullable=False),
+        )
+
+    if 'user_settings' not in existing:
+        op.create_table(
+            'user_settings',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.user_id')),
+            sa.Column('reminders_enabled', sa.Boolean()),
+            sa.Column('reminder_frequency', sa.Integer()),
+            sa.Column('last_reminder_date', sa.DateTime()),
+            sa.Column('created_at', sa.DateTime()),
+        )
+
+
+def downgrade() -> None:
+    for table in ('user_settings', 'achievement_list', 'achievements', 'media', 'entries', 'travels', 'users'):
+        op.drop_table(table)
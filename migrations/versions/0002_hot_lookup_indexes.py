@@ -0,0 +1,36 @@
+"""indexes for hot lookup columns
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-11-20 12:30:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+# Составные индексы покрывают и поиск по первой колонке,
+# поэтому отдельные индексы на travels.user_id и entries.travel_id не нужны
+INDEXES = [
+    ('ix_users_tg_id', 'users', ['tg_id']),
+    ('ix_travels_user_id_start_date', 'travels', ['user_id', 'start_date']),
+    ('ix_entries_travel_id_date', 'entries', ['travel_id', 'date']),
+    ('ix_media_place_id_media_type', 'media', ['place_id', 'media_type']),
+    ('ix_achievements_user_id_code', 'achievements', ['user_id', 'code']),
+    ('ix_user_settings_user_id', 'user_settings', ['user_id']),
+]
+
+
+def upgrade() -> None:
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, if_not_exists=True)
+
+
+def downgrade() -> None:
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
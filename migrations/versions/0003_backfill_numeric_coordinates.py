@@ -0,0 +1,88 @@
+"""backfill numeric coordinates for entries
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-11-21 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+entries = sa.table(
+    'entries',
+    sa.column('place_id', sa.Integer),
+    sa.column('latitude', sa.String),
+    sa.column('longitude', sa.String),
+    sa.column('latitude_num', sa.Float),
+    sa.column('longitude_num', sa.Float),
+)
+
+
+def parse_coordinate(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    columns = {c['name']: c['type'] for c in sa.inspect(bind).get_columns('entries')}
+
+    # Свежая база уже создана с числовыми колонками
+    if isinstance(columns['latitude'], sa.Float):
+        return
+
+    if 'latitude_num' not in columns:
+        with op.batch_alter_table('entries') as batch:
+            batch.add_column(sa.Column('latitude_num', sa.Float(), nullable=True))
+            batch.add_column(sa.Column('longitude_num', sa.Float(), nullable=True))
+
+    update = entries.update().where(entries.c.place_id == sa.bindparam('pid')).values(
+        latitude_num=sa.bindparam('lat'),
+        longitude_num=sa.bindparam('lon'),
+    )
+
+    # Каждая пачка фиксируется сразу: прерванную миграцию можно просто перезапустить,
+    # уже заполненные строки повторно не читаются
+    last_id = 0
+    processed = 0
+    with op.get_context().autocommit_block():
+        while True:
+            rows = bind.execute(
+                sa.select(entries.c.place_id, entries.c.latitude, entries.c.longitude)
+                .where(
+                    entries.c.place_id > last_id,
+                    entries.c.latitude.isnot(None),
+                    entries.c.latitude_num.is_(None),
+                )
+                .order_by(entries.c.place_id)
+                .limit(BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+
+            bind.execute(update, [
+                {'pid': row.place_id, 'lat': parse_coordinate(row.latitude), 'lon': parse_coordinate(row.longitude)}
+                for row in rows
+            ])
+            last_id = rows[-1].place_id
+            processed += len(rows)
+            print(f"📍 Перенесено координат: {processed}")
+
+
+def downgrade() -> None:
+    columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('entries')}
+    if 'latitude_num' in columns:
+        with op.batch_alter_table('entries') as batch:
+            batch.drop_column('latitude_num')
+            batch.drop_column('longitude_num')
@@ -0,0 +1,37 @@
+"""switch entries coordinates to float and add bbox index
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-11-21 10:30:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('entries')}
+
+    if 'latitude_num' in columns:
+        with op.batch_alter_table('entries') as batch:
+            batch.drop_column('latitude')
+            batch.drop_column('longitude')
+            batch.alter_column('latitude_num', new_column_name='latitude')
+            batch.alter_column('longitude_num', new_column_name='longitude')
+
+    op.create_index('ix_entries_latitude_longitude', 'entries', ['latitude', 'longitude'], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_entries_latitude_longitude', table_name='entries', if_exists=True)
+
+    with op.batch_alter_table('entries') as batch:
+        batch.alter_column('latitude', type_=sa.String(), existing_type=sa.Float())
+        batch.alter_column('longitude', type_=sa.String(), existing_type=sa.Float())
@@ -0,0 +1,36 @@
+"""persistent geocode cache
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2025-11-24 11:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if 'geocode_cache' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'geocode_cache',
+            sa.Column('query', sa.String(), primary_key=True),
+            sa.Column('language', sa.String(32), primary_key=True),
+            sa.Column('latitude', sa.Float(), nullable=True),
+            sa.Column('longitude', sa.Float(), nullable=True),
+            sa.Column('created_at', sa.DateTime()),
+            sa.Column('expires_at', sa.DateTime(), nullable=False),
+        )
+
+    op.create_index('ix_geocode_cache_expires_at', 'geocode_cache', ['expires_at'], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_geocode_cache_expires_at', table_name='geocode_cache', if_exists=True)
+    op.drop_table('geocode_cache')
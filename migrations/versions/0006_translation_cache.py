@@ -0,0 +1,31 @@
+"""translation cache
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2025-11-25 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if 'translation_cache' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'translation_cache',
+            sa.Column('source', sa.String(), primary_key=True),
+            sa.Column('target', sa.String(8), primary_key=True),
+            sa.Column('translated', sa.String(), nullable=False),
+            sa.Column('created_at', sa.DateTime()),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('translation_cache')
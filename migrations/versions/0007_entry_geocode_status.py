@@ -0,0 +1,32 @@
+"""geocode status for entries saved before their coordinates
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2025-11-26 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('entries')}
+    if 'geocode_status' not in columns:
+        with op.batch_alter_table('entries') as batch:
+            batch.add_column(sa.Column('geocode_status', sa.String(16), nullable=True))
+
+    op.create_index('ix_entries_geocode_status', 'entries', ['geocode_status'], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_entries_geocode_status', table_name='entries', if_exists=True)
+
+    with op.batch_alter_table('entries') as batch:
+        batch.drop_column('geocode_status')
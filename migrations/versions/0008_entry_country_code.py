@@ -0,0 +1,33 @@
+"""country code for entries resolved from coordinates
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2025-11-27 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Значения заполняет backfill_entry_countries по офлайн-газеттиру
+    columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('entries')}
+    if 'country_code' not in columns:
+        with op.batch_alter_table('entries') as batch:
+            batch.add_column(sa.Column('country_code', sa.String(2), nullable=True))
+
+    op.create_index('ix_entries_country_code', 'entries', ['country_code'], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_entries_country_code', table_name='entries', if_exists=True)
+
+    with op.batch_alter_table('entries') as batch:
+        batch.drop_column('country_code')
@@ -0,0 +1,43 @@
+"""per-user data version and heatmap file_id cache
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2025-11-28 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+
+    columns = {c['name'] for c in inspector.get_columns('users')}
+    if 'data_version' not in columns:
+        with op.batch_alter_table('users') as batch:
+            batch.add_column(sa.Column('data_version', sa.Integer(), nullable=True, server_default='0'))
+
+    if 'heatmap_cache' not in inspector.get_table_names():
+        op.create_table(
+            'heatmap_cache',
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.user_id'), primary_key=True),
+            sa.Column('filter', sa.String(64), primary_key=True),
+            sa.Column('data_version', sa.Integer(), nullable=False),
+            sa.Column('file_id', sa.String(), nullable=False),
+            sa.Column('caption', sa.String()),
+            sa.Column('created_at', sa.DateTime()),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('heatmap_cache')
+
+    with op.batch_alter_table('users') as batch:
+        batch.drop_column('data_version')
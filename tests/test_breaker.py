@@ -0,0 +1,88 @@
+import pytest
+
+import app.travel_breaker as travel_breaker
+from app.travel_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(travel_breaker.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+
+
+def test_opens_after_threshold(breaker):
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.failure(0.1)
+    assert breaker.state == CLOSED
+
+    breaker.failure(0.1)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert not breaker.available()
+
+
+def test_success_resets_failures(breaker):
+    breaker.failure(0.1)
+    breaker.failure(0.1)
+    breaker.success(0.1)
+    breaker.failure(0.1)
+
+    assert breaker.state == CLOSED
+    assert breaker.failures == 1
+
+
+def test_half_open_lets_one_probe(breaker, clock):
+    for _ in range(3):
+        breaker.failure(0.1)
+
+    clock.now += 30
+    assert breaker.available()
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Второй запрос ждет, пока пробный не отчитается
+    assert not breaker.allow()
+    assert not breaker.available()
+
+    breaker.success(0.1)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens(breaker, clock):
+    for _ in range(3):
+        breaker.failure(0.1)
+    clock.now += 30
+    assert breaker.allow()
+
+    breaker.failure(0.1)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    clock.now += 29
+    assert not breaker.allow()
+
+
+def test_stuck_probe_expires(breaker, clock):
+    for _ in range(3):
+        breaker.failure(0.1)
+    clock.now += 30
+    assert breaker.allow()
+
+    # Пробный запрос отменили, и он так и не вызвал success/failure
+    clock.now += 30
+    assert breaker.available()
+    assert breaker.allow()
@@ -0,0 +1,104 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.travel_database import Base, User, Travel, Entry, Media, MediaTypeEnum
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def counters(session, user):
+    session.refresh(user)
+    return user.trip_count, user.entries_count, user.photos_count, user.longest_trip
+
+
+def add_user(session):
+    user = User(tg_id=100, trip_count=0, entries_count=0, photos_count=0, longest_trip=0, data_version=0)
+    session.add(user)
+    session.commit()
+    return user
+
+
+def test_new_rows_bump_counters(session):
+    user = add_user(session)
+    travel = Travel(user_id=user.user_id, start_date=datetime(2024, 5, 1), end_date=datetime(2024, 5, 11))
+    session.add(travel)
+    session.flush()
+    entry = Entry(travel_id=travel.travel_id)
+    session.add(entry)
+    session.flush()
+    session.add_all([
+        Media(place_id=entry.place_id, media_type=MediaTypeEnum.photo, file_id="p1"),
+        Media(place_id=entry.place_id, media_type=MediaTypeEnum.photo, file_id="p2"),
+        Media(place_id=entry.place_id, media_type=MediaTypeEnum.video, file_id="v1"),
+    ])
+    session.commit()
+
+    assert counters(session, user) == (1, 1, 2, 10)
+    assert user.data_version > 0
+
+
+def test_deletes_decrement_counters(session):
+    user = add_user(session)
+    travel = Travel(user_id=user.user_id)
+    session.add(travel)
+    session.flush()
+    entries = [Entry(travel_id=travel.travel_id) for _ in range(3)]
+    session.add_all(entries)
+    session.flush()
+    photo = Media(place_id=entries[0].place_id, media_type=MediaTypeEnum.photo, file_id="p1")
+    session.add(photo)
+    session.commit()
+
+    session.delete(photo)
+    session.delete(entries[1])
+    session.commit()
+
+    assert counters(session, user)[:3] == (1, 2, 0)
+
+
+def test_longest_trip_only_grows(session):
+    user = add_user(session)
+    session.add(Travel(user_id=user.user_id, start_date=datetime(2024, 1, 1), end_date=datetime(2024, 1, 15)))
+    session.commit()
+    session.add(Travel(user_id=user.user_id, start_date=datetime(2024, 2, 1), end_date=datetime(2024, 2, 3)))
+    session.commit()
+
+    assert counters(session, user) == (2, 0, 0, 14)
+
+
+def test_editing_entry_bumps_data_version(session):
+    user = add_user(session)
+    travel = Travel(user_id=user.user_id)
+    session.add(travel)
+    session.flush()
+    entry = Entry(travel_id=travel.travel_id)
+    session.add(entry)
+    session.commit()
+    session.refresh(user)
+    version = user.data_version
+
+    entry.place_title = "Красная площадь"
+    session.commit()
+    session.refresh(user)
+
+    assert user.data_version > version
+    assert user.entries_count == 1
+
+
+def test_rollback_leaves_counters_untouched(session):
+    user = add_user(session)
+    session.add(Travel(user_id=user.user_id))
+    session.flush()
+    session.rollback()
+
+    assert counters(session, user) == (0, 0, 0, 0)
@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import pytest
+
+from app.travel_executor import ProcessExecutor, ExecutorBusy, JobCancelled, JobTimeout
+from app.travel_metrics import metrics
+
+
+def sleep_job(seconds: float):
+    time.sleep(seconds)
+    return seconds
+
+
+def run_with(executor: ProcessExecutor, scenario):
+    async def wrapper():
+        try:
+            return await scenario(executor)
+        finally:
+            await executor.close()
+    return asyncio.run(wrapper())
+
+
+def test_runs_in_process():
+    async def scenario(executor):
+        return await executor.run(sleep_job, 0.01)
+
+    assert run_with(ProcessExecutor(workers=1, preload=()), scenario) == 0.01
+
+
+def test_newer_job_supersedes_queued_one():
+    async def scenario(executor):
+        blocker = asyncio.ensure_future(executor.run(sleep_job, 0.3))
+        await asyncio.sleep(0)
+        old = asyncio.ensure_future(executor.run(sleep_job, 0.01, key="map:1"))
+        await asyncio.sleep(0)
+        new = asyncio.ensure_future(executor.run(sleep_job, 0.02, key="map:1"))
+        return await asyncio.gather(blocker, old, new, return_exceptions=True)
+
+    blocker, old, new = run_with(ProcessExecutor(workers=0), scenario)
+    assert blocker == 0.3
+    assert isinstance(old, JobCancelled)
+    assert new == 0.02
+
+
+def test_newer_job_supersedes_running_one():
+    async def scenario(executor):
+        old = asyncio.ensure_future(executor.run(sleep_job, 0.3, key="export:1"))
+        await asyncio.sleep(0.05)
+        new = asyncio.ensure_future(executor.run(sleep_job, 0.01, key="export:1"))
+        results = await asyncio.gather(old, new, return_exceptions=True)
+        return results, executor.jobs
+
+    (old, new), jobs = run_with(ProcessExecutor(workers=0), scenario)
+    assert isinstance(old, JobCancelled)
+    assert new == 0.01
+    assert not jobs
+
+
+def test_full_queue_rejects():
+    async def scenario(executor):
+        running = asyncio.ensure_future(executor.run(sleep_job, 0.1))
+        await asyncio.sleep(0.02)
+        # Одна задача в работе, две ждут слота - очередь заполнена
+        jobs = [running] + [asyncio.ensure_future(executor.run(sleep_job, 0.1)) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert executor.queued == 2
+        with pytest.raises(ExecutorBusy):
+            await executor.run(sleep_job, 0.1)
+        return await asyncio.gather(*jobs)
+
+    assert run_with(ProcessExecutor(workers=0, queue_size=2), scenario) == [0.1] * 3
+
+
+def test_timeout_restarts_pool_and_spares_other_jobs():
+    async def scenario(executor):
+        await executor.warm()
+        pool = executor.pool
+        healthy = asyncio.ensure_future(executor.run(sleep_job, 1.0))
+        await asyncio.sleep(0.1)
+        with pytest.raises(JobTimeout):
+            await executor.run(sleep_job, 30, timeout=0.3)
+        restarted = executor.pool is not pool
+        return restarted, await healthy, await executor.run(sleep_job, 0.01)
+
+    before = dict(metrics.counters)
+    restarted, healthy, after_restart = run_with(ProcessExecutor(workers=2, preload=()), scenario)
+    assert restarted
+    # Чужая задача пережила перезапуск через повтор, а не была посчитана падением процесса
+    assert healthy == 1.0
+    assert after_restart == 0.01
+    assert metrics.counters["executor.timeouts"] - before.get("executor.timeouts", 0) == 1
+    assert metrics.counters["executor.restart_casualties"] - before.get("executor.restart_casualties", 0) == 1
+    assert metrics.counters["executor.broken"] == before.get("executor.broken", 0)
@@ -0,0 +1,38 @@
+import pytest
+
+from app.travel_gazetteer import Gazetteer
+from bot.config import gazetteer_seed_dir
+
+
+@pytest.fixture(scope="module")
+def gazetteer(tmp_path_factory):
+    # Индекс собирается во временную папку, чтобы не трогать рабочий
+    return Gazetteer(gazetteer_seed_dir, tmp_path_factory.mktemp("gazetteer") / "index")
+
+
+def test_lookup_by_alternate_name(gazetteer):
+    lat, lon = gazetteer.lookup("Москва")
+    assert lat == pytest.approx(55.75, abs=0.01)
+    assert lon == pytest.approx(37.62, abs=0.01)
+
+
+def test_lookup_respects_country(gazetteer):
+    assert gazetteer.lookup("Москва", "Россия") != (None, None)
+    assert gazetteer.lookup("Москва", "Беларусь") == (None, None)
+    assert gazetteer.lookup("Нигдеград") == (None, None)
+
+
+def test_reverse_finds_nearest_city(gazetteer):
+    place = gazetteer.reverse(55.70, 37.50)
+    assert place.country_code == "RU"
+    assert place.city == "Москва"
+    assert place.distance_km < 15
+
+
+def test_reverse_gives_up_far_from_cities(gazetteer):
+    assert gazetteer.reverse(0.0, -150.0) is None
+    assert gazetteer.country_code_at(None, None) is None
+
+
+def test_seed_is_not_full(gazetteer):
+    assert not gazetteer.full
@@ -0,0 +1,83 @@
+import asyncio
+
+from app.travel_nominatim import NominatimScheduler, INTERACTIVE, BACKGROUND
+
+
+class Fetch:
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.calls = []
+
+    async def __call__(self, query, timeout):
+        self.calls.append(query)
+        await asyncio.sleep(self.delay)
+        return f"result:{query}"
+
+
+def test_same_query_coalesces():
+    async def scenario():
+        fetch = Fetch(delay=0.05)
+        scheduler = NominatimScheduler(fetch, interval=0)
+        results = await asyncio.gather(*(scheduler.request("moscow", "Moscow") for _ in range(5)))
+        return fetch.calls, results, scheduler.inflight
+
+    calls, results, inflight = asyncio.run(scenario())
+    assert calls == ["Moscow"]
+    assert results == ["result:Moscow"] * 5
+    assert not inflight
+
+
+def test_interactive_goes_before_background():
+    async def scenario():
+        fetch = Fetch()
+        scheduler = NominatimScheduler(fetch, interval=0.05)
+        first = asyncio.ensure_future(scheduler.request("a", "A", priority=BACKGROUND))
+        await asyncio.sleep(0)
+        background = asyncio.ensure_future(scheduler.request("b", "B", priority=BACKGROUND))
+        interactive = asyncio.ensure_future(scheduler.request("c", "C", priority=INTERACTIVE))
+        await asyncio.gather(first, background, interactive)
+        return fetch.calls
+
+    assert asyncio.run(scenario()) == ["A", "C", "B"]
+
+
+def test_coalesced_request_raises_priority():
+    async def scenario():
+        fetch = Fetch()
+        scheduler = NominatimScheduler(fetch, interval=0.05)
+        first = asyncio.ensure_future(scheduler.request("a", "A"))
+        await asyncio.sleep(0)
+        background = asyncio.ensure_future(scheduler.request("b", "B", priority=BACKGROUND))
+        other = asyncio.ensure_future(scheduler.request("c", "C", priority=BACKGROUND))
+        await asyncio.sleep(0)
+        upgraded = asyncio.ensure_future(scheduler.request("c", "C", priority=INTERACTIVE))
+        await asyncio.gather(first, background, other, upgraded)
+        return fetch.calls
+
+    assert asyncio.run(scenario()) == ["A", "C", "B"]
+
+
+def test_abandoned_job_is_not_sent():
+    async def scenario():
+        fetch = Fetch()
+        scheduler = NominatimScheduler(fetch, interval=0.2)
+        first = asyncio.ensure_future(scheduler.request("a", "A"))
+        await asyncio.sleep(0)
+        # Ждет слот дольше своего дедлайна - в сеть уйти не должен
+        late = await scheduler.request("b", "B", timeout=0.05)
+        await first
+        await asyncio.sleep(0.3)
+        return fetch.calls, late
+
+    calls, late = asyncio.run(scenario())
+    assert calls == ["A"]
+    assert late is None
+
+
+def test_unavailable_dependency_finishes_immediately():
+    async def scenario():
+        fetch = Fetch()
+        scheduler = NominatimScheduler(fetch, interval=0, available=lambda: False)
+        return fetch.calls, await scheduler.request("a", "A", timeout=1)
+
+    assert asyncio.run(scenario()) == ([], None)
@@ -0,0 +1,50 @@
+import pytest
+
+import app.travel_cache as travel_cache
+from app.travel_cache import UserCache
+from app.travel_database import User
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(travel_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_user(user_id: int) -> User:
+    return User(user_id=user_id, tg_id=1000 + user_id)
+
+
+def test_entries_expire(clock):
+    cache = UserCache(maxsize=10, ttl=60)
+    user = make_user(1)
+    cache.put(user)
+    assert cache.get(user.tg_id) is user
+
+    clock[0] += 61
+    assert cache.get(user.tg_id) is None
+    assert not cache.tg_ids
+
+
+def test_least_recently_used_is_evicted(clock):
+    cache = UserCache(maxsize=2, ttl=60)
+    first, second, third = make_user(1), make_user(2), make_user(3)
+    cache.put(first)
+    cache.put(second)
+    cache.get(first.tg_id)
+    cache.put(third)
+
+    assert cache.get(second.tg_id) is None
+    assert cache.get(first.tg_id) is first
+    assert second.user_id not in cache.tg_ids
+
+
+def test_invalidate_by_user_id(clock):
+    cache = UserCache()
+    user = make_user(5)
+    cache.put(user)
+    cache.invalidate_user_ids([5, 6])
+
+    assert cache.get(user.tg_id) is None
+    assert not cache.tg_ids
@@ -1,10 +1,13 @@
 import os
+import hmac
 import logging
 import aiohttp
 import asyncio
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiohttp import web
 from bot.Traveler_bot import bot, dp, setup_bot
+from app.travel_metrics import metrics
+from bot.config import metrics_token
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -35,6 +38,16 @@ async def healthz(request):
     return web.Response(text="OK")
 
 
+async def metrics_handler(request):
+    # Порт вебхука публичный: метрики отдаются только с общим секретом
+    if not metrics_token:
+        raise web.HTTPNotFound()
+    supplied = request.headers.get("X-Metrics-Token") or request.query.get("token") or ""
+    if not hmac.compare_digest(supplied.encode(), metrics_token.encode()):
+        raise web.HTTPUnauthorized()
+    return web.json_response(metrics.snapshot())
+
+
 async def root_handler(request):
     return web.Response(text="Travel Bot is running!")
 
@@ -46,6 +59,7 @@ async def create_app():
     app.router.add_get('/', root_handler)
     app.router.add_get('/healthz', healthz)
     app.router.add_get('/health', healthz)
+    app.router.add_get('/metrics', metrics_handler)
 
     return app
 